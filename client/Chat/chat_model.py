@@ -1,7 +1,8 @@
 
 from __future__ import annotations
 import requests
-from typing import Optional, Tuple, Dict, Any
+import json
+from typing import Optional, Tuple, Dict, Any, Iterator
 import os
 from dotenv import load_dotenv
 load_dotenv()
@@ -16,11 +17,47 @@ class ChatModel:
     def set_api_base_url(self, url: str) -> None:
         self.api_base_url = url
 
-    def chat(self, question: str, confirm_write: bool = False, timeout: int = 30) -> Tuple[bool, str]:
+    def chat(self, question: str, confirm_write: bool = False, timeout: int = 30,
+             confirmation_token: Optional[str] = None, max_rows: Optional[int] = None) -> Tuple[bool, str]:
         payload: Dict[str, Any] = {"question": question, "confirm_write": confirm_write}
+        if confirmation_token:
+            payload["confirmation_token"] = confirmation_token
+        if max_rows:
+            payload["max_rows"] = max_rows
         try:
             resp = requests.post(f"{self.api_base_url}/chat/ask", json=payload, timeout=timeout)
             resp.raise_for_status()
         except requests.HTTPError as e:
             raise requests.HTTPError(f"HTTP error: {e.response.status_code} - {e.response.text}") from e
         return resp.json()
+
+    def chat_stream(self, question: str, timeout: int = 60,
+                    max_rows: Optional[int] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield (event, data) from /chat/ask/stream as the server sends each stage:
+        sql, rows (chunks), token (summary text), then done or error.
+        Servers without the streaming endpoint get a single ("done", <full /chat/ask response>)."""
+        payload: Dict[str, Any] = {"question": question}
+        if max_rows:
+            payload["max_rows"] = max_rows
+        resp = requests.post(f"{self.api_base_url}/chat/ask/stream", json=payload, stream=True, timeout=timeout)
+        if resp.status_code == 404:
+            resp.close()
+            yield "done", self.chat(question, timeout=timeout, max_rows=max_rows)
+            return
+        try:
+            resp.raise_for_status()
+        except requests.HTTPError as e:
+            raise requests.HTTPError(f"HTTP error: {e.response.status_code} - {e.response.text}") from e
+
+        with resp:
+            event, data = "message", []
+            for line in resp.iter_lines(decode_unicode=True):
+                if line is None:
+                    continue
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data.append(line[5:].lstrip())
+                elif not line and data:
+                    yield event, json.loads("\n".join(data))
+                    event, data = "message", []
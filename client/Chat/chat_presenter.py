@@ -2,13 +2,14 @@ from __future__ import annotations
 from typing import Optional
 from .chat_model import ChatModel
 from .chat_view import ChatView
-from thread_manager import run_in_worker
+from thread_manager import run_in_worker, run_on_ui
 
 class ChatPresenter:
     def __init__(self, view: ChatView, model: ChatModel):
         self.view = view
         self.model = model
         self._pending_question: Optional[str] = None  
+        self._pending_token: Optional[str] = None
 
         # Wire UI signal
         self.view.sendRequested.connect(self._on_send_requested)
@@ -19,13 +20,17 @@ class ChatPresenter:
         self.view.appendRequested.emit("You", question)
         self.view.clear_input()
 
-        if self._pending_question and question.strip().lower() in {"yes", "y", "ok"}:
+        # only a token confirms: without one the server would generate (and show) the SQL again
+        if self._pending_question and self._pending_token and question.strip().lower() in {"yes", "y", "ok"}:
             pending = self._pending_question  
+            token = self._pending_token
             self._pending_question = None    
+            self._pending_token = None
 
             @run_in_worker
             def do_confirm():
-                return self.model.chat(pending, confirm_write=True)
+                # the token makes the server run the SQL shown above, without another LLM round
+                return self.model.chat(pending, confirm_write=True, confirmation_token=token)
 
             def done_confirm(data):
                 # אחרי אישור: מציגים רק את ה-message (או ברירת מחדל)
@@ -38,13 +43,19 @@ class ChatPresenter:
             do_confirm(on_result=done_confirm, on_error=on_error_confirm)
             return
 
+        if not self.view.is_streaming():
+            self._ask_streaming(question, max_rows)
+            return
+
+        # another answer is still streaming into the chat; this one arrives whole
         @run_in_worker
         def do():
-            return self.model.chat(question)
+            return self.model.chat(question, max_rows=max_rows)
 
         def done(data):
             if data.get("is_write_query") and not data.get("executed"):
                 self._pending_question = data.get("question")
+                self._pending_token = data.get("confirmation_token")
 
             msg = self.create_message(data)
             self.view.appendRequested.emit("Assistant", msg)
@@ -54,6 +65,78 @@ class ChatPresenter:
 
         do(on_result=done, on_error=on_error)
 
+    def _ask_streaming(self, question: str, max_rows: Optional[int] = None) -> None:
+        """Render the answer stage by stage: SQL, then rows, then the summary as it is written."""
+        state = {"open": True, "sql": False, "rows": 0, "text": False}
+        # the bubble appears right away and fills in as the server gets through each stage
+        self.view.streamStarted.emit("Assistant")
+
+        def finish() -> None:
+            if state["open"]:
+                state["open"] = False
+                self.view.streamFinished.emit()
+
+        def on_event(event: str, data: dict) -> None:
+            if not state["open"]:
+                return
+            if event == "sql":
+                state["sql"] = True
+                lines = [f"🧠 Question: {data.get('question', '')}"]
+                if data.get("is_write_query"):
+                    lines.append(f"\n📄 SQL to be executed:\n{data.get('sql', '')}")
+                else:
+                    lines.append(f"📄 SQL:\n{data.get('sql', '')}")
+                self.view.streamChunk.emit("\n".join(lines))
+            elif event == "rows":
+                if state["rows"] == 0:
+                    self.view.streamChunk.emit("\n\n📊 Results:")
+                lines = []
+                for row in data.get("rows") or []:
+                    state["rows"] += 1
+                    row_str = ", ".join(f"{k}={v}" for k, v in row.items()) if isinstance(row, dict) else str(row)
+                    lines.append(f"\n  {state['rows']}. {row_str}")
+                self.view.streamChunk.emit("".join(lines))
+            elif event == "token":
+                if not state["text"]:
+                    state["text"] = True
+                    self.view.streamChunk.emit("\n\n💬 ")
+                self.view.streamChunk.emit(data.get("text", ""))
+            elif event == "done":
+                if not state["sql"]:
+                    # a server without streaming sent the full /chat/ask response
+                    if data.get("is_write_query") and not data.get("executed"):
+                        self._pending_question = data.get("question")
+                        self._pending_token = data.get("confirmation_token")
+                    self.view.streamChunk.emit(self.create_message(data))
+                elif data.get("executed"):
+                    if data.get("row_count") is not None:
+                        self.view.streamChunk.emit(f"\n\n✅ Query executed. Returned {data['row_count']} rows.")
+                        if data.get("truncated"):
+                            self.view.streamChunk.emit(" More rows matched; ask a narrower question to see them.")
+                    elif data.get("rows_affected") is not None:
+                        self.view.streamChunk.emit(f"\n\n✅ Done. Rows affected: {data['rows_affected']}")
+                else:
+                    self._pending_question = question
+                    self._pending_token = data.get("confirmation_token")
+                    if not state["text"]:
+                        self.view.streamChunk.emit("\n\n⚠️ Confirmation required to execute write query.")
+                finish()
+            elif event == "error":
+                finish()
+                self.view.appendRequested.emit("Error", f"❌ Error: {data.get('status')} - {data.get('detail')}")
+
+        @run_in_worker
+        def do():
+            for event, data in self.model.chat_stream(question, max_rows=max_rows):
+                run_on_ui(lambda e=event, d=data: on_event(e, d))
+
+        def on_error(e: Exception) -> None:
+            finish()
+            self.view.appendRequested.emit("Error", f"❌ Error: {type(e).__name__}: {e}")
+
+        # a stream that ended without `done` still closes its bubble
+        do(on_result=lambda _: finish(), on_error=on_error)
+
     def create_message(self, data: dict) -> str:
         if data.get("is_write_query") and not data.get("executed"):
             msg_lines = [f"🧠 Question: {data.get('question', '')}"]
@@ -80,6 +163,8 @@ class ChatPresenter:
         results = data.get("results") or []
         count = len(results)
         msg_lines.append(f"✅ Query executed. Returned {count} rows.")
+        if data.get("truncated"):
+            msg_lines.append("More rows matched; ask a narrower question to see them.")
         if count > 0:
             msg_lines.append("\n📊 Results:")
             for i, row in enumerate(results, 1):
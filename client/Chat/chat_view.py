@@ -4,7 +4,7 @@ import os, sys
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from typing import Optional
 from PySide6.QtCore import Qt, Signal
-from PySide6.QtGui import QTextCursor
+from PySide6.QtGui import QTextCursor, QTextCharFormat, QColor
 from PySide6.QtWidgets import (
     QWidget, QFrame, QVBoxLayout, QLabel, QTextEdit, QHBoxLayout,
     QLineEdit, QPushButton, QComboBox
@@ -15,6 +15,10 @@ from theme_manager import ThemeManager
 class ChatView(QWidget):
     sendRequested = Signal(str, object, int)  
     appendRequested = Signal(str, str) 
+    # progressive messages: start a bubble, append text to it as it arrives, close it
+    streamStarted = Signal(str)
+    streamChunk = Signal(str)
+    streamFinished = Signal()
 
     def __init__(self, parent=None) -> None:
         super().__init__(parent)
@@ -25,9 +29,14 @@ class ChatView(QWidget):
         
         # Store chat history to refresh on theme changes
         self._chat_history: list = []
+        # (who, text so far) of the message being streamed, if any
+        self._streaming: Optional[list] = None
 
         # Connect appendRequested to actual slot
         self.appendRequested.connect(self._append_chat)
+        self.streamStarted.connect(self._start_stream)
+        self.streamChunk.connect(self._append_stream)
+        self.streamFinished.connect(self._finish_stream)
         
         # Connect to theme changes
         ThemeManager.instance().themeChanged.connect(self._on_theme_changed)
@@ -130,10 +139,61 @@ class ChatView(QWidget):
         self.chat_view.insertPlainText("\n")
         self.chat_view.moveCursor(QTextCursor.End)
 
+    def _start_stream_display(self, who: str) -> None:
+        """Open a message on the display; its text is added by _append_stream_display."""
+        if self.chat_view is None:
+            return
+        colors = self._get_theme_colors()
+        who_color = colors["you"] if who == "You" else colors["assistant"] if who == "Assistant" else colors["error"]
+        cursor = self.chat_view.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        self.chat_view.setTextCursor(cursor)
+        self.chat_view.insertHtml(f"""<span style=\"color:{who_color}; font-weight:600;\">{who}:</span>&nbsp;""")
+
+    def _append_stream_display(self, text: str) -> None:
+        if self.chat_view is None or not text:
+            return
+        fmt = QTextCharFormat()
+        fmt.setForeground(QColor(self._get_theme_colors()["text"]))
+        cursor = self.chat_view.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text, fmt)
+        self.chat_view.setTextCursor(cursor)
+        self.chat_view.ensureCursorVisible()
+
+    def _start_stream(self, who: str) -> None:
+        if self._streaming is not None:
+            self._finish_stream()
+        self._streaming = [who, ""]
+        self._start_stream_display(who)
+
+    def _append_stream(self, text: str) -> None:
+        if self._streaming is None:
+            return
+        self._streaming[1] += text
+        self._append_stream_display(text)
+
+    def _finish_stream(self) -> None:
+        if self._streaming is None:
+            return
+        who, text = self._streaming
+        self._streaming = None
+        self._chat_history.append((who, text))
+        if self.chat_view is not None:
+            self.chat_view.insertPlainText("\n\n")
+            self.chat_view.moveCursor(QTextCursor.End)
+
+    def is_streaming(self) -> bool:
+        return self._streaming is not None
+
     def _append_chat(self, who: str, text: str) -> None:
         """Append a line to the chat view with simple formatting."""
         # Store message in history for theme refresh
         self._chat_history.append((who, text))
+        if self._streaming is not None:
+            # keep the message being streamed last, so its text keeps landing at the end
+            self._refresh_chat_display()
+            return
         
         # Add to display
         self._append_message_to_display(who, text)
@@ -165,6 +225,9 @@ class ChatView(QWidget):
         # Re-add all messages with current theme colors
         for who, text in self._chat_history:
             self._append_message_to_display(who, text)
+        if self._streaming is not None:
+            self._start_stream_display(self._streaming[0])
+            self._append_stream_display(self._streaming[1])
 
     def _on_theme_changed(self, theme: str) -> None:
         """Handle theme changes by refreshing all chat messages with new colors."""
@@ -0,0 +1,60 @@
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+import requests
+
+
+class ETagSession(requests.Session):
+    """requests.Session that revalidates GETs with If-None-Match.
+
+    The server answers 304 (no body, no DB access) when nothing changed; we then
+    hand back the response cached from the previous 200.
+
+    It also echoes the server's latest X-Write-Token on every request, shared by
+    all sessions, so a read right after our own write comes from the primary
+    database rather than a replica that may not have it yet.
+    """
+
+    _write_token: Optional[str] = None
+
+    def __init__(self, max_entries: int = 256) -> None:
+        super().__init__()
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, Optional[str]], requests.Response]" = OrderedDict()
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        headers = dict(headers or {})
+        if ETagSession._write_token:
+            headers["X-Write-Token"] = ETagSession._write_token
+        if method.upper() != "GET":
+            return self._remember_token(super().request(method, url, params=params, headers=headers, **kwargs))
+
+        key = (requests.Request("GET", url, params=params).prepare().url, headers.get("Accept"))
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached is not None:
+            headers["If-None-Match"] = cached.headers["ETag"]
+
+        r = super().request(method, url, params=params, headers=headers, **kwargs)
+
+        if r.status_code == 304 and cached is not None:
+            with self._lock:
+                self._cache.move_to_end(key)
+            return cached
+        if r.ok and r.headers.get("ETag"):
+            r.content  # read the body now; it is replayed on later 304s
+            with self._lock:
+                self._cache[key] = r
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return r
+
+    @staticmethod
+    def _remember_token(r: requests.Response) -> requests.Response:
+        token = r.headers.get("X-Write-Token")
+        if token:
+            ETagSession._write_token = token
+        return r
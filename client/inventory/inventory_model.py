@@ -2,8 +2,9 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Optional, Dict, Any, List
 import os
-import requests
 from dotenv import load_dotenv
+from http_cache import ETagSession
+from wire import accept_header, decode_columns
 load_dotenv()
 
 BASE_URL = os.getenv("URL", "http://localhost:8000")
@@ -28,11 +29,21 @@ class ReadProduct:
             is_on_promotion=bool(j.get("is_on_promotion", j.get("IsOnPromotion", False)))
         )
 
+    @staticmethod
+    def from_columns(cols: Dict[str, List[Any]]) -> List["ReadProduct"]:
+        """Build rows straight from column batches (Arrow/msgpack), no per-row dicts."""
+        if not cols:
+            return []
+        return [
+            ReadProduct(product_id=pid or "", name=name or "", current_price=float(price or 0.0), quantity=int(qty or 0), is_on_promotion=bool(promo))
+            for pid, name, price, qty, promo in zip(cols["product_id"], cols["name"], cols["current_price"], cols["quantity"], cols["is_on_promotion"])
+        ]
+
 
 class InventoryModel:
     def __init__(self, base_url: Optional[str] = None):
         self.base_url = base_url or BASE_URL
-        self.s = requests.Session()
+        self.s = ETagSession()
 
     # ---------- Queries ----------
     def list_products(self, *, query: Optional[str] = None, category: Optional[str] = None, brand: Optional[str] = None,) -> List[Dict[str, Any]]:
@@ -46,6 +57,21 @@ class InventoryModel:
         r.raise_for_status()
         return r.json()
 
+    def list_read_products(self, *, query: Optional[str] = None, category: Optional[str] = None, brand: Optional[str] = None,) -> List[ReadProduct]:
+        """Like list_products, but negotiates a columnar body and returns typed rows."""
+        url = f"{self.base_url}/query/products"
+        params: Dict[str, Any] = {}
+        if query:    params["q"] = query
+        if category: params["category"] = category
+        if brand:    params["brand"] = brand
+
+        r = self.s.get(url, params=params, headers={"Accept": accept_header()}, timeout=30)
+        r.raise_for_status()
+        cols = decode_columns(r)
+        if cols is not None:
+            return ReadProduct.from_columns(cols)
+        return [ReadProduct.from_json(x) for x in r.json()]
+
     def get_product(self, product_id: str) -> Dict[str, Any]:
         url = f"{self.base_url}/query/products/{product_id}"
         r = self.s.get(url, timeout=30)
@@ -60,12 +60,11 @@ class InventoryPresenter:
 
         @run_in_worker
         def task(q, c, b):
-            js = self.m.list_products(
+            data_raw = self.m.list_read_products(
                 query=q,
                 category=c,
                 brand=b,
             )
-            data_raw = [ReadProduct.from_json(x) for x in js]
             rows = [{
                 "Name": p.name or "",
                 "ProductId": p.product_id or "",
@@ -8,11 +8,21 @@ from thread_manager import run_in_worker
 def WakeUpServer():
     import requests
     import os
+    import time
     url = os.getenv("URL", "http://localhost:8000")
-    try:
-        requests.get(url + "/healthz", timeout=5)
-    except Exception:
-        pass
+    # /readyz answers 503 until the server has warmed its DB pool and hot queries
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            r = requests.get(url + "/readyz", timeout=5)
+            if r.status_code == 404:
+                requests.get(url + "/healthz", timeout=5)
+                return
+            if r.ok:
+                return
+        except Exception:
+            pass
+        time.sleep(1)
 
 
 def main():
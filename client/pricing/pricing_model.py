@@ -1,15 +1,16 @@
 from __future__ import annotations
 from typing import Any, Dict, Optional
 import os
-import requests
 from dotenv import load_dotenv
+from http_cache import ETagSession
+from wire import accept_header, decode_columns, rows_from_columns
 load_dotenv()
 
 
 class PricingModel:
     def __init__(self, base_url: Optional[str] = None, timeout: float = 15.0) -> None:
         self.base_url = base_url or os.getenv("URL", "http://localhost:8000")
-        self.session = requests.Session()
+        self.session = ETagSession()
         self.timeout = timeout
 
     def get_product(self, product_id: str) -> Dict[str, Any]:
@@ -83,9 +84,17 @@ class PricingModel:
 
     def get_events(self, product_id: str):
         url = f"{self.base_url}/query/products/{product_id}/events"
-        r = self.session.get(url, timeout=self.timeout)
+        r = self.session.get(url, headers={"Accept": accept_header()}, timeout=self.timeout)
         r.raise_for_status()
-        return r.json()
+        cols = decode_columns(r)
+        if cols is None:
+            return r.json()
+        # columnar bodies flatten `changes` into one column per field; rebuild the JSON shape
+        return [{
+            "event_type": row.pop("event_type"),
+            "occurred_at_utc": row.pop("occurred_at_utc"),
+            "changes": {k: v for k, v in row.items() if v is not None},
+        } for row in rows_from_columns(cols)]
 
     def add_note(self, product_id: str, note: str):
         url = f"{self.base_url}/command/product/{product_id}/add_note"
@@ -93,8 +102,13 @@ class PricingModel:
         r.raise_for_status()
         return r.json()
 
-    def analyze_note(self,  note: str) -> Dict[str, Any]:
+    def analyze_note(self, note: Optional[str], product_id: Optional[str] = None) -> Dict[str, Any]:
+        # with product_id the server answers from the analysis stored when the note was added;
+        # without a note it analyzes the product's saved one
         url = f"{self.base_url}/chat/analyze_note"
-        r = self.session.post(url, params={"note": note}, timeout=self.timeout)
+        params = {"product_id": product_id} if product_id else {}
+        if note:
+            params["note"] = note
+        r = self.session.post(url, params=params, timeout=self.timeout)
         r.raise_for_status()
         return r.json()
@@ -243,9 +243,12 @@ class PricingPresenter:
         if self.v.note_input.text().strip() == "Write a note about this product...":
             self.v.notify("Please enter a note to analyze.", "Error", critical=True)
             return
+        pid = self.current_product_id
+        note = self.v.note_input.text().strip()
+
         @run_in_worker
         def do():
-            return self.m.analyze_note(self.v.note_input.text().strip())
+            return self.m.analyze_note(note or None, pid)
         def done(result):
             data = result
             text = (
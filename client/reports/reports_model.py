@@ -11,6 +11,8 @@ import requests
 import json ,os
 
 from dotenv import load_dotenv
+from http_cache import ETagSession
+from wire import accept_header, decode_rows
 load_dotenv()
 
 
@@ -62,29 +64,29 @@ class ReportsModel:
     def __init__(self, base_url: Optional[str] = None, timeout: float = 15.0) -> None:
         """Initialize reports model with API configuration."""
         self.base_url = base_url or os.getenv("URL", "http://localhost:8000")
-        self.session = requests.Session()
+        self.session = ETagSession()
         self.timeout = timeout
     
     def get_products_profit(self) -> List[Dict[str, Any]]:
         """Fetch products profit data from API."""
         url = f"{self.base_url}/query/products_profit"
-        r = self.session.get(url, timeout=self.timeout)
+        r = self.session.get(url, headers={"Accept": accept_header()}, timeout=self.timeout)
         r.raise_for_status()
-        return r.json()
+        return decode_rows(r)
     
     def get_products_category_value(self) -> List[Dict[str, Any]]:
         """Fetch products category value data from API."""
         url = f"{self.base_url}/query/products_category_value"
-        r = self.session.get(url, timeout=self.timeout)
+        r = self.session.get(url, headers={"Accept": accept_header()}, timeout=self.timeout)
         r.raise_for_status()
-        return r.json()
+        return decode_rows(r)
     
     def get_products_total_profit_per_month(self) -> List[Dict[str, Any]]:
         """Fetch products total profit per month data from API."""
         url = f"{self.base_url}/query/products_total_profit_per_month"
-        r = self.session.get(url, timeout=self.timeout)
+        r = self.session.get(url, headers={"Accept": accept_header()}, timeout=self.timeout)
         r.raise_for_status()
-        return r.json()
+        return decode_rows(r)
     
     def generate_sales_report(self) -> SalesReport:
         """Generate comprehensive sales performance report using real API data."""
@@ -0,0 +1,48 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional
+import requests
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional dependency
+    pa = None
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+ARROW = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/vnd.msgpack"
+
+
+def accept_header() -> str:
+    """Ask for column batches when we can decode them; JSON stays the fallback."""
+    offered = []
+    if pa is not None:
+        offered.append(ARROW)
+    if msgpack is not None:
+        offered.append(MSGPACK)
+    offered.append("application/json;q=0.5")
+    return ", ".join(offered)
+
+
+def decode_columns(r: requests.Response) -> Optional[Dict[str, List[Any]]]:
+    """{column: values} for Arrow/msgpack bodies, None for JSON bodies."""
+    ctype = r.headers.get("Content-Type", "").split(";")[0].strip()
+    if ctype == ARROW and pa is not None:
+        table = pa.ipc.open_stream(r.content).read_all()
+        return {name: table.column(name).to_pylist() for name in table.column_names}
+    if ctype == MSGPACK and msgpack is not None:
+        return msgpack.unpackb(r.content, raw=False)
+    return None
+
+
+def rows_from_columns(columns: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def decode_rows(r: requests.Response) -> List[Dict[str, Any]]:
+    columns = decode_columns(r)
+    return rows_from_columns(columns) if columns is not None else r.json()
@@ -1,11 +1,71 @@
+import asyncio
+import os
+import sys
+from common.startup import startup_report
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from fastapi.responses import  RedirectResponse, Response
+from fastapi.responses import  JSONResponse, RedirectResponse, Response
+startup_report.mark("fastapi")
 from readFrom.read_view import router as read_router
 from writeTo.write_view import router as write_router
 from chat.chat_view import router as chat_router
+from debug.debug_view import router as debug_router
+from jobs.jobs_view import router as jobs_router
+startup_report.mark("routers")
+from common.profiler import ProfilingMiddleware
+from common.tracing import TracingMiddleware
+from common.compression import CompressionMiddleware
+from common.readiness import readiness
+from common.db import all_pools, warm_pools
+from common.consistency import ConsistencyMiddleware
+from common.admission import AdmissionMiddleware, size_threadpool
+from common import shared_cache
+from jobs.job_queue import job_queue
+from readFrom.read_model import ReadModel
+from writeTo.write_model import writeModel
+startup_report.mark("middleware")
 
 
-app = FastAPI(title="SmartMarket API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup_report.mark("server start")
+    startup_report.log()
+    size_threadpool()
+    shared_cache.start()
+    readiness.start()
+    job_queue.start()
+    digest = None
+    if float(os.getenv("NOTE_DIGEST_EVERY_S", "0")) > 0:
+        from chat.note_digest import schedule
+        digest = asyncio.create_task(schedule())
+    yield
+    if digest is not None:
+        digest.cancel()
+    await job_queue.stop()
+    for p in all_pools():
+        p.close_all()
+    # only loaded once a chat endpoint was hit
+    chat_model = sys.modules.get("chat.chat_model")
+    if chat_model is not None:
+        await chat_model.aclose_http()
+
+
+app = FastAPI(title="SmartMarket API", lifespan=lifespan)
+
+# gzip/brotli for large bodies, negotiated via Accept-Encoding
+app.add_middleware(CompressionMiddleware)
+
+# X-Write-Token: read-your-writes when reads go to replicas
+app.add_middleware(ConsistencyMiddleware)
+
+# per-request sampling profiler (admin + X-Profile header only)
+app.add_middleware(ProfilingMiddleware)
+
+# per-lane concurrency limits: sales/purchases before product reads before reports/chat
+app.add_middleware(AdmissionMiddleware)
+
+# root span per request (added last so it wraps everything else)
+app.add_middleware(TracingMiddleware)
 
 # Read side (Queries)
 app.include_router(read_router, prefix="/query", tags=["query"])
@@ -16,11 +76,30 @@ app.include_router(write_router, prefix="/command", tags=["command"])
 # chat
 app.include_router(chat_router, prefix="/chat", tags=["chat"])
 
+# background jobs: submit, poll, long-poll, cancel
+app.include_router(jobs_router, prefix="/jobs", tags=["jobs"])
+
+# diagnostics (admin only)
+app.include_router(debug_router, prefix="/debug", tags=["debug"], include_in_schema=False)
+
+
+# warm-up behind /readyz
+readiness.add_step("pool", warm_pools)
+readiness.add_step("read statements", ReadModel.warm_up)
+readiness.add_step("write statements", writeModel.warm_up)
+
+
+startup_report.mark("app")
+
 
 @app.get("/healthz", include_in_schema=False)
 def healthz():
     return {"status": "ok"}
 
+@app.get("/readyz", include_in_schema=False)
+def readyz():
+    return JSONResponse(readiness.as_dict(), status_code=200 if readiness.ready else 503)
+
 @app.head("/", include_in_schema=False)
 def head_root():
     return Response(status_code=200)
@@ -0,0 +1,79 @@
+"""
+CPU cost of encoding a 10k-row /query/products response, before and after the fast path.
+
+- before: what FastAPI does for `response_model=List[ProductRead]`
+          (pydantic validation + serialization, then stdlib json)
+- after:  common.fast_json.dumps (orjson when installed, else json with pre-built field lists)
+- plus:   gzip / brotli on top of the fast path
+
+Run (from server/):
+    python benchmarks/bench_json.py [rows] [repeats]
+"""
+from __future__ import annotations
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import asyncio
+import gzip
+import json
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+from readFrom.read_model import ProductRead
+from common import fast_json
+from common.compression import brotli
+
+
+def make_rows(n: int) -> List[ProductRead]:
+    base = datetime(2024, 1, 1)
+    return [
+        ProductRead(
+            product_id=f"P{i:06d}", name=f"Fresh Product {i}", current_price=10.5 + i % 50,
+            quantity=i % 300, cost_price=6.25 + i % 40, brand=f"Brand{i % 13}", category=f"Category{i % 9}",
+            is_on_promotion=bool(i % 2), promotion_discount_percent=float(i % 30), note="Customer favorite; sales trending up",
+            updated_at_utc=base + timedelta(minutes=i),
+        )
+        for i in range(n)
+    ]
+
+
+def cpu(fn, repeats: int) -> float:
+    """Best-of-N process CPU time, in milliseconds."""
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.process_time()
+        fn()
+        best = min(best, time.process_time() - t0)
+    return best * 1000
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    rows = make_rows(n)
+    field = create_model_field(name="Response_list_products", type_=List[ProductRead], mode="serialization")
+
+    def fastapi_path() -> bytes:
+        content = asyncio.run(serialize_response(field=field, response_content=rows))
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+    body = fast_json.dumps(rows)
+    results = [
+        ("response_model + json (before)", cpu(fastapi_path, repeats), len(fastapi_path())),
+        (f"fast path ({'orjson' if fast_json.orjson else 'json'})", cpu(lambda: fast_json.dumps(rows), repeats), len(body)),
+        ("fast path + gzip(5)", cpu(lambda: gzip.compress(fast_json.dumps(rows), compresslevel=5), repeats), len(gzip.compress(body, compresslevel=5))),
+    ]
+    if brotli is not None:
+        results.append(("fast path + brotli(4)", cpu(lambda: brotli.compress(fast_json.dumps(rows), quality=4), repeats), len(brotli.compress(body, quality=4))))
+
+    print(f"{n} rows, best of {repeats}")
+    for label, ms, size in results:
+        print(f"  {label:<34} {ms:9.1f} ms CPU   {size / 1024:9.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Train and evaluate the local field classifier (chat.field_classifier) against
+the remote bart-large-mnli labels.
+
+Labels are the (question, remote flags) pairs logged while CLASSIFIER=shadow or
+CLASSIFIER=remote (FIELD_LOG_PATH), or fetched now with --live.
+
+    python benchmarks/field_classifier.py eval  [--labels field_labels.jsonl] [--live questions.txt]
+    python benchmarks/field_classifier.py train [--labels field_labels.jsonl] [--out field_model.json]
+
+`eval` reports, for the lexicon alone, the saved model and a model trained on
+80% of the labels (scored on the other 20%): exact agreement on all 14 flags,
+per-field agreement/precision/recall with the remote model as reference, and
+the local prediction time. `train` fits on all labels and writes the model
+that the server loads from FIELD_MODEL_PATH.
+
+Run from server/.
+"""
+from __future__ import annotations
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from typing import Callable, Dict, List, Tuple
+
+from chat.field_classifier import FIELD_LOG_PATH, FIELD_MODEL_PATH, FieldClassifier, log_label, read_labels
+from chat.chat_schemas import FIELDS
+
+Labels = List[Tuple[str, Dict[str, bool]]]
+
+
+def fetch_live(path: str) -> None:
+    """Label each question in `path` with the remote model and append it to the label log."""
+    from chat.chat_model import aclose_http, chatModel
+
+    local = FieldClassifier.load()
+
+    async def run() -> None:
+        with open(path, encoding="utf-8") as f:
+            questions = [q.strip() for q in f if q.strip()]
+        for i, q in enumerate(questions, 1):
+            log_label(q, await chatModel.classify_remote(q), local.predict(q))
+            print(f"\rlabelled {i}/{len(questions)}", end="", flush=True)
+        print()
+        await aclose_http()
+
+    asyncio.run(run())
+
+
+def score(name: str, predict: Callable[[str], Dict[str, bool]], labels: Labels) -> None:
+    if not labels:
+        print(f"{name}: no labels")
+        return
+    exact = 0
+    tp = {f: 0 for f in FIELDS}
+    fp = dict(tp)
+    fn = dict(tp)
+    agree = dict(tp)
+    times = []
+    for question, remote in labels:
+        start = time.perf_counter()
+        local = predict(question)
+        times.append((time.perf_counter() - start) * 1e6)
+        exact += all(local[f] == bool(remote.get(f)) for f in FIELDS)
+        for f in FIELDS:
+            r, l = bool(remote.get(f)), local[f]
+            agree[f] += r == l
+            tp[f] += r and l
+            fp[f] += l and not r
+            fn[f] += r and not l
+
+    def pct(num: int, den: int) -> str:
+        return f"{num / den:.1%}" if den else "-"
+
+    n = len(labels)
+    print(f"\n{name}: {n} questions, exact agreement {exact / n:.1%}, "
+          f"predict p50 {statistics.median(times):.1f} us, max {max(times):.1f} us")
+    print(f"  {'field':28} {'agree':>7} {'prec':>7} {'recall':>7} {'remote+':>8}")
+    for f in FIELDS:
+        print(f"  {f:28} {pct(agree[f], n):>7} {pct(tp[f], tp[f] + fp[f]):>7} {pct(tp[f], tp[f] + fn[f]):>7} {tp[f] + fn[f]:8d}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["eval", "train"])
+    parser.add_argument("--labels", default=FIELD_LOG_PATH)
+    parser.add_argument("--live", help="file with one question per line to label with the remote model first")
+    parser.add_argument("--out", default=FIELD_MODEL_PATH)
+    parser.add_argument("--epochs", type=int, default=15)
+    args = parser.parse_args()
+
+    if args.live:
+        fetch_live(args.live)
+    labels = read_labels(args.labels)
+    print(f"{len(labels)} labelled questions from {args.labels}")
+
+    if args.command == "train":
+        FieldClassifier.train(labels, epochs=args.epochs).save(args.out)
+        print(f"model written to {args.out}")
+        return
+
+    score("lexicon only", FieldClassifier().predict, labels)
+    saved = FieldClassifier.load(args.out)
+    if saved.weights:
+        score(f"saved model ({args.out}, may have seen these questions)", saved.predict, labels)
+    shuffled = labels[:]
+    random.Random(7).shuffle(shuffled)
+    cut = int(len(shuffled) * 0.8)
+    if 0 < cut < len(shuffled):
+        held_out = FieldClassifier.train(shuffled[:cut], epochs=args.epochs)
+        score("model trained on 80%, scored on held-out 20%", held_out.predict, shuffled[cut:])
+
+
+if __name__ == "__main__":
+    main()
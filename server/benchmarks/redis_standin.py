@@ -0,0 +1,25 @@
+"""
+Local Redis-protocol stand-in for trying the shared cache without a Redis server.
+
+Run (from server/, needs `pip install fakeredis`):
+    python benchmarks/redis_standin.py [port]
+then start each worker with REDIS_URL=redis://127.0.0.1:<port>/0
+"""
+from __future__ import annotations
+import sys
+
+from fakeredis import TcpFakeServer
+
+
+def main() -> None:
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 6379
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    print(f"fake Redis listening on redis://127.0.0.1:{port}/0 (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
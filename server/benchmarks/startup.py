@@ -0,0 +1,76 @@
+"""
+Cold-start benchmark and import audit.
+
+1. Import audit: runs `python -X importtime -c "import app"` and lists the
+   modules with the highest cumulative import time.
+2. Time to first /healthz: starts uvicorn N times and measures, from process
+   spawn, how long until /healthz answers 200 (target: < 300 ms).
+
+Run (from server/):
+    python benchmarks/startup.py [runs] [top]
+"""
+from __future__ import annotations
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+
+import socket
+import statistics
+import subprocess
+import time
+import urllib.request
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_audit(top: int) -> None:
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                          cwd=SERVER_DIR, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [p.strip() for p in line.replace("import time:", "|").split("|")]
+        rows.append((int(cumulative_us), int(self_us), name))
+    total = next((c for c, _, n in rows if n == "app"), 0)
+    print(f"import app: {total / 1000:.1f} ms cumulative")
+    for cumulative, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {cumulative / 1000:8.1f} ms  (self {self_us / 1000:6.1f})  {name}")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_healthz(timeout: float = 20.0) -> float:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/healthz"
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - t0 < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as r:
+                    if r.status == 200:
+                        return (time.perf_counter() - t0) * 1000
+            except OSError:
+                time.sleep(0.005)
+        raise TimeoutError("server did not answer /healthz")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    top = int(sys.argv[2]) if len(sys.argv) > 2 else 15
+    import_audit(top)
+    samples = [time_to_healthz() for _ in range(runs)]
+    print(f"time to first /healthz over {runs} runs: median {statistics.median(samples):.0f} ms, "
+          f"min {min(samples):.0f} ms, max {max(samples):.0f} ms (target < 300 ms)")
+
+
+if __name__ == "__main__":
+    main()
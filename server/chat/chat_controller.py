@@ -1,70 +1,201 @@
-from .chat_model import chatModel, AskResponse, AskRequest
+from .chat_model import chatModel, AskResponse, AskRequest, HF_TOKEN
+from .sentiment import SENTIMENT_FALLBACK, analyze, from_remote
+from .pending_actions import PendingAction, pending_actions
+from .streaming import CHAT_STREAM_ROW_CHUNK, Prefetch
+from .intents import match_intent
+from .note_digest import note_digest
 from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from common.tracing import trace_methods
+import asyncio
+import logging
 import re
+from typing import List, Optional
 
 
 
+log = logging.getLogger("smartmarket.chat")
+
 TWO_WORD_TAG = {"negative": "Not good","neutral":  "Needs check","positive": "All good",}
 
 WRITE_RE = re.compile(r"^(insert|update|delete|merge|alter|drop|truncate|create|exec|grant|revoke)\b", re.I)
 
+@trace_methods
 class chatController:
 
-    def get_sentiment(self,text: str):
-        preds = chatModel.get_sentiment(text)
-        label_map = {"LABEL_0": "negative", "LABEL_1": "neutral", "LABEL_2": "positive"}
-
-        # normalize scores to percentages
-        total = sum(p["score"] for p in preds)
-        scores = {label_map.get(p["label"], p["label"]).lower(): round(p["score"] / total * 100, 2) for p in preds}
-
-        best_label = max(scores, key=scores.get)
-        return best_label, scores
-
-    def analyze_and_respond(self, text: str):
-        polarity, scores = self.get_sentiment(text)
+    async def get_sentiment(self,text: str):
+        local = analyze(text)
+        if local["low_confidence"] and SENTIMENT_FALLBACK and HF_TOKEN:
+            try:
+                return await self._remote_sentiment(text)
+            except Exception as e:
+                log.warning("remote sentiment fallback failed, using the lexicon score: %s", e)
+        return local["label"], local["sentiment_breakdown"]
+
+    def sentiment_batch(self, notes: List[str]) -> List[dict]:
+        # lexicon only: a batch is about throughput, not the odd ambiguous note
+        results = []
+        for note in notes:
+            r = analyze(note)
+            results.append({**r, "tag": TWO_WORD_TAG.get(r["label"], "Needs check")})
+        return results
+
+    def notes_digest(self, min_negative: float, limit: int) -> List[dict]:
+        # precomputed by the note_digest job; this is one read, no model calls
+        return note_digest.digest(min_negative, limit)
+
+    async def _remote_sentiment(self, text: str):
+        return from_remote(await chatModel.get_sentiment(text))
+
+    async def precomputed(self, product_id: Optional[str], text: Optional[str]) -> Optional[dict]:
+        """The analysis stored at write time for the product's note, if it is the note being asked about."""
+        if not product_id:
+            return None
+        stored = await run_in_threadpool(note_digest.stored, product_id)
+        if stored is None or stored["summary"] is None:
+            return None
+        if text is not None and " ".join(text.split()) != " ".join((stored["note"] or "").split()):
+            return None
+        if text is None:
+            # "the product's note": only if no newer note was written since (its note.analyze job may be queued)
+            latest = await run_in_threadpool(note_digest.latest_note, product_id)
+            if latest is None or latest[0] > stored["event_id"]:
+                return None
+        return {"sentiment_breakdown": stored["sentiment_breakdown"], "tag": stored["tag"], "summary": stored["summary"]}
+
+    async def analyze_and_respond(self, text: Optional[str], product_id: Optional[str] = None):
+        found = await self.precomputed(product_id, text)
+        if found is not None:
+            return found
+        if text is None:
+            # nothing stored yet for the product's own note: analyze it now, and keep the result
+            result = await note_digest.analyze_product(product_id) if product_id else None
+            if result is None:
+                raise HTTPException(status_code=404, detail="No note to analyze")
+            if result.get("summary") is None:
+                raise HTTPException(status_code=502, detail="Summary unavailable")
+            return {"sentiment_breakdown": result["sentiment_breakdown"], "tag": result["tag"],
+                    "summary": result["summary"]}
+
+        # the reply is written from the note itself, so both calls go out together
+        (polarity, scores), out = await asyncio.gather(self.get_sentiment(text), chatModel.analyze_and_respond(text))
         tag = TWO_WORD_TAG.get(polarity, "Needs check")
 
-        out = chatModel.analyze_and_respond(text,polarity)
-        
         return {
             "sentiment_breakdown": scores,
             "tag": tag,
             "summary": out,
         }
+
+    async def analyze_and_respond_stream(self, text: Optional[str], product_id: Optional[str] = None):
+        found = await self.precomputed(product_id, text)
+        if found is None and text is None:
+            found = await self.analyze_and_respond(None, product_id)
+        if found is not None:
+            yield "sentiment", {"sentiment_breakdown": found["sentiment_breakdown"], "tag": found["tag"]}
+            yield "token", {"text": found["summary"]}
+            yield "done", found
+            return
+
+        async def sentiment():
+            polarity, scores = await self.get_sentiment(text)
+            yield "sentiment", {"sentiment_breakdown": scores, "tag": TWO_WORD_TAG.get(polarity, "Needs check")}
+
+        async def reply():
+            async for chunk in chatModel.analyze_and_respond_stream(text):
+                yield "token", {"text": chunk}
+
+        result, summary = {}, []
+        async for event, data in Prefetch(sentiment(), reply()):
+            if event == "sentiment":
+                result.update(data)
+            else:
+                summary.append(data["text"])
+            yield event, data
+        yield "done", {**result, "summary": "".join(summary).strip()}
     
-    def classify(self,text: str):
-       return chatModel.classify(text)
+    async def classify(self,text: str):
+       return await chatModel.classify(text)
 
-    def build_sql(self, question: str, field_flags: dict) -> str:
-        return chatModel.build_sql(question, field_flags)
+    async def build_sql(self, question: str, field_flags: dict) -> str:
+        return await chatModel.build_sql(question, field_flags)
 
-    def summarize_action(self, api_response: dict) -> str:
-        return chatModel.summarize_action(api_response)
+    async def summarize_action(self, api_response: dict) -> str:
+        return await chatModel.summarize_action(api_response)
 
     def _is_write_query(self, sql: str) -> bool:
         return bool(WRITE_RE.match(sql.strip()))
 
-    def ask(self, req: AskRequest) -> AskResponse:
-        try:
-            try:
-                flags = self.classify(req.question)
-            except HTTPException as he:
-                raise he
-
-            try:
-                sql = self.build_sql(req.question, flags)
-            except Exception as e:
-                raise RuntimeError(f"SQL generation error: {e}")
-
-            is_write = self._is_write_query(sql)
-
-            
-            return chatModel.execute_sql(sql, req, flags, is_write)
-            
+    @staticmethod
+    def _unconfirmed(req: AskRequest) -> AskRequest:
+        """confirm_write without a confirmation_token confirms nothing: the SQL generated now was never shown."""
+        return req.model_copy(update={"confirm_write": False}) if req.confirm_write else req
+
+    async def ask(self, req: AskRequest) -> AskResponse:
+        if req.confirmation_token:
+            return await self.confirm(req.confirmation_token)
+        req = self._unconfirmed(req)
+        match = match_intent(req.question)
+        if match is not None:
+            resp = await chatModel.answer_intent(match, req)
+            if resp.results or not match.fallback_when_empty:
+                return resp
+        # HTTPExceptions pass through as they are: 422 from chat.sql_guard, 503 without HF_TOKEN,
+        # 504 when a stage or the query times out
+        flags = await self.classify(req.question)
 
-        except HTTPException as e:
-            raise HTTPException(status_code=500, detail=str(e))
+        try:
+            sql = await self.build_sql(req.question, flags)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"SQL generation error: {e}")
+
+        is_write = self._is_write_query(sql)
+
+        resp = await chatModel.execute_sql(sql, req, flags, is_write)
+        if resp.is_write_query and not resp.executed:
+            # Redis or in-memory store; the Redis client is synchronous
+            resp.confirmation_token = await run_in_threadpool(pending_actions.put, PendingAction(req.question, sql, flags))
+        return resp
+
+    async def ask_stream(self, req: AskRequest):
+        if req.confirmation_token:
+            resp = await self.confirm(req.confirmation_token)
+            yield "done", resp.model_dump(exclude={"question", "field_flags", "sql", "is_write_query", "results"})
+            return
+        req = self._unconfirmed(req)
+        match = match_intent(req.question)
+        resp = await chatModel.answer_intent(match, req) if match is not None else None
+        if resp is not None and (resp.results or not match.fallback_when_empty):
+            yield "sql", {"question": resp.question, "field_flags": resp.field_flags, "sql": resp.sql, "is_write_query": False}
+            for offset in range(0, len(resp.results), CHAT_STREAM_ROW_CHUNK):
+                yield "rows", {"offset": offset, "rows": resp.results[offset:offset + CHAT_STREAM_ROW_CHUNK]}
+            yield "token", {"text": resp.message}
+            yield "done", {"executed": True, "rows_affected": None, "row_count": len(resp.results),
+                           "truncated": resp.truncated, "message": resp.message}
+            return
+        flags = await self.classify(req.question)
+        try:
+            sql = await self.build_sql(req.question, flags)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise RuntimeError(f"SQL generation error: {e}")
+        is_write = self._is_write_query(sql)
+        yield "sql", {"question": req.question, "field_flags": flags, "sql": sql, "is_write_query": is_write}
+
+        async for event, data in chatModel.execute_sql_stream(sql, req, flags, is_write):
+            if event == "done" and not data["executed"]:
+                data["confirmation_token"] = await run_in_threadpool(pending_actions.put, PendingAction(req.question, sql, flags))
+            yield event, data
+
+    async def confirm(self, token: str) -> AskResponse:
+        action = await run_in_threadpool(pending_actions.pop, token)
+        if action is None:
+            raise HTTPException(status_code=410, detail="This confirmation has expired or was already used. Please ask again.")
+        req = AskRequest(question=action.question, confirm_write=True)
+        return await chatModel.execute_sql(action.sql, req, action.field_flags, True, summarize=False)
 
 
     #######################################################################
@@ -1,15 +1,27 @@
-import requests,json,os
+import asyncio,json,os,hashlib,logging
+import httpx
+from starlette.concurrency import run_in_threadpool
 from fastapi import HTTPException
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
-from common.db import get_conn
-from pydantic import BaseModel
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+from common.consistency import wants_primary
+from common.db import get_read_conn, get_write_conn
+from common.tracing import span
+from common.versioning import data_versions
+from .chat_schemas import FIELDS, AskRequest, AskResponse
+from .llm_cache import llm_cache, make_key
+from .streaming import CHAT_STREAM_ROW_CHUNK, Prefetch
+from .intents import IntentMatch
+from .field_classifier import CLASSIFIER, field_classifier, log_label
+from .sql_guard import cap_select, clamp_rows, guarded_fetch
+from .snapshot import CHAT_SNAPSHOT, chat_snapshot
 from dotenv import load_dotenv
 load_dotenv()
 
+log = logging.getLogger("smartmarket.chat")
+
+# Checked on first use, not at import: a missing token only disables the chat endpoints.
 HF_TOKEN = os.getenv("HF_TOKEN")
-if not HF_TOKEN:
-    raise SystemExit("Missing HF_TOKEN. Set it with: export HF_TOKEN=hf_xxx")
 
 # for sentiment analysis
 SENTIMENT_API = "https://router.huggingface.co/hf-inference/models/cardiffnlp/twitter-xlm-roberta-base-sentiment"
@@ -33,32 +45,136 @@ GEN_CFG = {"max_tokens": 500, "temperature": 0.2, "top_p": 0.9}
 # for summarizing actions
 HEADERS = {"Authorization": f"Bearer {HF_TOKEN}", "Content-Type": "application/json"}
 
-class AskRequest(BaseModel):
-    question: str
-    confirm_write: bool = False  
+SCHEMA = """
+        TABLE dbo.readProduct(product_id TEXT,name TEXT,current_price FLOAT,cost_price FLOAT,quantity INT,brand TEXT,category TEXT,is_on_promotion BIT,promotion_discount_percent FLOAT,image_url TEXT,note TEXT,inventory_value FLOAT,total_profit FLOAT,updated_at_utc DATETIME)
+        """
+# part of every LLM cache key: a schema change must not replay SQL written for the old one
+SCHEMA_HASH = hashlib.sha256(SCHEMA.encode()).hexdigest()[:16]
+
+# per-stage time budgets (seconds); override with HF_TIMEOUT_<STAGE>, e.g. HF_TIMEOUT_BUILD_SQL=45
+STAGE_TIMEOUTS = {
+    stage: float(os.getenv(f"HF_TIMEOUT_{stage.upper()}", default))
+    for stage, default in {"sentiment": 20, "classify": 20, "analyze": 30, "build_sql": 30, "summarize": 20}.items()
+}
+HF_MAX_CONNECTIONS = int(os.getenv("HF_MAX_CONNECTIONS", "20"))
+
+# keeps shadow-mode remote classifications alive until they finish
+_shadow_tasks: set = set()
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _http() -> httpx.AsyncClient:
+    """One keep-alive pool for every call to the router (per event loop), so TLS is set up once."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = httpx.AsyncClient(limits=httpx.Limits(max_connections=HF_MAX_CONNECTIONS,
+                                                        max_keepalive_connections=HF_MAX_CONNECTIONS,
+                                                        keepalive_expiry=60))
+        _client_loop = loop
+    return _client
+
+async def aclose_http() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def _post(stage: str, url: str, **kwargs) -> httpx.Response:
+    """POST to the Hugging Face router within the stage's time budget, traced as one span per call."""
+    if not HF_TOKEN:
+        raise HTTPException(status_code=503, detail="Missing HF_TOKEN. Set it with: export HF_TOKEN=hf_xxx")
+    budget = STAGE_TIMEOUTS[stage]
+    with span(f"hf.{stage}", **{"http.url": url}) as sp:
+        try:
+            # httpx timeouts are per socket operation; wait_for caps the whole call
+            r = await asyncio.wait_for(
+                _http().post(url, timeout=httpx.Timeout(budget, connect=min(5.0, budget)), **kwargs), budget)
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            raise HTTPException(status_code=504, detail=f"{stage} did not answer within {budget:g}s")
+        sp.set(**{"http.status_code": r.status_code})
+        return r
+
+async def _post_json(stage: str, url: str, payload: Dict[str, Any], headers: Dict[str, str], check: bool = True) -> Any:
+    """POST `payload` and return the decoded JSON; repeated requests are answered from llm_cache."""
+    key = make_key(stage, url, payload, SCHEMA_HASH)
+    # SQLite read + hit-count UPDATE: off the event loop
+    cached = await run_in_threadpool(llm_cache.get, key, stage)
+    if cached is not None:
+        return cached
+    r = await _post(stage, url, headers=headers, json=payload)
+    if check:
+        r.raise_for_status()
+    data = r.json()
+    if r.is_success and not (isinstance(data, dict) and "error" in data):
+        await run_in_threadpool(llm_cache.put, key, stage, payload.get("model"), data)
+    return data
+
+async def _stream_chat(stage: str, url: str, payload: Dict[str, Any], headers: Dict[str, str]) -> AsyncIterator[str]:
+    """Yield a chat completion's text as it is generated (OpenAI-style SSE from the router).
 
-class AskResponse(BaseModel):
-    question: str
-    field_flags: Dict[str, bool]
-    sql: str
-    is_write_query: bool
-    executed: bool
-    rows_affected: Optional[int] = None
-    results: Optional[List[Dict[str, Any]]] = None
-    message: Optional[str] = None  
+    Shares llm_cache entries with `_post_json`: a cached answer comes back as a single chunk,
+    and a completed stream is stored like a non-streamed response.
+    """
+    key = make_key(stage, url, payload, SCHEMA_HASH)
+    cached = await run_in_threadpool(llm_cache.get, key, stage)
+    if cached is not None:
+        yield cached["choices"][0]["message"]["content"].strip()
+        return
+    if not HF_TOKEN:
+        raise HTTPException(status_code=503, detail="Missing HF_TOKEN. Set it with: export HF_TOKEN=hf_xxx")
+    budget = STAGE_TIMEOUTS[stage]
+    deadline = asyncio.get_running_loop().time() + budget
+    parts: List[str] = []
+    with span(f"hf.{stage}", **{"http.url": url, "stream": True}) as sp:
+        try:
+            async with _http().stream("POST", url, headers=headers, json={**payload, "stream": True},
+                                      timeout=httpx.Timeout(budget, connect=min(5.0, budget))) as r:
+                sp.set(**{"http.status_code": r.status_code})
+                r.raise_for_status()
+                async for line in r.aiter_lines():
+                    if asyncio.get_running_loop().time() > deadline:
+                        raise asyncio.TimeoutError
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    choices = json.loads(data).get("choices") or [{}]
+                    text = (choices[0].get("delta") or {}).get("content") or ""
+                    if not parts:
+                        # the non-streamed answer is .strip()ped; match it
+                        text = text.lstrip()
+                    if text:
+                        parts.append(text)
+                        yield text
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            raise HTTPException(status_code=504, detail=f"{stage} did not answer within {budget:g}s")
+    content = "".join(parts).strip()
+    if content:
+        await run_in_threadpool(llm_cache.put, key, stage, payload.get("model"),
+                                {"choices": [{"message": {"role": "assistant", "content": content}}]})
 
 @dataclass
 class chatModel:
     
     @classmethod
-    def get_sentiment(cls, text: str) -> Dict[str, Any]:
+    async def get_sentiment(cls, text: str) -> Dict[str, Any]:
         payload = {"inputs": text, "options": {"wait_for_model": True}}
-        r = requests.post(SENTIMENT_API, headers=INF_HEADERS, json=payload, timeout=60)
-        r.raise_for_status()
-        return r.json()[0]
+        return (await _post_json("sentiment", SENTIMENT_API, payload, INF_HEADERS))[0]
+
+    @classmethod
+    async def get_sentiment_batch(cls, texts: List[str]) -> List[List[Dict[str, Any]]]:
+        """One multi-input inference request; one list of label scores per text, in order."""
+        payload = {"inputs": texts, "options": {"wait_for_model": True}}
+        out = await _post_json("sentiment", SENTIMENT_API, payload, INF_HEADERS)
+        if len(out) != len(texts):
+            raise HTTPException(status_code=502, detail=f"sentiment batch returned {len(out)} results for {len(texts)} texts")
+        return out
     
     @classmethod
-    def analyze_and_respond(cls, text: str , polarity: str) -> str:
+    def _analyze_payload(cls, text: str) -> Dict[str, Any]:
         system_msg = "You are a helpful assistant who writes concise, natural English."
         user_msg = f"""
             You analyze what the seller wrote to himself about the product.
@@ -67,12 +183,11 @@ class chatModel:
             Write it as if you were the seller.
 
             Original note: "{text}"
-            Detected sentiment: {polarity}
 
             Constraints:
             - Be brief (one or two sentences).
             - Sound like the seller writing a note to themselves.
-            - If sentiment is negative, suggest a practical next step.
+            - If the note is negative, suggest a practical next step.
             """
 
         data = {
@@ -85,25 +200,53 @@ class chatModel:
             "temperature": 0.3,
             "top_p": 0.9,
         }
+        return data
 
-        r = requests.post(CHAT_URL, headers=CHAT_HEADERS, json=data, timeout=60)
-        r.raise_for_status()
-        out = r.json()["choices"][0]["message"]["content"].strip()
+    @classmethod
+    async def analyze_and_respond(cls, text: str) -> str:
+        out = (await _post_json("analyze", CHAT_URL, cls._analyze_payload(text), CHAT_HEADERS))["choices"][0]["message"]["content"].strip()
         return out
+
+    @classmethod
+    def analyze_and_respond_stream(cls, text: str) -> AsyncIterator[str]:
+        return _stream_chat("analyze", CHAT_URL, cls._analyze_payload(text), CHAT_HEADERS)
     
 
     @classmethod
-    def classify(cls, text: str) -> Dict[str, float]:
+    async def classify(cls, text: str) -> Dict[str, bool]:
+        if CLASSIFIER == "remote":
+            flags = await cls.classify_remote(text)
+            # a locked file append: off the event loop
+            await run_in_threadpool(log_label, text, flags, field_classifier.predict(text))
+            return flags
+        with span("chat.classify_local"):
+            flags = field_classifier.predict(text)
+        if CLASSIFIER == "shadow":
+            # label for training/evaluation, off the request path
+            task = asyncio.create_task(cls._shadow_classify(text, flags))
+            _shadow_tasks.add(task)
+            task.add_done_callback(_shadow_tasks.discard)
+        return flags
+
+    @classmethod
+    async def _shadow_classify(cls, text: str, local: Dict[str, bool]) -> None:
+        try:
+            await run_in_threadpool(log_label, text, await cls.classify_remote(text), local)
+        except Exception as e:
+            log.debug("shadow classify failed: %s", e)
+
+    @classmethod
+    async def classify_remote(cls, text: str) -> Dict[str, bool]:
+        """Zero-shot field flags from bart-large-mnli on the HF router."""
         data = {
             "inputs": text,
             "parameters": {
-                "candidate_labels": ["product_id","name","current_price","cost_price","quantity","brand","category","is_on_promotion","promotion_discount_percent","image_url","note","inventory_value","total_profit","updated_at_utc"],
+                "candidate_labels": FIELDS,
                 "multi_label": True
             },
             "options": {"wait_for_model": True}
         }
-        response = requests.post(API_URL_FOR_CLASSIFY, headers=HEADERS_FOR_CLASSIFY, json=data)
-        response = response.json()
+        response = await _post_json("classify", API_URL_FOR_CLASSIFY, data, HEADERS_FOR_CLASSIFY, check=False)
         if "error" in response:
             raise HTTPException(status_code=500, detail=f"Classification API error: {response['error']}")
         response = {item["label"]: item["score"] for item in response}
@@ -111,16 +254,12 @@ class chatModel:
         return response
     
     @classmethod
-    def build_sql(cls,question: str, field_flags: dict) -> str:
-        schema = """
-        TABLE dbo.readProduct(product_id TEXT,name TEXT,current_price FLOAT,cost_price FLOAT,quantity INT,brand TEXT,category TEXT,is_on_promotion BIT,promotion_discount_percent FLOAT,image_url TEXT,note TEXT,inventory_value FLOAT,total_profit FLOAT,updated_at_utc DATETIME)
-        """
-
+    async def build_sql(cls,question: str, field_flags: dict) -> str:
         prompt = f"""
         You are an expert Text-to-SQL generator. Return **only** valid SQL Server (T-SQL) code without any quotation marks before or after  — no explanations.
 
         [SCHEMA]
-        {schema}
+        {SCHEMA}
 
         [QUESTION]
         {question}
@@ -138,13 +277,13 @@ class chatModel:
             **GEN_CFG,
         }
 
-        r = requests.post(HF_CHAT_API_URL, headers=HEADERS_FOR_CHAT, json=payload, timeout=60)
-        r.raise_for_status()
-        return r.json()["choices"][0]["message"]["content"].strip()
+        return (await _post_json("build_sql", HF_CHAT_API_URL, payload, HEADERS_FOR_CHAT))["choices"][0]["message"]["content"].strip()
 
 
     @classmethod
-    def summarize_action(cls, api_response: dict) -> str:
+    def _summarize_payload(cls, api_response: dict) -> Dict[str, Any]:
+        # the question is embedded as a JSON string; tidy it so the cache key ignores stray spaces
+        api_response = {**api_response, "question": " ".join(str(api_response.get("question", "")).split())}
         prompt = f"""
     You are an assistant that summarizes SQL actions in natural English.
 
@@ -177,14 +316,18 @@ class chatModel:
             "messages": [{"role": "user", "content": prompt}],
             **GEN_CFG,
         }
-        r = requests.post(HF_CHAT_API_URL, headers=HEADERS, json=payload, timeout=60)
-        r.raise_for_status()
-        return r.json()["choices"][0]["message"]["content"].strip()
+        return payload
+
+    @classmethod
+    async def summarize_action(cls, api_response: dict) -> str:
+        return (await _post_json("summarize", HF_CHAT_API_URL, cls._summarize_payload(api_response), HEADERS))["choices"][0]["message"]["content"].strip()
+
+    @classmethod
+    def summarize_action_stream(cls, api_response: dict) -> AsyncIterator[str]:
+        return _stream_chat("summarize", HF_CHAT_API_URL, cls._summarize_payload(api_response), HEADERS)
 
     @classmethod
-    def _fetch_all_dict(cls,cur) -> List[Dict[str, Any]]:
-        cols = [c[0] for c in cur.description]
-        rows = cur.fetchall()
+    def _fetch_all_dict(cls, cols: List[str], rows: Sequence[Any]) -> List[Dict[str, Any]]:
         out = []
         for r in rows:
             if isinstance(r, dict):
@@ -194,8 +337,48 @@ class chatModel:
         return out
 
     @classmethod
-    def execute_sql(cls, sql: str, req, flags: Dict[str, bool], is_write: bool) -> Dict[str, Any]:
-       
+    def _run_sql(cls, sql: str, is_write: bool, params: Sequence[Any] = (), max_rows: Optional[int] = None,
+                 check_cost: bool = True):
+        """(rows, None, truncated) for a SELECT, (None, rowcount, False) for a write.
+
+        Reads run under the chat statement timeout and return at most max_rows rows (chat.sql_guard).
+        """
+        limit = clamp_rows(max_rows)
+        if not is_write and CHAT_SNAPSHOT and not wants_primary():
+            # the local copy first (chat.snapshot); None when only the server can answer it.
+            # A caller that just wrote reads the primary: the copy may not have its write yet.
+            fetched = chat_snapshot.query(sql, params, limit)
+            if fetched is not None:
+                rows, cols, truncated = fetched
+                return cls._fetch_all_dict(cols, rows), None, truncated
+        if not is_write:
+            # chat SELECTs go to a replica so ad-hoc analytics don't compete with checkout writes
+            with get_read_conn(label="chat") as conn:
+                with conn.cursor() as cur:
+                    rows, cols, truncated = guarded_fetch(conn, cur, sql, params, limit, check_cost)
+                    return cls._fetch_all_dict(cols, rows), None, truncated
+        with get_write_conn(label="chat") as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, *params)
+                if cur.description:
+                    # e.g. an OUTPUT clause
+                    rows = cur.fetchmany(limit + 1)
+                    return cls._fetch_all_dict([c[0] for c in cur.description], rows[:limit]), None, len(rows) > limit
+                try:
+                    conn.commit()
+                except Exception:
+                    pass
+                # free-form SQL: we can't tell which read scopes it touched
+                data_versions.bump_all()
+                return None, getattr(cur, "rowcount", None), False
+
+    @classmethod
+    async def execute_sql(cls, sql: str, req, flags: Dict[str, bool], is_write: bool, summarize: bool = True) -> AskResponse:
+        if not is_write:
+            # row cap and single-statement check before anything runs (chat.sql_guard)
+            sql = cap_select(sql, clamp_rows(req.max_rows))
+        action = {"question": req.question, "sql": sql, "is_write_query": bool(is_write)}
+
         if is_write and not req.confirm_write:
                 return AskResponse(
                     question=req.question,
@@ -203,56 +386,73 @@ class chatModel:
                     sql=sql,
                     is_write_query=True,
                     executed=False,
-                    message=cls.summarize_action({
-                            "question": req.question,
-                            "sql": sql,
-                            "is_write_query": bool(is_write),
-                            "executed": False,
-                        })
+                    message=await cls.summarize_action({**action, "executed": False})
                 )
 
-        with get_conn() as conn:
-                with conn.cursor() as cur:
-                    cur.execute(sql)
-                    if cur.description:
-                        results = cls._fetch_all_dict(cur)
-                        message = cls.summarize_action({
-                            "question": req.question,
-                            "sql": sql,
-                            "is_write_query": bool(is_write),
-                            "executed": True,
-                        })
-                        return AskResponse(
-                            question=req.question,
-                            field_flags=flags,
-                            sql=sql,
-                            is_write_query=is_write,
-                            executed=True,
-                            results=results,
-                            message=message,
-                        )
-                    else:
-                        try:
-                            conn.commit()
-                        except Exception:
-                            pass
-                        affected = getattr(cur, "rowcount", None)
-                        return AskResponse(
-                            question=req.question,
-                            field_flags=flags,
-                            sql=sql,
-                            is_write_query=is_write,
-                            executed=True,
-                            rows_affected=affected,
-                            message=cls.summarize_action({
-                                "question": req.question,
-                                "sql": sql,
-                                "is_write_query": bool(is_write),
-                                "executed": True,
-                            })
-                        )
-                
-        
-
+        # the summary only needs the question and the SQL, so it is generated while the SQL runs
+        summary = asyncio.create_task(cls.summarize_action({**action, "executed": True})) if summarize else None
+        try:
+            results, affected, truncated = await run_in_threadpool(cls._run_sql, sql, is_write, (), req.max_rows)
+        except BaseException:
+            if summary is not None:
+                summary.cancel()
+            raise
+        return AskResponse(
+            question=req.question,
+            field_flags=flags,
+            sql=sql,
+            is_write_query=is_write,
+            executed=True,
+            results=results,
+            rows_affected=affected,
+            truncated=truncated,
+            message=await summary if summary is not None else None,
+        )
 
+    @classmethod
+    async def execute_sql_stream(cls, sql: str, req, flags: Dict[str, bool], is_write: bool) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """execute_sql as stream events: rows in chunks, then the summary token by token, then `done`."""
+        if not is_write:
+            sql = cap_select(sql, clamp_rows(req.max_rows))
+        action = {"question": req.question, "sql": sql, "is_write_query": bool(is_write)}
+        executed = not is_write or req.confirm_write
+        # generated while the SQL runs, sent once the rows are out
+        summary = Prefetch(cls.summarize_action_stream({**action, "executed": executed}))
+        results = affected = None
+        truncated = False
+        try:
+            if executed:
+                results, affected, truncated = await run_in_threadpool(cls._run_sql, sql, is_write, (), req.max_rows)
+                for offset in range(0, len(results or ()), CHAT_STREAM_ROW_CHUNK):
+                    yield "rows", {"offset": offset, "rows": results[offset:offset + CHAT_STREAM_ROW_CHUNK]}
+            message = []
+            async for text in summary:
+                message.append(text)
+                yield "token", {"text": text}
+        finally:
+            summary.cancel()
+        yield "done", {
+            "executed": executed,
+            "rows_affected": affected,
+            "row_count": len(results) if results is not None else None,
+            "truncated": truncated,
+            "message": "".join(message).strip(),
+        }
 
+    @classmethod
+    async def answer_intent(cls, match: IntentMatch, req) -> AskResponse:
+        """Run a fast-path template (chat.intents): no LLM call, the message comes with the template."""
+        with span("chat.intent", intent=match.intent):
+            # trusted templates: capped and timed like any chat read, but no plan check
+            results, _, truncated = await run_in_threadpool(cls._run_sql, match.sql, False, match.params,
+                                                            req.max_rows, False)
+        return AskResponse(
+            question=req.question,
+            field_flags=match.field_flags,
+            sql=match.display_sql,
+            is_write_query=False,
+            executed=True,
+            results=results,
+            truncated=truncated,
+            message=match.message,
+        )
@@ -0,0 +1,43 @@
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, Field
+
+# the columns of dbo.readProduct, in order: the keys of every field_flags dict
+FIELDS = ["product_id", "name", "current_price", "cost_price", "quantity", "brand", "category", "is_on_promotion",
+          "promotion_discount_percent", "image_url", "note", "inventory_value", "total_profit", "updated_at_utc"]
+
+class AskRequest(BaseModel):
+    question: str
+    confirm_write: bool = False  
+    # from a previous AskResponse: run that exact pending write instead of asking the LLM again
+    confirmation_token: Optional[str] = None
+    # most rows to return; the server caps it at CHAT_MAX_ROWS (chat.sql_guard)
+    max_rows: Optional[int] = Field(None, ge=1)
+
+class AskResponse(BaseModel):
+    question: str
+    field_flags: Dict[str, bool]
+    sql: str
+    is_write_query: bool
+    executed: bool
+    rows_affected: Optional[int] = None
+    results: Optional[List[Dict[str, Any]]] = None
+    # more rows matched than were returned
+    truncated: bool = False
+    message: Optional[str] = None  
+    confirmation_token: Optional[str] = None
+
+
+SENTIMENT_BATCH_MAX = 10000
+
+class SentimentBatchRequest(BaseModel):
+    notes: List[str] = Field(max_length=SENTIMENT_BATCH_MAX)
+
+class SentimentResult(BaseModel):
+    sentiment_breakdown: Dict[str, float]
+    tag: str
+    label: str
+    confidence: float
+    low_confidence: bool
+
+class SentimentBatchResponse(BaseModel):
+    results: List[SentimentResult]
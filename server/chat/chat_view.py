@@ -1,22 +1,65 @@
-from fastapi import APIRouter, HTTPException
-from .chat_controller import chatController, AskRequest, AskResponse
+from functools import lru_cache
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from .chat_schemas import AskRequest, AskResponse, SentimentBatchRequest, SentimentBatchResponse
 
 router = APIRouter()
-controller = chatController()
 
 
+@lru_cache(maxsize=1)
+def get_controller():
+    # The chat stack (httpx, HF config) is only imported on the first chat call,
+    # so it costs nothing on a cold start that just answers /healthz.
+    from .chat_controller import chatController
+    return chatController()
+
+
+# with product_id, the analysis stored when the note was written is returned if it is for this note
 @router.post("/analyze_note")
-def analyze_note(note: str):
+async def analyze_note(note: Optional[str] = None, product_id: Optional[str] = None):
+    if note is None and product_id is None:
+        raise HTTPException(status_code=422, detail="note or product_id is required")
     try:
-        result = controller.analyze_and_respond(note)
+        result = await get_controller().analyze_and_respond(note, product_id)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
+@router.post("/sentiment/batch", response_model=SentimentBatchResponse)
+def sentiment_batch(request: SentimentBatchRequest):
+    # in-process lexicon scoring, no remote calls (chat.sentiment)
+    return {"results": get_controller().sentiment_batch(request.notes)}
+
+@router.get("/notes/digest")
+def notes_digest(min_negative: float = Query(50.0, ge=0, le=100), limit: int = Query(50, ge=1, le=500)):
+    # most worrying notes first, as stored by the last note_digest run
+    return {"results": get_controller().notes_digest(min_negative, limit)}
+
 @router.post("/ask", response_model=AskResponse)
-def ask_question(request: AskRequest):
+async def ask_question(request: AskRequest):
     try:
-        result = controller.ask(request)
+        result = await get_controller().ask(request)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Server-sent events: each stage is sent as soon as it is ready (see chat.streaming)
+@router.post("/analyze_note/stream")
+async def analyze_note_stream(note: Optional[str] = None, product_id: Optional[str] = None):
+    from .streaming import SSE_HEADERS, sse_stream
+    if note is None and product_id is None:
+        raise HTTPException(status_code=422, detail="note or product_id is required")
+    return StreamingResponse(sse_stream(get_controller().analyze_and_respond_stream(note, product_id)),
+                             media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/ask/stream")
+async def ask_question_stream(request: AskRequest):
+    from .streaming import SSE_HEADERS, sse_stream
+    return StreamingResponse(sse_stream(get_controller().ask_stream(request)),
+                             media_type="text/event-stream", headers=SSE_HEADERS)
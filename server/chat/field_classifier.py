@@ -0,0 +1,178 @@
+"""
+In-process replacement for the remote zero-shot field classifier.
+
+`chatModel.classify` only needs a boolean per known column of dbo.readProduct
+(the FIELD FLAGS in the build_sql prompt). Here they come from:
+
+1. a keyword/synonym lexicon per field ("how much" -> current_price,
+   "running low" -> quantity, ...), and
+2. optionally, one logistic-regression model per field over hashed word
+   unigrams/bigrams plus the lexicon hits, trained from questions the remote
+   model labelled (see benchmarks/field_classifier.py).
+
+Without a trained model (FIELD_MODEL_PATH missing) the lexicon decides alone.
+Prediction is a few dozen dict lookups: microseconds, no network.
+
+CLASSIFIER selects what classify uses: "local", "remote" (the bart-large-mnli
+call) or "shadow" (the default: answer locally, call the remote model in the
+background). Remote labels are appended to FIELD_LOG_PATH in the last two
+modes, which is the training and evaluation set. Switch to "local" once
+`python benchmarks/field_classifier.py eval` shows acceptable agreement.
+"""
+from __future__ import annotations
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .chat_schemas import FIELDS
+
+log = logging.getLogger("smartmarket.field_classifier")
+
+CLASSIFIER = os.getenv("CLASSIFIER", "shadow")
+FIELD_MODEL_PATH = os.getenv("FIELD_MODEL_PATH", "field_model.json")
+FIELD_LOG_PATH = os.getenv("FIELD_LOG_PATH", "field_labels.jsonl")
+HASH_BITS = 18
+
+LEXICON: Dict[str, Sequence[str]] = {
+    "product_id": ["id", "ids", "product id", "barcode", "barcodes", "sku", "skus", "code"],
+    "name": ["name", "names", "named", "called", "product name", "title"],
+    "current_price": ["price", "prices", "priced", "selling price", "sell for", "sells for", "how much", "costs?",
+                      "expensive", "cheap", "cheaper", "cheapest"],
+    "cost_price": ["cost price", "buy price", "buying price", "purchase price", "wholesale", "we paid", "paid for",
+                   "margin", "margins", "markup"],
+    "quantity": ["quantity", "quantities", "stock", "in stock", "units", "left", "how many", "running low",
+                 "out of stock", "restock", "count"],
+    "brand": ["brand", "brands", "manufacturer", "maker", "made by"],
+    "category": ["category", "categories", "department", "departments", "section", "aisle", "kind of", "type of"],
+    "is_on_promotion": ["promotion", "promotions", "promo", "promos", "on sale", "discount", "discounts",
+                        "discounted", "deal", "deals"],
+    "promotion_discount_percent": ["discount percent", "discount percentage", "percent off", "% off", "discount rate",
+                                   "how much off", "discount"],
+    "image_url": ["image", "images", "picture", "pictures", "photo", "photos", "img"],
+    "note": ["note", "notes", "comment", "comments", "remark", "remarks", "feedback"],
+    "inventory_value": ["inventory value", "stock value", "value of (?:the )?(?:inventory|stock)", "worth",
+                        "value"],
+    "total_profit": ["profit", "profits", "profitable", "earnings", "earned", "made money", "revenue"],
+    "updated_at_utc": ["updated", "last update", "changed", "modified", "recent", "recently", "latest", "when"],
+}
+
+_PATTERNS: Dict[str, "re.Pattern[str]"] = {
+    f: re.compile(r"(?<!\w)(?:" + "|".join(t.replace(" ", r"\s+") for t in terms) + r")(?!\w)")
+    for f, terms in LEXICON.items()
+}
+_WORD = re.compile(r"[a-z0-9%]+")
+
+
+def lexicon_flags(text: str) -> Dict[str, bool]:
+    text = text.lower()
+    return {f: bool(_PATTERNS[f].search(text)) for f in FIELDS}
+
+
+def features(text: str, lexicon: Optional[Dict[str, bool]] = None) -> List[int]:
+    """Hashed feature indices: word unigrams and bigrams (plural 's' dropped) and the lexicon hits."""
+    words = [w[:-1] if len(w) > 3 and w.endswith("s") else w for w in _WORD.findall(text.lower())]
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    grams += [f"lex:{f}" for f, hit in (lexicon or lexicon_flags(text)).items() if hit]
+    mask = (1 << HASH_BITS) - 1
+    return sorted({zlib.crc32(g.encode()) & mask for g in grams})
+
+
+def _sigmoid(z: float) -> float:
+    return 1.0 / (1.0 + math.exp(-max(min(z, 30.0), -30.0)))
+
+
+class FieldClassifier:
+    def __init__(self, weights: Optional[Dict[str, Tuple[float, Dict[int, float]]]] = None) -> None:
+        # field -> (bias, {feature index: weight})
+        self.weights = weights
+
+    @classmethod
+    def load(cls, path: str = FIELD_MODEL_PATH) -> "FieldClassifier":
+        try:
+            with open(path, encoding="utf-8") as f:
+                raw = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        except (OSError, ValueError) as e:
+            log.warning("ignoring field model %s: %s", path, e)
+            return cls()
+        if raw.get("hash_bits") != HASH_BITS:
+            log.warning("ignoring field model %s: trained with hash_bits=%s", path, raw.get("hash_bits"))
+            return cls()
+        return cls({f: (m["bias"], {int(k): v for k, v in m["w"].items()}) for f, m in raw["fields"].items()})
+
+    def save(self, path: str) -> None:
+        raw = {"hash_bits": HASH_BITS, "fields": {f: {"bias": b, "w": {str(k): round(v, 5) for k, v in w.items()}}
+                                                  for f, (b, w) in (self.weights or {}).items()}}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(raw, f)
+
+    def predict(self, text: str) -> Dict[str, bool]:
+        lexicon = lexicon_flags(text)
+        if not self.weights:
+            return lexicon
+        x = features(text, lexicon)
+        flags = {}
+        for f in FIELDS:
+            if f not in self.weights:
+                flags[f] = lexicon[f]
+                continue
+            bias, w = self.weights[f]
+            flags[f] = bias + sum(w.get(i, 0.0) for i in x) > 0.0
+        return flags
+
+    @classmethod
+    def train(cls, examples: Iterable[Tuple[str, Dict[str, bool]]], epochs: int = 15, lr: float = 0.3,
+              l2: float = 1e-4, seed: int = 7) -> "FieldClassifier":
+        """One-vs-rest logistic regression by SGD over (question, flags) pairs."""
+        data = [(features(q), flags) for q, flags in examples]
+        rng = random.Random(seed)
+        weights: Dict[str, Tuple[float, Dict[int, float]]] = {}
+        for f in FIELDS:
+            bias, w = 0.0, {}
+            for epoch in range(epochs):
+                rng.shuffle(data)
+                step = lr / (1 + epoch)
+                for x, flags in data:
+                    y = 1.0 if flags.get(f) else 0.0
+                    g = _sigmoid(bias + sum(w.get(i, 0.0) for i in x)) - y
+                    bias -= step * g
+                    for i in x:
+                        w[i] = w.get(i, 0.0) * (1 - step * l2) - step * g
+            weights[f] = (bias, {i: v for i, v in w.items() if abs(v) > 1e-4})
+        return cls(weights)
+
+
+def read_labels(path: str = FIELD_LOG_PATH) -> List[Tuple[str, Dict[str, bool]]]:
+    """(question, remote flags) pairs from the label log; later entries win for repeated questions."""
+    pairs: Dict[str, Tuple[str, Dict[str, bool]]] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            pairs[" ".join(row["question"].split()).lower()] = (row["question"], row["flags"])
+    return list(pairs.values())
+
+
+_log_lock = threading.Lock()
+
+
+def log_label(question: str, remote: Dict[str, bool], local: Dict[str, bool]) -> None:
+    try:
+        with _log_lock, open(FIELD_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"ts": time.time(), "question": question, "flags": remote, "local": local},
+                               ensure_ascii=False) + "\n")
+    except OSError as e:
+        log.warning("could not log field labels: %s", e)
+
+
+field_classifier = FieldClassifier.load()
@@ -0,0 +1,174 @@
+"""
+Deterministic fast path for the questions staff ask every day.
+
+Most chat questions are one of a handful of shapes (low stock, most profitable
+products, what's on promotion, inventory value by category, the price of one
+product). These are matched here with anchored patterns and answered from
+parameterized SQL templates against dbo.readProduct, skipping classify,
+build_sql and summarize_action entirely. Anything that does not match a
+pattern as a whole goes to the LLM as before, and so does a price lookup
+that finds no product (the "name" was probably not one).
+
+CHAT_INTENTS=0 disables the fast path.
+"""
+from __future__ import annotations
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .chat_schemas import FIELDS
+
+CHAT_INTENTS = os.getenv("CHAT_INTENTS", "1") != "0"
+LOW_STOCK_DEFAULT = int(os.getenv("LOW_STOCK_DEFAULT", "10"))
+TOP_DEFAULT = 10
+TOP_MAX = 100
+
+# "show me the ...", "which ...", "what are all the ..." carry no meaning here
+_LEAD = re.compile(r"^(?:please\s+)?(?:(?:can|could) you\s+)?(?:show(?: me)?|list|give me|get|find|tell me|"
+                   r"what(?:'s| is| are)|which|i want(?: to see)?)?\s*(?:the\s+)?(?:all\s+)?(?:of\s+the\s+)?", re.I)
+_TRAIL = re.compile(r"[\s?.!]+$")
+
+# a "product name" containing any of these is really an analytical question
+_NOT_A_NAME = {"most", "least", "average", "avg", "highest", "lowest", "cheapest", "expensive", "all", "products",
+               "items", "total", "each", "per", "every", "category", "categories", "brand", "brands", "promotion",
+               "sale", "than", "sum", "stock", "profit", "and", "or", "inventory", "value", "revenue", "sales",
+               "earning", "earn", "earned", "earnings", "income", "margin", "worth", "money", "cost", "costs",
+               "spend", "spent", "it", "this", "that", "they", "we", "our", "us", "i", "my"}
+
+
+@dataclass
+class IntentMatch:
+    intent: str
+    sql: str
+    params: Tuple[Any, ...]
+    fields: Sequence[str]
+    message: str
+    # no rows means the pattern matched by accident: ask the LLM instead
+    fallback_when_empty: bool = False
+    field_flags: Dict[str, bool] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.field_flags = {f: f in self.fields for f in FIELDS}
+
+    @property
+    def display_sql(self) -> str:
+        """The SQL with its parameters inlined, for showing to the user (never executed)."""
+        parts = self.sql.split("?")
+        out = [parts[0]]
+        for value, rest in zip(self.params, parts[1:]):
+            out.append("N'" + value.replace("'", "''") + "'" if isinstance(value, str) else str(value))
+            out.append(rest)
+        return "".join(out)
+
+
+def _n(m: re.Match, default: int, cap: Optional[int] = None) -> int:
+    n = int(m.group("n")) if m.groupdict().get("n") else default
+    return min(n, cap) if cap else n
+
+
+def _like(text: str) -> str:
+    # used with ESCAPE '\': means the same on SQL Server and on the SQLite snapshot (chat.snapshot),
+    # where a T-SQL [%] class would match literally
+    return "%" + re.sub(r"([%_\[\\])", r"\\\1", text) + "%"
+
+
+def _low_stock(m: re.Match) -> IntentMatch:
+    n = _n(m, LOW_STOCK_DEFAULT)
+    return IntentMatch(
+        "low_stock",
+        "SELECT product_id, name, quantity FROM dbo.readProduct WHERE quantity < ? ORDER BY quantity ASC, name",
+        (n,), ("product_id", "name", "quantity"),
+        f"Products with fewer than {n} units in stock, lowest first.",
+    )
+
+
+def _top_profit(m: re.Match) -> IntentMatch:
+    n = _n(m, TOP_DEFAULT, TOP_MAX)
+    return IntentMatch(
+        "top_profit",
+        "SELECT TOP (?) product_id, name, total_profit FROM dbo.readProduct ORDER BY total_profit DESC",
+        (n,), ("product_id", "name", "total_profit"),
+        f"The {n} products with the highest total profit.",
+    )
+
+
+def _on_promotion(m: re.Match) -> IntentMatch:
+    return IntentMatch(
+        "on_promotion",
+        "SELECT product_id, name, current_price, promotion_discount_percent FROM dbo.readProduct "
+        "WHERE is_on_promotion = 1 ORDER BY promotion_discount_percent DESC, name",
+        (), ("product_id", "name", "current_price", "is_on_promotion", "promotion_discount_percent"),
+        "Products currently on promotion, biggest discount first.",
+    )
+
+
+def _inventory_by_category(m: re.Match) -> IntentMatch:
+    return IntentMatch(
+        "inventory_by_category",
+        "SELECT category, SUM(inventory_value) AS inventory_value FROM dbo.readProduct "
+        "GROUP BY category ORDER BY inventory_value DESC",
+        (), ("category", "inventory_value"),
+        "Inventory value per category, largest first.",
+    )
+
+
+def _price_of(m: re.Match) -> Optional[IntentMatch]:
+    name = re.sub(r"^(?:the|a|an|product|item)\s+", "", m.group("name").strip(" '\""), flags=re.I)
+    words = name.lower().split()
+    if not words or len(words) > 5 or _NOT_A_NAME & set(words):
+        return None
+    return IntentMatch(
+        "price_of",
+        "SELECT product_id, name, current_price, is_on_promotion, promotion_discount_percent FROM dbo.readProduct "
+        "WHERE name LIKE ? ESCAPE '\\' OR product_id = ? ORDER BY name",
+        (_like(name), name), ("product_id", "name", "current_price", "is_on_promotion", "promotion_discount_percent"),
+        f"Current price of products matching '{name}'.",
+        fallback_when_empty=True,
+    )
+
+
+_ITEMS = r"(?:products?|items?)"
+_BELOW = r"(?:under|below|less than|fewer than|<)"
+
+# first match wins; each pattern must match the whole (normalized) question, case-insensitively
+INTENTS: List[Tuple["re.Pattern[str]", Callable[[re.Match], Optional[IntentMatch]]]] = [
+    (re.compile(rf"(?:{_ITEMS}\s+)?(?:(?:that are|are)\s+)?(?:with\s+|having\s+)?"
+                rf"(?:low stock|running low|low on stock|low inventory)"
+                rf"(?:\s+{_BELOW}\s+(?P<n>\d+)(?:\s+units)?)?", re.I), _low_stock),
+    # "products under 5" alone is more likely a price: a stock word is required
+    (re.compile(rf"{_ITEMS}\s+(?:with\s+|having\s+)?(?:a\s+)?(?:quantity|stock)\s+{_BELOW}\s+(?P<n>\d+)"
+                rf"(?:\s+(?:units|items|pieces))?(?:\s+(?:in stock|left))?", re.I), _low_stock),
+    (re.compile(rf"{_ITEMS}\s+(?:with\s+|having\s+)?{_BELOW}\s+(?P<n>\d+)"
+                rf"(?:\s+(?:units|items|pieces))?\s+(?:in stock|left)", re.I), _low_stock),
+    (re.compile(rf"(?:top|best)\s+(?:(?P<n>\d+)\s+)?(?:most\s+)?profitable\s+{_ITEMS}", re.I), _top_profit),
+    (re.compile(rf"(?:top|best)\s+(?:(?P<n>\d+)\s+)?{_ITEMS}\s+by\s+(?:total\s+)?profit", re.I), _top_profit),
+    (re.compile(rf"(?:(?P<n>\d+)\s+)?most\s+profitable\s+{_ITEMS}", re.I), _top_profit),
+    (re.compile(rf"{_ITEMS}\s+with\s+the\s+(?:highest|most|top)\s+(?:total\s+)?profits?", re.I), _top_profit),
+    (re.compile(rf"(?:{_ITEMS}\s+)?(?:that are\s+|are\s+)?(?:currently\s+)?on\s+(?:promotion|promo|sale|discount)"
+                rf"(?:\s+(?:now|right now|today))?", re.I), _on_promotion),
+    (re.compile(rf"(?:current\s+|active\s+)?promotions|discounted\s+{_ITEMS}", re.I), _on_promotion),
+    (re.compile(r"(?:total\s+)?(?:inventory|stock)\s+value\s+(?:by|per|for each|for every)\s+category", re.I),
+     _inventory_by_category),
+    (re.compile(r"(?:current\s+)?price\s+(?:of|for)\s+(?P<name>.+)", re.I), _price_of),
+    (re.compile(r"how much (?:is|are|does|do)\s+(?P<name>.+?)(?:\s+cost)?", re.I), _price_of),
+]
+
+
+def normalize(question: str) -> str:
+    q = _TRAIL.sub("", " ".join(question.split()))
+    return _LEAD.sub("", q, count=1)
+
+
+def match_intent(question: str) -> Optional[IntentMatch]:
+    """The fast-path answer for `question`, or None when it needs the LLM."""
+    if not CHAT_INTENTS:
+        return None
+    q = normalize(question)
+    for pattern, build in INTENTS:
+        m = pattern.fullmatch(q)
+        if m is not None:
+            found = build(m)
+            if found is not None:
+                return found
+    return None
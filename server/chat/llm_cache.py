@@ -0,0 +1,171 @@
+"""
+Persistent cache for Hugging Face router responses.
+
+build_sql, classify, analyze_and_respond, summarize_action and get_sentiment
+each take seconds and cost money, while staff ask the same questions every
+day. Responses are stored in a small SQLite file (LLM_CACHE_PATH) under a key
+made of the stage, endpoint, the request payload with whitespace
+collapsed (so the prompt, model name and generation config all count) and
+the DB schema hash used in the prompts.
+
+Entries expire after LLM_CACHE_TTL_S; past LLM_CACHE_MAX_ENTRIES the least
+recently used ones are evicted. Error responses are never stored. Per-stage
+hit rates are served at /debug/llm_cache. LLM_CACHE=0 disables the cache.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from common.tracing import span
+
+log = logging.getLogger("smartmarket.llm_cache")
+
+LLM_CACHE = os.getenv("LLM_CACHE", "1") != "0"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3")
+LLM_CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key        TEXT PRIMARY KEY,
+    stage      TEXT NOT NULL,
+    model      TEXT,
+    response   TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used  REAL NOT NULL,
+    hits       INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache(last_used);
+"""
+
+
+def _normalize(value: Any) -> Any:
+    """Prompt text differing only in whitespace maps to the same key.
+
+    Case is kept: notes and product names in the prompt end up in the answer.
+    """
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def make_key(stage: str, url: str, payload: Dict[str, Any], schema_hash: str) -> str:
+    body = json.dumps({"stage": stage, "url": url, "payload": _normalize(payload), "schema": schema_hash},
+                      sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str = LLM_CACHE_PATH) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._puts = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA_SQL)
+            self._local.conn = conn
+        return conn
+
+    def _count(self, stage: str, field: str) -> None:
+        with self._lock:
+            stat = self._stats.setdefault(stage, {"hits": 0, "misses": 0, "stores": 0})
+            stat[field] += 1
+
+    def get(self, key: str, stage: str) -> Optional[Any]:
+        if not LLM_CACHE:
+            return None
+        with span("llm_cache.get", stage=stage) as sp:
+            try:
+                conn = self._conn()
+                row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row is not None and time.time() - row[1] > LLM_CACHE_TTL_S:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    row = None
+                if row is not None:
+                    conn.execute("UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+                    conn.commit()
+            except sqlite3.Error as e:
+                log.warning("LLM cache read failed: %s", e)
+                row = None
+            sp.set(hit=row is not None)
+        self._count(stage, "hits" if row is not None else "misses")
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, stage: str, model: Optional[str], response: Any) -> None:
+        if not LLM_CACHE:
+            return
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, stage, model, response, created_at, last_used, hits) VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, stage, model, json.dumps(response, ensure_ascii=False), now, now),
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            log.warning("LLM cache write failed: %s", e)
+            return
+        self._count(stage, "stores")
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % 100 == 1
+        if evict:
+            try:
+                self.evict()
+            except sqlite3.Error as e:
+                log.warning("LLM cache eviction failed: %s", e)
+
+    def evict(self) -> int:
+        """Drop expired entries, then the least recently used beyond LLM_CACHE_MAX_ENTRIES."""
+        conn = self._conn()
+        expired = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - LLM_CACHE_TTL_S,)).rowcount
+        overflow = conn.execute(
+            "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (LLM_CACHE_MAX_ENTRIES,),
+        ).rowcount
+        conn.commit()
+        return expired + overflow
+
+    def clear(self) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM llm_cache")
+        conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stages: List[Dict[str, Any]] = []
+            for stage, s in sorted(self._stats.items()):
+                lookups = s["hits"] + s["misses"]
+                stages.append({"stage": stage, **s, "hit_rate": round(s["hits"] / lookups, 3) if lookups else None})
+        try:
+            rows = self._conn().execute("SELECT stage, COUNT(*), SUM(hits) FROM llm_cache GROUP BY stage").fetchall()
+        except sqlite3.Error:
+            rows = []
+        return {
+            "enabled": LLM_CACHE,
+            "path": self.path,
+            "ttl_s": LLM_CACHE_TTL_S,
+            "max_entries": LLM_CACHE_MAX_ENTRIES,
+            "since_start": stages,
+            "stored": [{"stage": s, "entries": n, "lifetime_hits": h or 0} for s, n, h in rows],
+        }
+
+
+llm_cache = LLMCache()
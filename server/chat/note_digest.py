@@ -0,0 +1,414 @@
+"""
+Bulk note analysis behind the "worrying notes" digest.
+
+A run picks up every NOTE_ADDED event, and every CREATE/UPDATE that carried a
+note, newer than the watermark in dbo.JobState. Only the latest note per
+product is analyzed:
+
+1. every note is scored by the in-process lexicon (chat.sentiment);
+2. the low-confidence ones go to the remote sentiment model as multi-input
+   requests of NOTE_BATCH_SIZE texts;
+3. notes that come out negative get the one-line seller summary from the chat
+   model.
+
+Remote calls share NOTE_HF_CONCURRENCY slots (the provider's concurrency
+limit) and are retried on 429/5xx/timeouts with exponential backoff and
+jitter, honouring Retry-After. A call that still fails leaves the lexicon
+score (or no summary) in place rather than failing the run.
+
+Results are upserted into dbo.NoteAnalysis, one row per product, so
+/chat/notes/digest is a single indexed read. A lease on the JobState row keeps
+concurrent workers from running the job twice. Runs are queued as
+"note.digest" jobs (jobs.handlers) from /debug/note_digest/run or every
+NOTE_DIGEST_EVERY_S seconds (0 = off).
+
+Note writes (add_note, or a create/update carrying a note) queue a
+"note.analyze" job for the product (`analyze_product`): the full analysis,
+summary included, is stored before anyone clicks Analyze, and
+/chat/analyze_note answers from it (`stored`). Notes analyzed that way are
+skipped by the next run.
+
+Each run re-reads the last NOTE_DIGEST_OVERLAP events before the watermark,
+since an event can commit after one with a higher id; notes already stored
+are skipped. The watermark then moves to the highest event_id seen when the
+run started, even if every note in between was already analyzed at write
+time. A note cleared to empty removes the product's row, so an old
+"worrying" note does not stay in the digest.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+
+import httpx
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from common.db import get_read_conn, get_write_conn
+from common.tracing import span
+from .chat_model import HF_TOKEN, chatModel
+from .sentiment import SENTIMENT_FALLBACK, analyze, from_remote
+
+log = logging.getLogger("smartmarket.note_digest")
+
+NOTE_BATCH_SIZE = int(os.getenv("NOTE_BATCH_SIZE", "32"))
+NOTE_HF_CONCURRENCY = int(os.getenv("NOTE_HF_CONCURRENCY", "4"))
+NOTE_RETRIES = int(os.getenv("NOTE_RETRIES", "4"))
+NOTE_RETRY_BASE_S = float(os.getenv("NOTE_RETRY_BASE_S", "1"))
+NOTE_DIGEST_EVERY_S = float(os.getenv("NOTE_DIGEST_EVERY_S", "0"))
+NOTE_DIGEST_LEASE_S = float(os.getenv("NOTE_DIGEST_LEASE_S", "3600"))
+# event ids are identity values: one committed after a higher one must still be seen
+NOTE_DIGEST_OVERLAP = int(os.getenv("NOTE_DIGEST_OVERLAP", "100"))
+JOB_NAME = "note_digest"
+
+TAGS = {"negative": "Not good", "neutral": "Needs check", "positive": "All good"}
+
+_SCHEMA_SQL = [
+    """
+    IF OBJECT_ID('dbo.NoteAnalysis') IS NULL
+    CREATE TABLE dbo.NoteAnalysis (
+        product_id      NVARCHAR(100) NOT NULL PRIMARY KEY,
+        event_id        BIGINT        NOT NULL,
+        note            NVARCHAR(MAX) NULL,
+        negative        FLOAT         NOT NULL,
+        neutral         FLOAT         NOT NULL,
+        positive        FLOAT         NOT NULL,
+        tag             NVARCHAR(32)  NOT NULL,
+        summary         NVARCHAR(MAX) NULL,
+        source          NVARCHAR(16)  NOT NULL,
+        analyzed_at_utc DATETIME2     NOT NULL
+    )
+    """,
+    """
+    IF OBJECT_ID('dbo.JobState') IS NULL
+    CREATE TABLE dbo.JobState (
+        job_name        NVARCHAR(64)  NOT NULL PRIMARY KEY,
+        last_event_id   BIGINT        NOT NULL DEFAULT 0,
+        lease_until_utc DATETIME2     NULL,
+        last_run_utc    DATETIME2     NULL,
+        last_result     NVARCHAR(MAX) NULL
+    )
+    """,
+]
+
+T = TypeVar("T")
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _retry_after(e: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait (0 when unspecified), or None if retrying is pointless."""
+    if isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+        if status != 429 and status < 500:
+            return None
+        try:
+            return float(e.response.headers.get("retry-after", 0))
+        except ValueError:
+            return 0.0
+    if isinstance(e, httpx.TransportError):
+        return 0.0
+    if isinstance(e, HTTPException) and e.status_code in (502, 504):
+        return 0.0
+    return None
+
+
+class NoteDigest:
+    def __init__(self) -> None:
+        self._schema_ready = False
+        self._sem: Optional[asyncio.Semaphore] = None
+        self.last_run: Dict[str, Any] = {}
+
+    # ------------------------------------------------------------------ DB
+    def ensure_schema(self) -> None:
+        if self._schema_ready:
+            return
+        with get_write_conn(label="note_digest") as cn:
+            cur = cn.cursor()
+            for sql in _SCHEMA_SQL:
+                cur.execute(sql)
+            cn.commit()
+        self._schema_ready = True
+
+    def _acquire(self) -> Tuple[bool, int]:
+        """Take the job lease; (acquired, watermark event_id)."""
+        now = utcnow()
+        with get_write_conn(label="note_digest") as cn:
+            cur = cn.cursor()
+            cur.execute("""
+                INSERT INTO dbo.JobState (job_name, last_event_id)
+                SELECT ?, 0 WHERE NOT EXISTS (SELECT 1 FROM dbo.JobState WHERE job_name = ?)
+            """, JOB_NAME, JOB_NAME)
+            cur.execute("""
+                UPDATE dbo.JobState SET lease_until_utc = ?
+                WHERE job_name = ? AND (lease_until_utc IS NULL OR lease_until_utc < ?)
+            """, now + timedelta(seconds=NOTE_DIGEST_LEASE_S), JOB_NAME, now)
+            acquired = cur.rowcount == 1
+            cur.execute("SELECT last_event_id FROM dbo.JobState WHERE job_name = ?", JOB_NAME)
+            watermark = int(cur.fetchone()[0])
+            cn.commit()
+        return acquired, watermark
+
+    def _release(self, watermark: int, result: Dict[str, Any]) -> None:
+        with get_write_conn(label="note_digest") as cn:
+            cur = cn.cursor()
+            cur.execute("""
+                UPDATE dbo.JobState
+                SET last_event_id = ?, lease_until_utc = NULL, last_run_utc = ?, last_result = ?
+                WHERE job_name = ?
+            """, watermark, utcnow(), json.dumps(result, default=str), JOB_NAME)
+            cn.commit()
+
+    def _pending_notes(self, since: int) -> List[Tuple[int, str, str]]:
+        """(event_id, product_id, note) of the latest note per product after event `since` (less the overlap),
+        skipping notes already analyzed at write time."""
+        with get_read_conn(label="note_digest") as cn:
+            cur = cn.cursor()
+            cur.execute("""
+                SELECT e.event_id, e.product_id, e.note
+                FROM dbo.Events e
+                WHERE e.event_id > ?
+                  AND e.note IS NOT NULL AND LTRIM(RTRIM(e.note)) <> ''
+                  AND e.event_type IN ('NOTE_ADDED', 'UPDATE', 'CREATE')
+                  AND NOT EXISTS (SELECT 1 FROM dbo.NoteAnalysis a
+                                  WHERE a.product_id = e.product_id AND a.event_id >= e.event_id)
+                  AND NOT EXISTS (SELECT 1 FROM dbo.Events c
+                                  WHERE c.product_id = e.product_id AND c.event_id > e.event_id
+                                    AND c.note IS NOT NULL AND LTRIM(RTRIM(c.note)) = ''
+                                    AND c.event_type IN ('NOTE_ADDED', 'UPDATE'))
+                ORDER BY e.event_id ASC
+            """, max(0, since - NOTE_DIGEST_OVERLAP))
+            rows = cur.fetchall()
+        latest: Dict[str, Tuple[int, str, str]] = {}
+        for event_id, product_id, note in rows:
+            latest[product_id] = (int(event_id), product_id, note)
+        return list(latest.values())
+
+    def _last_event_id(self) -> int:
+        with get_read_conn(label="note_digest") as cn:
+            cur = cn.cursor()
+            cur.execute("SELECT MAX(event_id) FROM dbo.Events")
+            return int(cur.fetchone()[0] or 0)
+
+    def _drop_cleared(self, since: int) -> int:
+        """Delete the analyses of notes that were cleared to empty after event `since`."""
+        with get_write_conn(label="note_digest") as cn:
+            cur = cn.cursor()
+            cur.execute("""
+                DELETE FROM dbo.NoteAnalysis
+                WHERE EXISTS (SELECT 1 FROM dbo.Events e
+                              WHERE e.product_id = dbo.NoteAnalysis.product_id
+                                AND e.event_id > ? AND e.event_id > dbo.NoteAnalysis.event_id
+                                AND e.note IS NOT NULL AND LTRIM(RTRIM(e.note)) = ''
+                                AND e.event_type IN ('NOTE_ADDED', 'UPDATE'))
+            """, max(0, since - NOTE_DIGEST_OVERLAP))
+            dropped = cur.rowcount
+            cn.commit()
+        return dropped
+
+    def latest_note(self, product_id: str, primary: bool = False) -> Optional[Tuple[int, str, str]]:
+        """The product's newest note event, or None when it has none or it was cleared.
+
+        `primary` reads it from the primary: a note.analyze job runs right
+        after the write, which a lagging replica may not have yet.
+        """
+        with (get_write_conn if primary else get_read_conn)(label="note_digest") as cn:
+            cur = cn.cursor()
+            cur.execute("""
+                SELECT event_id, product_id, note FROM dbo.Events
+                WHERE event_id = (SELECT MAX(event_id) FROM dbo.Events
+                                  WHERE product_id = ? AND note IS NOT NULL
+                                    AND event_type IN ('NOTE_ADDED', 'UPDATE', 'CREATE'))
+            """, product_id)
+            row = cur.fetchone()
+        if row is None or not (row[2] or "").strip():
+            return None
+        return (int(row[0]), row[1], row[2])
+
+    def stored(self, product_id: str) -> Optional[Dict[str, Any]]:
+        """The stored analysis of the product's note, or None when it was never analyzed."""
+        self.ensure_schema()
+        with get_read_conn(label="note_digest") as cn:
+            cur = cn.cursor()
+            cur.execute("""
+                SELECT note, negative, neutral, positive, tag, summary, source, analyzed_at_utc, event_id
+                FROM dbo.NoteAnalysis WHERE product_id = ?
+            """, product_id)
+            r = cur.fetchone()
+        if r is None:
+            return None
+        return {"note": r[0], "tag": r[4], "summary": r[5], "source": r[6], "analyzed_at_utc": r[7],
+                "event_id": int(r[8]), "sentiment_breakdown": {"negative": float(r[1]), "neutral": float(r[2]), "positive": float(r[3])}}
+
+    def store(self, results: List[Dict[str, Any]]) -> None:
+        """Upsert one NoteAnalysis row per product; an older event never overwrites a newer one."""
+        now = utcnow()
+        with get_write_conn(label="note_digest") as cn:
+            cur = cn.cursor()
+            for r in results:
+                b = r["sentiment_breakdown"]
+                values = (r["event_id"], r["note"], b.get("negative", 0.0), b.get("neutral", 0.0),
+                          b.get("positive", 0.0), r["tag"], r.get("summary"), r["source"], now)
+                cur.execute("""
+                    UPDATE dbo.NoteAnalysis
+                    SET event_id = ?, note = ?, negative = ?, neutral = ?, positive = ?,
+                        tag = ?, summary = ?, source = ?, analyzed_at_utc = ?
+                    WHERE product_id = ? AND event_id <= ?
+                """, *values, r["product_id"], r["event_id"])
+                cur.execute("""
+                    INSERT INTO dbo.NoteAnalysis (event_id, note, negative, neutral, positive,
+                                                  tag, summary, source, analyzed_at_utc, product_id)
+                    SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+                    WHERE NOT EXISTS (SELECT 1 FROM dbo.NoteAnalysis WHERE product_id = ?)
+                """, *values, r["product_id"], r["product_id"])
+            cn.commit()
+
+    def digest(self, min_negative: float, limit: int) -> List[Dict[str, Any]]:
+        self.ensure_schema()
+        with get_read_conn(label="note_digest") as cn:
+            cur = cn.cursor()
+            cur.execute("""
+                SELECT a.product_id, p.name, p.category, a.note, a.negative, a.neutral, a.positive,
+                       a.tag, a.summary, a.source, a.analyzed_at_utc
+                FROM dbo.NoteAnalysis a
+                JOIN dbo.readProduct p ON p.product_id = a.product_id
+                WHERE a.negative >= ?
+                ORDER BY a.negative DESC
+            """, min_negative)
+            rows = cur.fetchmany(limit)
+        return [{
+            "product_id": r[0], "name": r[1], "category": r[2], "note": r[3],
+            "sentiment_breakdown": {"negative": float(r[4]), "neutral": float(r[5]), "positive": float(r[6])},
+            "tag": r[7], "summary": r[8], "source": r[9], "analyzed_at_utc": r[10],
+        } for r in rows]
+
+    # ------------------------------------------------------------ analysis
+    def _slots(self) -> asyncio.Semaphore:
+        # one pool of provider slots for the job and the write-time analyses together
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(NOTE_HF_CONCURRENCY)
+        return self._sem
+
+    async def _call(self, stats: Dict[str, int], fn: Callable[[], Awaitable[T]]) -> T:
+        delay = NOTE_RETRY_BASE_S
+        for attempt in range(NOTE_RETRIES + 1):
+            try:
+                async with self._slots():
+                    return await fn()
+            except Exception as e:
+                wait = _retry_after(e)
+                if wait is None or attempt == NOTE_RETRIES:
+                    raise
+                stats["retries"] += 1
+                await asyncio.sleep(max(wait, delay) + random.uniform(0, delay))
+                delay *= 2
+        raise AssertionError("unreachable")
+
+    async def analyze_notes(self, items: List[Tuple[int, str, str]], stats: Dict[str, int],
+                            summarize_all: bool = False) -> List[Dict[str, Any]]:
+        """Score `items`; summaries for the negative ones, or for all with `summarize_all`."""
+        results = []
+        for event_id, product_id, note in items:
+            local = analyze(note)
+            results.append({"event_id": event_id, "product_id": product_id, "note": note, "source": "lexicon",
+                            "label": local["label"], "sentiment_breakdown": local["sentiment_breakdown"],
+                            "low_confidence": local["low_confidence"]})
+
+        remote = HF_TOKEN and SENTIMENT_FALLBACK
+        unsure = [r for r in results if r["low_confidence"]] if remote else []
+        batches = [unsure[i:i + NOTE_BATCH_SIZE] for i in range(0, len(unsure), NOTE_BATCH_SIZE)]
+
+        async def score_batch(batch: List[Dict[str, Any]]) -> None:
+            try:
+                preds = await self._call(stats, lambda: chatModel.get_sentiment_batch([r["note"] for r in batch]))
+            except Exception as e:
+                stats["batches_failed"] += 1
+                log.warning("sentiment batch of %d notes failed, keeping lexicon scores: %s", len(batch), e)
+                return
+            stats["batches"] += 1
+            for r, p in zip(batch, preds):
+                r["label"], r["sentiment_breakdown"] = from_remote(p)
+                r["source"] = "remote"
+
+        await asyncio.gather(*(score_batch(b) for b in batches))
+
+        async def summarize(r: Dict[str, Any]) -> None:
+            try:
+                r["summary"] = await self._call(stats, lambda: chatModel.analyze_and_respond(r["note"]))
+                stats["summaries"] += 1
+            except Exception as e:
+                stats["summaries_failed"] += 1
+                log.warning("summary for %s failed: %s", r["product_id"], e)
+
+        if HF_TOKEN:
+            await asyncio.gather(*(summarize(r) for r in results if summarize_all or r["label"] == "negative"))
+        for r in results:
+            r["tag"] = TAGS.get(r["label"], "Needs check")
+        return results
+
+    async def analyze_product(self, product_id: str) -> Optional[Dict[str, Any]]:
+        """Analyze and store the product's latest note now; None when it has no note."""
+        await run_in_threadpool(self.ensure_schema)
+        item = await run_in_threadpool(self.latest_note, product_id, True)
+        if item is None:
+            return None
+        stats = {"batches": 0, "batches_failed": 0, "summaries": 0, "summaries_failed": 0, "retries": 0}
+        [result] = await self.analyze_notes([item], stats, summarize_all=True)
+        await run_in_threadpool(self.store, [result])
+        return result
+
+    async def run(self) -> Dict[str, Any]:
+        with span("note_digest.run") as sp:
+            await run_in_threadpool(self.ensure_schema)
+            acquired, since = await run_in_threadpool(self._acquire)
+            if not acquired:
+                return {"skipped": "another worker holds the note_digest lease"}
+            started = time.perf_counter()
+            stats = {"events_after": since, "products": 0, "batches": 0, "batches_failed": 0,
+                     "summaries": 0, "summaries_failed": 0, "retries": 0}
+            watermark = since
+            results: List[Dict[str, Any]] = []
+            try:
+                # read first: everything up to here gets scanned below, so the watermark can move to it
+                # even when write-time analysis left nothing pending (the overlap is still re-read)
+                upto = await run_in_threadpool(self._last_event_id)
+                stats["cleared"] = await run_in_threadpool(self._drop_cleared, since)
+                items = await run_in_threadpool(self._pending_notes, since)
+                stats["products"] = len(items)
+                if items:
+                    results = await self.analyze_notes(items, stats)
+                    await run_in_threadpool(self.store, results)
+                watermark = max(watermark, upto, *(event_id for event_id, _, _ in items))
+                stats["worrying"] = sum(1 for r in results if r["label"] == "negative")
+            finally:
+                stats["duration_s"] = round(time.perf_counter() - started, 3)
+                stats["watermark"] = watermark
+                await run_in_threadpool(self._release, watermark, stats)
+                self.last_run = {"finished_at_utc": utcnow(), **stats}
+            sp.set(products=stats["products"])
+            return stats
+
+    def status(self) -> Dict[str, Any]:
+        return {"last_run": self.last_run, "batch_size": NOTE_BATCH_SIZE, "concurrency": NOTE_HF_CONCURRENCY,
+                "every_s": NOTE_DIGEST_EVERY_S}
+
+
+note_digest = NoteDigest()
+
+
+async def schedule() -> None:
+    """Queue a run every NOTE_DIGEST_EVERY_S seconds for the life of the process."""
+    from jobs.job_queue import job_queue
+    while True:
+        await asyncio.sleep(NOTE_DIGEST_EVERY_S)
+        try:
+            job_queue.enqueue("note.digest", {}, dedupe_key="note.digest")
+        except Exception:
+            log.exception("could not queue the note digest")
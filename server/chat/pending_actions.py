@@ -0,0 +1,80 @@
+"""
+Short-lived store for chat writes awaiting the user's confirmation.
+
+When /chat/ask produces a write, the generated SQL is kept here and the
+response carries a single-use `confirmation_token`. Confirming with that token
+executes exactly the SQL the user was shown, without running classify and
+build_sql again. Tokens expire after PENDING_ACTION_TTL_S. With REDIS_URL set
+they live in Redis, so any worker can confirm them.
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Optional
+
+from common import shared_cache
+
+log = logging.getLogger("smartmarket.pending_actions")
+
+PENDING_ACTION_TTL_S = float(os.getenv("PENDING_ACTION_TTL_S", "300"))
+PENDING_ACTION_MAX = int(os.getenv("PENDING_ACTION_MAX", "1000"))
+
+
+@dataclass
+class PendingAction:
+    question: str
+    sql: str
+    field_flags: Dict[str, bool]
+    created_at: float = field(default_factory=time.time)
+
+
+class PendingActions:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._actions: "OrderedDict[str, PendingAction]" = OrderedDict()
+
+    @staticmethod
+    def _redis_key(token: str) -> str:
+        return f"{shared_cache.REDIS_PREFIX}:pending:{token}"
+
+    def put(self, action: PendingAction) -> str:
+        token = secrets.token_urlsafe(16)
+        l2 = shared_cache.l2
+        if l2 is not None:
+            try:
+                l2.client.set(self._redis_key(token), json.dumps(asdict(action)), ex=max(int(PENDING_ACTION_TTL_S), 1))
+                return token
+            except Exception as e:
+                log.warning("pending action not stored in Redis, keeping it in this worker: %s", e)
+        now = time.time()
+        with self._lock:
+            while self._actions and now - next(iter(self._actions.values())).created_at > PENDING_ACTION_TTL_S:
+                self._actions.popitem(last=False)
+            self._actions[token] = action
+            while len(self._actions) > PENDING_ACTION_MAX:
+                self._actions.popitem(last=False)
+        return token
+
+    def pop(self, token: str) -> Optional[PendingAction]:
+        """The action behind `token`, at most once; None when unknown or expired."""
+        with self._lock:
+            action = self._actions.pop(token, None)
+        if action is None and shared_cache.l2 is not None:
+            try:
+                raw = shared_cache.l2.client.getdel(self._redis_key(token))
+            except Exception as e:
+                log.warning("pending action lookup in Redis failed: %s", e)
+                raw = None
+            action = PendingAction(**json.loads(raw)) if raw else None
+        if action is None or time.time() - action.created_at > PENDING_ACTION_TTL_S:
+            return None
+        return action
+
+
+pending_actions = PendingActions()
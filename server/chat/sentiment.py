@@ -0,0 +1,148 @@
+"""
+In-process sentiment for product notes.
+
+Notes are short operational phrases ("Supplier delay; restock ETA next week",
+"Recall check completed; no issues found"), so a domain lexicon with a few
+rules covers them:
+
+- each lexicon term has a valence from -3 to +3 (phrases are matched before
+  single words);
+- a negator ("no", "not", "without", "never", "n't") within the three
+  preceding words flips the sign: "no issues" reads as positive;
+- an intensifier ("very", "severe", "major") scales it up, a diminisher
+  ("slightly", "minor", "some") scales it down;
+- a resolver ("fixed", "cleared", "replaced", ...) turns the negatives of its
+  own clause (text between ; : , .) into mild positives: "Backorder cleared".
+
+Positive and negative mass plus a neutral prior give the breakdown in the
+shape the remote XLM-RoBERTa path produced: {"negative", "neutral",
+"positive"} as percentages. A score whose top share is below
+SENTIMENT_MIN_CONFIDENCE, or a note with no lexicon hits at all (the lexicon
+knows nothing about it, however short), is flagged low-confidence.
+chatController.get_sentiment then asks the remote model when
+SENTIMENT_FALLBACK is on and HF_TOKEN is set.
+"""
+from __future__ import annotations
+import functools
+import os
+import re
+from typing import Any, Dict, List, Tuple
+
+SENTIMENT_MIN_CONFIDENCE = float(os.getenv("SENTIMENT_MIN_CONFIDENCE", "0.55"))
+SENTIMENT_FALLBACK = os.getenv("SENTIMENT_FALLBACK", "1") != "0"
+NEUTRAL_PRIOR = 1.0
+
+LEXICON: Dict[str, float] = {
+    # positive
+    "favorite": 2, "favourite": 2, "trending up": 2, "excellent": 3, "great": 2, "good": 1.5, "fair": 1.5,
+    "quality rated a": 2, "fresh": 1, "healthy": 1.5, "passed": 1.5, "approved": 1.5, "verified": 0.5,
+    "complete": 0.5, "completed": 0.5, "high visibility": 1.5,
+    "popular": 2, "selling well": 2, "sold out": 1, "strong": 1.5, "improved": 1.5, "increase": 0.5,
+    "within normal range": 1, "on track": 1, "bonus": 0.5, "above forecast": 2, "love": 2, "loves": 2,
+    "positive": 1.5, "praise": 2, "recommended": 1.5,
+    # neutral in this domain, matched so the single words inside them are not
+    "recall check": 0, "return rate": 0, "return policy": 0, "price check": 0,
+    # negative
+    "delay": -2, "delayed": -2, "late": -1.5, "damage": -2, "damaged": -2, "broken": -2, "leak": -2,
+    "leaking": -2, "complaint": -2.5, "complaints": -2.5, "odd smell": -2.5, "smell": -1, "expired": -2.5,
+    "spoiled": -3, "mold": -3, "moldy": -3, "recall": -2, "short-dated": -1.5, "shrinkage": -2,
+    "variance": -1, "misprint": -1, "mis-scan": -1, "issue": -1.5, "issues": -1.5, "problem": -2,
+    "problems": -2, "missing": -1.5, "below forecast": -2, "slow": -1, "slow-moving": -1.5,
+    "overstock": -1, "backorder": -1, "out of stock": -2, "shortage": -2, "discontinued": -1,
+    "returned": -1, "return": -0.5, "investigate": -1, "monitor": -0.5, "poor": -2, "bad": -2,
+    "worst": -3, "wrong": -1.5, "error": -1.5, "defect": -2, "defective": -2, "dirty": -2, "stale": -2,
+    "negative": -1.5, "decline": -1.5, "declining": -1.5, "drop": -1, "dropped": -1, "loss": -2,
+    "theft": -2.5, "stolen": -2.5, "angry": -2.5, "unhappy": -2, "overpriced": -2, "expensive": -1,
+}
+NEGATORS = {"no", "not", "without", "never", "none", "nothing", "hardly", "cannot", "cant", "isnt", "wasnt",
+            "dont", "doesnt", "didnt", "arent", "werent"}
+INTENSIFIERS = {"very": 1.5, "extremely": 2.0, "highly": 1.5, "severe": 1.8, "serious": 1.5, "major": 1.5,
+                "significant": 1.4, "really": 1.3, "slightly": 0.5, "minor": 0.5, "some": 0.8, "somewhat": 0.6,
+                "a bit": 0.6, "little": 0.6}
+RESOLVERS = {"fixed", "resolved", "cleared", "replaced", "adjusted", "corrected", "repaired", "restocked",
+             "refunded", "sorted"}
+RESOLVED_SHARE = 0.5
+NEGATION_WINDOW = 3
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+_CLAUSE = re.compile(r"[;:,.!?]+")
+_MAX_PHRASE = max(len(term.split()) for term in list(LEXICON) + list(INTENSIFIERS))
+
+
+def _tokens(text: str) -> List[str]:
+    return [t.replace("'", "") for t in _TOKEN.findall(text.lower())]
+
+
+def _score_clause(words: List[str]) -> Tuple[float, float, int]:
+    pos = neg = 0.0
+    hits = 0
+    resolved = False
+    scale = 1.0
+    last_negator = -NEGATION_WINDOW - 1
+    i = 0
+    while i < len(words):
+        # longest phrase first
+        for n in range(min(_MAX_PHRASE, len(words) - i), 0, -1):
+            term = " ".join(words[i:i + n])
+            if term in LEXICON or term in INTENSIFIERS:
+                break
+        else:
+            n, term = 1, words[i]
+        if term in NEGATORS:
+            last_negator = i
+        elif term in RESOLVERS:
+            resolved = True
+            hits += 1
+        elif term in INTENSIFIERS:
+            scale *= INTENSIFIERS[term]
+        elif term in LEXICON:
+            value = LEXICON[term] * scale
+            if i - last_negator <= NEGATION_WINDOW:
+                value = -value  # "no issues" is good news, "not good" bad news
+            if value > 0:
+                pos += value
+            else:
+                neg -= value
+            hits += 1
+            scale = 1.0
+        i += n
+    if resolved:
+        pos += neg * RESOLVED_SHARE if neg else RESOLVED_SHARE
+        neg = 0.0
+    return pos, neg, hits
+
+
+@functools.lru_cache(maxsize=8192)
+def _score(text: str) -> Tuple[float, float, int]:
+    """(positive mass, negative mass, lexicon hits); cached because notes repeat a lot."""
+    pos = neg = 0.0
+    hits = 0
+    for clause in _CLAUSE.split(text.lower()):
+        p, n, h = _score_clause(_tokens(clause))
+        pos, neg, hits = pos + p, neg + n, hits + h
+    return pos, neg, hits
+
+
+def analyze(text: str) -> Dict[str, object]:
+    """{"sentiment_breakdown": {...percentages...}, "label", "confidence", "low_confidence"}."""
+    pos, neg, hits = _score(" ".join(text.split()))
+    total = pos + neg + NEUTRAL_PRIOR
+    shares = {"negative": neg / total, "neutral": NEUTRAL_PRIOR / total, "positive": pos / total}
+    label = max(shares, key=shares.get)
+    confidence = shares[label]
+    return {
+        "sentiment_breakdown": {k: round(v * 100, 2) for k, v in shares.items()},
+        "label": label,
+        "confidence": round(confidence, 3),
+        "low_confidence": confidence < SENTIMENT_MIN_CONFIDENCE or hits == 0,
+    }
+
+
+REMOTE_LABELS = {"LABEL_0": "negative", "LABEL_1": "neutral", "LABEL_2": "positive"}
+
+
+def from_remote(preds: List[Dict[str, Any]]) -> Tuple[str, Dict[str, float]]:
+    """(label, breakdown in percent) from the XLM-RoBERTa router response for one text."""
+    total = sum(p["score"] for p in preds)
+    scores = {REMOTE_LABELS.get(p["label"], p["label"]).lower(): round(p["score"] / total * 100, 2) for p in preds}
+    return max(scores, key=scores.get), scores
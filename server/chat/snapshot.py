@@ -0,0 +1,334 @@
+"""
+Local analytical copy of dbo.readProduct for chat SELECTs.
+
+Generated chat queries no longer run against SQL Server. They run against a
+SQLite file (CHAT_SNAPSHOT_PATH) holding a copy of dbo.readProduct, plus
+dbo.Events with CHAT_SNAPSHOT_EVENTS=1. A bad plan from the model then costs
+this process some CPU but never holds locks or I/O that checkout needs.
+
+Refresh is incremental and happens on demand:
+
+- each write bumps data_versions (locally, or from another worker through
+  common.shared_cache); the next chat read then re-copies only the products
+  with events after the last copied event_id. CHAT_SNAPSHOT_OVERLAP events are
+  re-read so that identity values committed out of order are not missed;
+- without writes, a read refreshes once the copy is CHAT_SNAPSHOT_REFRESH_S old;
+- free-form chat writes (bump_all) carry no product ids, so they force a full
+  copy, as does age beyond CHAT_SNAPSHOT_FULL_S.
+
+While one thread refreshes, other reads use the current copy. Copies are
+read from a replica when there is one, except within MAX_REPLICA_LAG_S of a
+bump: the replica may not have that write yet, so those copies come from the
+primary. A caller pinned to the primary (a fresh X-Write-Token, see
+common.consistency) skips the snapshot and queries the server.
+
+The model writes T-SQL, so chat.transpile rewrites it to SQLite, typing
+operands from the column types below; where SQLite would answer
+differently (`+` on operands of unknown type, CONVERT with a style, ...) it
+is not tried. Text columns compare case insensitively, like the server's
+collation. Queries run on their own read-only connection (mode=ro,
+query_only), so only a refresh can change the copy. A query that can't be
+transpiled, or that SQLite rejects, runs on the server as before
+(CHAT_SNAPSHOT_FALLBACK=0 refuses it instead). CHAT_SNAPSHOT=0 turns the
+snapshot off.
+"""
+from __future__ import annotations
+import contextlib
+import datetime as dt
+import decimal
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+from common.consistency import MAX_REPLICA_LAG_S, reading_primary
+from common.db import get_read_conn
+from common.tracing import span
+from common.versioning import data_versions
+from .sql_guard import CHAT_SQL_TIMEOUT_S
+from .transpile import TranspileError, transpile
+
+log = logging.getLogger("smartmarket.chat_snapshot")
+
+CHAT_SNAPSHOT = os.getenv("CHAT_SNAPSHOT", "1") != "0"
+CHAT_SNAPSHOT_PATH = os.getenv("CHAT_SNAPSHOT_PATH", "chat_snapshot.sqlite3")
+CHAT_SNAPSHOT_EVENTS = os.getenv("CHAT_SNAPSHOT_EVENTS", "0") != "0"
+CHAT_SNAPSHOT_REFRESH_S = float(os.getenv("CHAT_SNAPSHOT_REFRESH_S", "30"))
+CHAT_SNAPSHOT_FULL_S = float(os.getenv("CHAT_SNAPSHOT_FULL_S", "3600"))
+CHAT_SNAPSHOT_OVERLAP = int(os.getenv("CHAT_SNAPSHOT_OVERLAP", "100"))
+CHAT_SNAPSHOT_FALLBACK = os.getenv("CHAT_SNAPSHOT_FALLBACK", "1") != "0"
+COPY_BATCH = 2000
+IN_CHUNK = 500
+
+PRODUCT_COLUMNS = [
+    ("product_id", "TEXT"), ("name", "TEXT"), ("current_price", "REAL"), ("cost_price", "REAL"),
+    ("quantity", "INTEGER"), ("brand", "TEXT"), ("category", "TEXT"), ("is_on_promotion", "INTEGER"),
+    ("promotion_discount_percent", "REAL"), ("image_url", "TEXT"), ("note", "TEXT"), ("inventory_value", "REAL"),
+    ("total_profit", "REAL"), ("updated_at_utc", "DATETIME"),
+]
+EVENT_COLUMNS = [
+    ("event_id", "INTEGER"), ("product_id", "TEXT"), ("event_type", "TEXT"), ("occurred_at_utc", "DATETIME"),
+    ("name", "TEXT"), ("current_price", "REAL"), ("cost_price", "REAL"), ("quantity_after", "INTEGER"),
+    ("quantity_delta", "INTEGER"), ("brand", "TEXT"), ("category", "TEXT"), ("is_on_promotion", "INTEGER"),
+    ("promotion_discount_percent", "REAL"), ("image_url", "TEXT"), ("note", "TEXT"), ("sale_unit_price", "REAL"),
+    ("sale_unit_cost", "REAL"), ("purchase_unit_cost", "REAL"),
+]
+
+
+def _ddl(table: str, columns: List[Tuple[str, str]], key: str) -> str:
+    cols = ", ".join(f"{c} {t}{' COLLATE NOCASE' if t == 'TEXT' else ''}{' PRIMARY KEY' if c == key else ''}"
+                     for c, t in columns)
+    return f"CREATE TABLE IF NOT EXISTS {table} ({cols})"
+
+
+# without the Events copy the table must not exist at all: a query on it then falls back to the server
+_SCHEMA_SQL = ";\n".join([
+    _ddl("readProduct", PRODUCT_COLUMNS, "product_id"),
+    "CREATE INDEX IF NOT EXISTS readProduct_category ON readProduct(category)",
+    "CREATE INDEX IF NOT EXISTS readProduct_brand ON readProduct(brand)",
+    "CREATE TABLE IF NOT EXISTS snapshot_state (name TEXT PRIMARY KEY, value REAL)",
+    *([_ddl("Events", EVENT_COLUMNS, "event_id"),
+       "CREATE INDEX IF NOT EXISTS Events_product ON Events(product_id, event_id)"]
+      if CHAT_SNAPSHOT_EVENTS else ["DROP TABLE IF EXISTS Events"]),
+]) + ";"
+
+
+# operand types for chat.transpile
+_COLUMN_TYPES = dict(PRODUCT_COLUMNS + EVENT_COLUMNS)
+
+
+# ----------------------------------------------------------------- snapshot
+def _value(v: Any) -> Any:
+    # dates in the one text form chat.transpile compares them in (DATETIME_FORMAT)
+    if isinstance(v, dt.datetime):
+        return v.isoformat(" ", timespec="milliseconds")
+    if isinstance(v, dt.date):
+        return v.isoformat()
+    if isinstance(v, decimal.Decimal):
+        return float(v)
+    if isinstance(v, bool):
+        return int(v)
+    return v
+
+
+class ChatSnapshot:
+    def __init__(self, path: str = CHAT_SNAPSHOT_PATH) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+        self._dirty = True
+        self._full = True
+        self._built = False
+        self._refreshed_at = 0.0
+        self._full_at = 0.0
+        self._bumped_at = 0.0
+        self._stats = {"queries": 0, "fallbacks": 0, "refreshes": 0, "full_refreshes": 0, "rows_copied": 0,
+                       "last_refresh_ms": None, "last_fallback": None}
+        data_versions.subscribe(self._on_write)
+
+    def _on_write(self, scopes) -> None:
+        self._bumped_at = time.monotonic()
+        self._dirty = True
+        if scopes is None:
+            self._full = True
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # a lost copy is rebuilt from the source
+            conn.executescript(_SCHEMA_SQL)
+            self._local.conn = conn
+        return conn
+
+    def _query_conn(self) -> sqlite3.Connection:
+        """Read-only connection for chat queries; only refresh writes, through _conn()."""
+        conn = getattr(self._local, "query_conn", None)
+        if conn is None:
+            self._conn()  # creates the file and schema first
+            conn = sqlite3.connect(f"file:{os.path.abspath(self.path)}?mode=ro", uri=True, timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA query_only=ON")
+            self._local.query_conn = conn
+        return conn
+
+    def _state(self, conn: sqlite3.Connection, name: str) -> float:
+        row = conn.execute("SELECT value FROM snapshot_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    # ---------------------------------------------------------- refreshing
+    def _copy_products(self, local: sqlite3.Connection, src_cur, ids: Optional[List[str]]) -> int:
+        cols = ", ".join(c for c, _ in PRODUCT_COLUMNS)
+        marks = ", ".join("?" for _ in PRODUCT_COLUMNS)
+        copied = 0
+        if ids is None:
+            local.execute("DELETE FROM readProduct")
+            src_cur.execute(f"SELECT {cols} FROM dbo.readProduct")
+            while True:
+                rows = src_cur.fetchmany(COPY_BATCH)
+                if not rows:
+                    break
+                local.executemany(f"INSERT INTO readProduct ({cols}) VALUES ({marks})",
+                                  [tuple(_value(v) for v in r) for r in rows])
+                copied += len(rows)
+            return copied
+        for n in range(0, len(ids), IN_CHUNK):
+            chunk = ids[n:n + IN_CHUNK]
+            qs = ", ".join("?" for _ in chunk)
+            src_cur.execute(f"SELECT {cols} FROM dbo.readProduct WHERE product_id IN ({qs})", *chunk)
+            rows = src_cur.fetchall()
+            # products that are gone from the source (DELETE) are dropped here as well
+            local.execute(f"DELETE FROM readProduct WHERE product_id IN ({qs})", chunk)
+            local.executemany(f"INSERT INTO readProduct ({cols}) VALUES ({marks})",
+                              [tuple(_value(v) for v in r) for r in rows])
+            copied += len(rows)
+        return copied
+
+    def _copy_events(self, local: sqlite3.Connection, src_cur, after: int, upto: int) -> int:
+        cols = ", ".join(c for c, _ in EVENT_COLUMNS)
+        marks = ", ".join("?" for _ in EVENT_COLUMNS)
+        src_cur.execute(f"SELECT {cols} FROM dbo.Events WHERE event_id > ? AND event_id <= ?", after, upto)
+        copied = 0
+        while True:
+            rows = src_cur.fetchmany(COPY_BATCH)
+            if not rows:
+                return copied
+            local.executemany(f"INSERT OR REPLACE INTO Events ({cols}) VALUES ({marks})",
+                              [tuple(_value(v) for v in r) for r in rows])
+            copied += len(rows)
+
+    def refresh(self, full: bool = False) -> Dict[str, Any]:
+        with self._refresh_lock:
+            self._refresh(full)
+        return self.stats()
+
+    def _refresh(self, full: bool = False) -> None:
+        started = time.perf_counter()
+        self._dirty = False
+        full = full or self._full or time.time() - self._full_at > CHAT_SNAPSHOT_FULL_S
+        if full:
+            self._full = False
+        local = self._conn()
+        # a replica may still be missing the write behind the last bump
+        primary = time.monotonic() - self._bumped_at < MAX_REPLICA_LAG_S
+        source = reading_primary() if primary else contextlib.nullcontext()
+        with span("chat.snapshot.refresh", full=full, primary=primary) as sp, source, \
+                get_read_conn(label="chat_snapshot") as src:
+            cur = src.cursor()
+            cur.execute("SELECT MAX(event_id) FROM dbo.Events")
+            upto = int(cur.fetchone()[0] or 0)
+            local.execute("BEGIN IMMEDIATE")
+            try:
+                seen = 0 if full else int(self._state(local, "event_id"))
+                after = max(0, seen - CHAT_SNAPSHOT_OVERLAP)
+                if full:
+                    copied = self._copy_products(local, cur, None)
+                elif upto > seen:
+                    cur.execute("SELECT DISTINCT product_id FROM dbo.Events WHERE event_id > ? AND event_id <= ?",
+                                after, upto)
+                    copied = self._copy_products(local, cur, [r[0] for r in cur.fetchall()])
+                else:
+                    copied = 0
+                if CHAT_SNAPSHOT_EVENTS:
+                    if full:
+                        local.execute("DELETE FROM Events")
+                    copied += self._copy_events(local, cur, after, upto)
+                local.execute("INSERT OR REPLACE INTO snapshot_state (name, value) VALUES ('event_id', ?)", (upto,))
+                local.execute("COMMIT")
+            except BaseException:
+                local.execute("ROLLBACK")
+                self._dirty = True
+                if full:
+                    self._full = True
+                raise
+            sp.set(rows=copied)
+        now = time.time()
+        self._refreshed_at = now
+        if full:
+            self._full_at = now
+        self._built = True
+        ms = round((time.perf_counter() - started) * 1000, 1)
+        self._stats["refreshes"] += 1
+        self._stats["full_refreshes"] += full
+        self._stats["rows_copied"] += copied
+        self._stats["last_refresh_ms"] = ms
+        log.debug("chat snapshot refreshed (%s): %d rows in %.1f ms", "full" if full else "incremental", copied, ms)
+
+    def _ensure_fresh(self) -> None:
+        stale = self._dirty or self._full or time.time() - self._refreshed_at > CHAT_SNAPSHOT_REFRESH_S
+        if not stale:
+            return
+        # someone else is refreshing: read the copy we have, unless there is none yet
+        if not self._refresh_lock.acquire(blocking=not self._built):
+            return
+        try:
+            self._refresh()
+        finally:
+            self._refresh_lock.release()
+
+    # ------------------------------------------------------------- queries
+    def query(self, sql: str, params: Sequence[Any], limit: int) -> Optional[Tuple[List[tuple], List[str], bool]]:
+        """(rows, columns, truncated) from the snapshot, or None when the server has to answer it."""
+        try:
+            lite_sql = transpile(sql, params, _COLUMN_TYPES)
+        except TranspileError as e:
+            return self._fallback(sql, f"transpile: {e}")
+        try:
+            self._ensure_fresh()
+        except Exception as e:
+            log.warning("chat snapshot refresh failed: %s", e)
+            if not self._built:
+                return self._fallback(sql, f"refresh: {e}")
+        conn = self._query_conn()
+        deadline = time.monotonic() + CHAT_SQL_TIMEOUT_S
+        conn.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+        try:
+            with span("chat.snapshot.query"):
+                cur = conn.execute(lite_sql, tuple(_value(p) for p in params))
+                rows = cur.fetchmany(limit + 1) if cur.description else []
+                cols = [c[0] for c in cur.description] if cur.description else []
+        except sqlite3.OperationalError as e:
+            if "interrupted" in str(e):
+                raise HTTPException(status_code=504, detail=f"The query took longer than {CHAT_SQL_TIMEOUT_S}s")
+            return self._fallback(sql, f"sqlite: {e}")
+        except sqlite3.Error as e:
+            return self._fallback(sql, f"sqlite: {e}")
+        finally:
+            conn.set_progress_handler(None, 0)
+        self._stats["queries"] += 1
+        return rows[:limit], cols, len(rows) > limit
+
+    def _fallback(self, sql: str, reason: str) -> None:
+        self._stats["fallbacks"] += 1
+        self._stats["last_fallback"] = reason
+        if not CHAT_SNAPSHOT_FALLBACK:
+            raise HTTPException(status_code=422, detail="This question can't be answered from the analytics copy")
+        log.info("chat query runs on the server (%s): %s", reason, sql)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            conn = self._conn()
+            products = conn.execute("SELECT COUNT(*) FROM readProduct").fetchone()[0]
+            events = conn.execute("SELECT COUNT(*) FROM Events").fetchone()[0] if CHAT_SNAPSHOT_EVENTS else None
+            event_id = self._state(conn, "event_id")
+        except sqlite3.Error:
+            products = events = event_id = None
+        return {
+            "enabled": CHAT_SNAPSHOT,
+            "path": self.path,
+            "products": products,
+            "events": events,
+            "event_id": event_id,
+            "age_s": round(time.time() - self._refreshed_at, 1) if self._refreshed_at else None,
+            "stale": self._dirty or self._full,
+            **self._stats,
+        }
+
+
+chat_snapshot = ChatSnapshot()
@@ -0,0 +1,272 @@
+"""
+Limits for the SELECTs the chat model writes.
+
+`chatModel.execute_sql` used to run generated SQL as is and load every row.
+Before a generated read runs, it now goes through these steps:
+
+1. it is tokenized (strings, [identifiers] and comments respected) and
+   must be a single SELECT (or WITH ... SELECT) statement: no INTO, no
+   DML/DDL/EXEC keyword anywhere, and no second statement, with or without
+   a `;` (T-SQL runs `SELECT 1 DELETE ...` as a batch of two);
+2. the outer SELECT gets TOP (max_rows + 1), or its own TOP is lowered to
+   that; the extra row only tells us the answer was cut. UNION-style and
+   OFFSET ... FETCH queries cannot take a TOP on the outside and rely on the
+   capped fetch alone;
+3. its estimated plan (SET SHOWPLAN_XML) is checked. A plan that scans more
+   than CHAT_SCAN_MAX_ROWS rows of one table, or costs more than
+   CHAT_MAX_COST, is refused with 422. Where showplan is unavailable (no
+   SHOWPLAN permission, another engine) this step is skipped from then on;
+   any other failure to get a plan skips it for that query only;
+4. it runs with a CHAT_SQL_TIMEOUT_S statement timeout, at most max_rows
+   rows are fetched, and its transaction is always rolled back.
+
+max_rows comes from the request (AskRequest.max_rows), capped at
+CHAT_MAX_ROWS, which is also the default.
+"""
+from __future__ import annotations
+import logging
+import os
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+log = logging.getLogger("smartmarket.chat")
+
+CHAT_MAX_ROWS = int(os.getenv("CHAT_MAX_ROWS", "1000"))
+CHAT_SQL_TIMEOUT_S = int(os.getenv("CHAT_SQL_TIMEOUT_S", "10"))
+CHAT_COST_GUARD = os.getenv("CHAT_COST_GUARD", "1") != "0"
+CHAT_SCAN_MAX_ROWS = float(os.getenv("CHAT_SCAN_MAX_ROWS", "200000"))
+CHAT_MAX_COST = float(os.getenv("CHAT_MAX_COST", "50"))
+
+_TOKEN = re.compile(r"""
+      (?P<space>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<string>N?'(?:[^']|'')*')
+    | (?P<ident>\[(?:[^\]]|\]\])*\]|"(?:[^"]|"")*")
+    | (?P<word>[A-Za-z_@#][\w@#$]*)
+    | (?P<number>\d+(?:\.\d+)?)
+    | (?P<op>.)
+""", re.S | re.X)
+
+_SET_OPS = {"UNION", "EXCEPT", "INTERSECT"}
+# none of these belongs in a read, at any depth
+_FORBIDDEN = {"INSERT", "UPDATE", "DELETE", "MERGE", "ALTER", "DROP", "TRUNCATE", "CREATE", "EXEC", "EXECUTE",
+              "GRANT", "REVOKE", "DENY", "DECLARE", "SET", "USE", "BACKUP", "RESTORE", "DBCC", "KILL", "SHUTDOWN",
+              "WAITFOR", "BULK", "OPENROWSET", "OPENQUERY", "OPENDATASOURCE", "WRITETEXT", "UPDATETEXT", "RECONFIGURE"}
+_SCANS = {"Table Scan", "Clustered Index Scan", "Index Scan"}
+_SHOWPLAN_NS = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+
+
+@dataclass
+class Token:
+    kind: str
+    text: str
+    start: int
+    depth: int
+
+    @property
+    def upper(self) -> str:
+        return self.text.upper() if self.kind == "word" else ""
+
+
+def tokenize(sql: str) -> List[Token]:
+    """Tokens (whitespace and comments dropped) with their parenthesis depth."""
+    out: List[Token] = []
+    depth = 0
+    for m in _TOKEN.finditer(sql):
+        kind = m.lastgroup
+        if kind in ("space", "comment"):
+            continue
+        text = m.group()
+        if text == ")":
+            depth -= 1
+        out.append(Token(kind, text, m.start(), depth))
+        if text == "(":
+            depth += 1
+    return out
+
+
+def clamp_rows(max_rows: Optional[int]) -> int:
+    return min(max_rows, CHAT_MAX_ROWS) if max_rows else CHAT_MAX_ROWS
+
+
+def _reject(detail: str) -> HTTPException:
+    return HTTPException(status_code=422, detail=detail)
+
+
+def _close(tokens: List[Token], i: int) -> int:
+    """Index of the ')' matching the '(' at i."""
+    end = next((n for n in range(i + 1, len(tokens)) if tokens[n].text == ")" and tokens[n].depth == tokens[i].depth), None)
+    if end is None:
+        raise _reject("Unbalanced parentheses")
+    return end
+
+
+def _main_select(tokens: List[Token]) -> int:
+    """Index of the statement's own SELECT: the first token, or the one after a WITH's CTE list."""
+    if tokens[0].upper == "SELECT":
+        return 0
+    i = 1
+    while True:
+        # name [(columns)] AS (query)
+        if i >= len(tokens) or tokens[i].kind not in ("word", "ident"):
+            raise _reject("Malformed WITH clause")
+        i += 1
+        if i < len(tokens) and tokens[i].text == "(":
+            i = _close(tokens, i) + 1
+        if i + 1 >= len(tokens) or tokens[i].upper != "AS" or tokens[i + 1].text != "(":
+            raise _reject("Malformed WITH clause")
+        i = _close(tokens, i + 1) + 1
+        if i < len(tokens) and tokens[i].text == ",":
+            i += 1
+            continue
+        break
+    if i >= len(tokens) or tokens[i].upper != "SELECT":
+        raise _reject("Only SELECT statements can be run without confirmation")
+    return i
+
+
+def _single_statement(tokens: List[Token], main: int) -> None:
+    """422 when anything after the main SELECT starts another statement."""
+    for n in range(main + 1, len(tokens)):
+        t = tokens[n]
+        if t.depth != 0:
+            continue
+        prev = tokens[n - 1].upper
+        if t.upper == "SELECT" and prev not in _SET_OPS and prev != "ALL":
+            raise _reject("Only a single SELECT statement can be run from chat")
+        # WITH (NOLOCK) and WITH TIES are part of this statement; WITH name starts another one
+        if t.upper == "WITH" and n + 1 < len(tokens) and tokens[n + 1].text != "(" and tokens[n + 1].upper != "TIES":
+            raise _reject("Only a single SELECT statement can be run from chat")
+
+
+def cap_select(sql: str, limit: int) -> str:
+    """`sql` as a single read statement returning at most `limit` rows; 422 if it is anything else."""
+    sql = sql.strip()
+    tokens = tokenize(sql)
+    # a trailing ';' is fine, a second statement is not
+    while tokens and tokens[-1].text == ";":
+        sql = sql[:tokens[-1].start].rstrip()
+        tokens.pop()
+    if not tokens:
+        raise _reject("Empty query")
+    if any(t.text == ";" for t in tokens):
+        raise _reject("Only a single SELECT statement can be run from chat")
+    if tokens[0].upper not in ("SELECT", "WITH"):
+        raise _reject("Only SELECT statements can be run without confirmation")
+    bad = next((t.upper for t in tokens if t.upper in _FORBIDDEN), None)
+    if bad:
+        raise _reject(f"{bad} is not allowed in a chat query")
+    top_level = [t for t in tokens if t.depth == 0]
+    if any(t.upper == "INTO" for t in top_level):
+        raise _reject("SELECT ... INTO is not allowed from chat")
+    i = _main_select(tokens)
+    _single_statement(tokens, i)
+    if any(t.upper in _SET_OPS for t in top_level) or any(t.upper == "OFFSET" for t in top_level):
+        # no single outer SELECT to cap, or TOP can't be combined with OFFSET ... FETCH;
+        # the fetch still stops at the limit
+        return sql
+    cap = limit + 1
+    j = i + 1
+    if j < len(tokens) and tokens[j].upper in ("DISTINCT", "ALL"):
+        j += 1
+    if j < len(tokens) and tokens[j].upper == "TOP":
+        k = j + 1
+        if k < len(tokens) and tokens[k].text == "(":
+            inner = k + 1
+            end = next((n for n in range(inner, len(tokens)) if tokens[n].text == ")" and tokens[n].depth == tokens[k].depth), None)
+            if end is None or end != inner + 1:
+                return sql  # TOP (expression): leave it to the capped fetch
+            number, after = tokens[inner], end + 1
+        else:
+            number, after = tokens[k] if k < len(tokens) else None, k + 1
+        if number is None or number.kind != "number":
+            return sql
+        if after < len(tokens) and tokens[after].upper == "PERCENT":
+            return sql
+        if float(number.text) <= cap:
+            return sql
+        return sql[:number.start] + str(cap) + sql[number.start + len(number.text):]
+    at = tokens[j].start if j < len(tokens) else len(sql)
+    return sql[:at] + f"TOP ({cap}) " + sql[at:]
+
+
+def check_plan(plan_xml: str) -> Optional[str]:
+    """Why the estimated plan is too expensive for chat, or None if it is fine."""
+    try:
+        root = ET.fromstring(plan_xml)
+    except ET.ParseError:
+        return None
+    for stmt in root.iter(f"{_SHOWPLAN_NS}StmtSimple"):
+        cost = float(stmt.get("StatementSubTreeCost") or 0)
+        if cost > CHAT_MAX_COST:
+            return f"The query is too expensive to run from chat (estimated cost {cost:.0f})"
+    for op in root.iter(f"{_SHOWPLAN_NS}RelOp"):
+        if op.get("PhysicalOp") not in _SCANS:
+            continue
+        rows = float(op.get("EstimatedRowsRead") or op.get("TableCardinality") or 0)
+        if rows > CHAT_SCAN_MAX_ROWS:
+            obj = op.find(f".//{_SHOWPLAN_NS}Object")
+            table = obj.get("Table", "a table").strip("[]") if obj is not None else "a table"
+            return (f"The query would scan about {rows:,.0f} rows of {table}; "
+                    "add a filter on an indexed column or ask for fewer rows")
+    return None
+
+
+_showplan_ok = True
+
+
+def estimate(cur, sql: str) -> Optional[str]:
+    """check_plan for `sql` on the cursor's connection; None when the plan can't be had."""
+    global _showplan_ok
+    if not (CHAT_COST_GUARD and _showplan_ok):
+        return None
+    try:
+        cur.execute("SET SHOWPLAN_XML ON")
+    except Exception as e:
+        args = getattr(e, "args", None)
+        if args and str(args[0]) == "42000":
+            # no SHOWPLAN permission (error 262), or an engine without it: that won't change
+            _showplan_ok = False
+            log.warning("cost guard disabled, SHOWPLAN_XML unavailable: %s", e)
+        else:
+            # e.g. a dropped connection (08S01): only this query goes unchecked
+            log.warning("cost guard skipped for this query: %s", e)
+        return None
+    try:
+        cur.execute(sql)
+        row = cur.fetchone()
+        while cur.nextset():
+            pass
+    finally:
+        cur.execute("SET SHOWPLAN_XML OFF")
+    return check_plan(row[0]) if row else None
+
+
+def guarded_fetch(conn, cur, sql: str, params: Sequence[Any], limit: int,
+                  check_cost: bool = True) -> Tuple[List[tuple], List[str], bool]:
+    """Run a read under the statement timeout and fetch at most `limit` rows: (rows, columns, truncated)."""
+    if check_cost:
+        reason = estimate(cur, sql)
+        if reason:
+            raise _reject(reason)
+    previous = getattr(conn, "timeout", 0)
+    conn.timeout = CHAT_SQL_TIMEOUT_S
+    try:
+        cur.execute(sql, *params)
+        rows = cur.fetchmany(limit + 1) if cur.description else []
+        cols = [c[0] for c in cur.description] if cur.description else []
+    except Exception as e:
+        # SQLSTATE HYT00: the statement timeout fired
+        if getattr(e, "args", None) and str(e.args[0]).startswith("HYT00"):
+            raise HTTPException(status_code=504, detail=f"The query took longer than {CHAT_SQL_TIMEOUT_S}s")
+        raise
+    finally:
+        conn.timeout = previous
+        # a read has nothing to keep: whatever slipped past cap_select is undone before the
+        # connection's `with` block commits (the primary serves reads when there is no replica)
+        conn.rollback()
+    return rows[:limit], cols, len(rows) > limit
@@ -0,0 +1,81 @@
+"""
+Server-sent events for the chat endpoints.
+
+/chat/ask/stream and /chat/analyze_note/stream answer with text/event-stream
+instead of one JSON body, sending each stage as soon as it is ready:
+
+    event: sql        {"question", "field_flags", "sql", "is_write_query"}
+    event: rows       {"offset", "rows"}              CHAT_STREAM_ROW_CHUNK rows each
+    event: sentiment  {"sentiment_breakdown", "tag"}  analyze_note only
+    event: token      {"text"}                        summary / reply, as the model writes it
+    event: done       the remaining AskResponse fields (or the final analyze_note result)
+    event: error      {"status", "detail"}            ends the stream
+"""
+from __future__ import annotations
+import asyncio
+import json
+import os
+from typing import Any, AsyncIterable, AsyncIterator, Tuple
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+CHAT_STREAM_ROW_CHUNK = int(os.getenv("CHAT_STREAM_ROW_CHUNK", "50"))
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+_DONE = object()
+
+
+def sse(event: str, data: Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n".encode()
+
+
+async def sse_stream(events: AsyncIterable[Tuple[str, Any]]) -> AsyncIterator[bytes]:
+    """Encode (event, data) pairs; an exception becomes a final `error` event (headers are already sent)."""
+    try:
+        async for event, data in events:
+            yield sse(event, data)
+    except HTTPException as e:
+        yield sse("error", {"status": e.status_code, "detail": e.detail})
+    except Exception as e:
+        yield sse("error", {"status": 500, "detail": str(e)})
+
+
+class Prefetch:
+    """Run async iterables in background tasks right away; iterating yields their items in arrival order.
+
+    Lets a later stage (e.g. the summary) be generated while an earlier one (the SQL) is still
+    running, and still be sent after it.
+    """
+
+    def __init__(self, *sources: AsyncIterable[Any]) -> None:
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._pump(s)) for s in sources]
+
+    async def _pump(self, source: AsyncIterable[Any]) -> None:
+        try:
+            async for item in source:
+                self._queue.put_nowait(item)
+        finally:
+            self._queue.put_nowait(_DONE)
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        try:
+            remaining = len(self._tasks)
+            while remaining:
+                item = await self._queue.get()
+                if item is not _DONE:
+                    yield item
+                    continue
+                remaining -= 1
+                for task in self._tasks:
+                    # a failed source ends the whole feed
+                    if task.done() and not task.cancelled() and task.exception() is not None:
+                        raise task.exception()
+        finally:
+            self.cancel()
+
+    def cancel(self) -> None:
+        for task in self._tasks:
+            task.cancel()
@@ -0,0 +1,96 @@
+import pytest
+from fastapi import HTTPException
+
+from chat import sql_guard
+from chat.sql_guard import cap_select, estimate, tokenize
+
+LIMIT = 100  # cap_select asks for LIMIT + 1 rows, the extra one flags truncation
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT * FROM dbo.Events", "SELECT TOP (101) * FROM dbo.Events"),
+    ("SELECT DISTINCT product_id FROM dbo.Events", "SELECT DISTINCT TOP (101) product_id FROM dbo.Events"),
+    ("SELECT * FROM dbo.Events;", "SELECT TOP (101) * FROM dbo.Events"),
+    ("select name from dbo.Products ;  ;", "select TOP (101) name from dbo.Products"),
+    # an own TOP above the cap is lowered, one below it is kept
+    ("SELECT TOP 5000 * FROM dbo.Events", "SELECT TOP 101 * FROM dbo.Events"),
+    ("SELECT TOP (5000) * FROM dbo.Events", "SELECT TOP (101) * FROM dbo.Events"),
+    ("SELECT TOP 10 * FROM dbo.Events", "SELECT TOP 10 * FROM dbo.Events"),
+    # WITH TIES keeps its lowered TOP; PERCENT and expressions are left to the capped fetch
+    ("SELECT TOP 500 WITH TIES * FROM dbo.Events ORDER BY price",
+     "SELECT TOP 101 WITH TIES * FROM dbo.Events ORDER BY price"),
+    ("SELECT TOP 50 PERCENT * FROM dbo.Events", "SELECT TOP 50 PERCENT * FROM dbo.Events"),
+    ("SELECT TOP (@n) * FROM dbo.Events", "SELECT TOP (@n) * FROM dbo.Events"),
+    # OFFSET ... FETCH and set operations take no outer TOP
+    ("SELECT * FROM dbo.Events ORDER BY event_id OFFSET 10 ROWS FETCH NEXT 5000 ROWS ONLY",
+     "SELECT * FROM dbo.Events ORDER BY event_id OFFSET 10 ROWS FETCH NEXT 5000 ROWS ONLY"),
+    ("SELECT name FROM dbo.Products UNION ALL SELECT name FROM dbo.Archive",
+     "SELECT name FROM dbo.Products UNION ALL SELECT name FROM dbo.Archive"),
+    # a CTE: only the statement's own SELECT is capped
+    ("WITH recent AS (SELECT TOP 5 * FROM dbo.Events ORDER BY event_id DESC) SELECT * FROM recent",
+     "WITH recent AS (SELECT TOP 5 * FROM dbo.Events ORDER BY event_id DESC) SELECT TOP (101) * FROM recent"),
+    ("WITH a (id) AS (SELECT 1), b AS (SELECT id FROM a) SELECT TOP 1000 id FROM b",
+     "WITH a (id) AS (SELECT 1), b AS (SELECT id FROM a) SELECT TOP 101 id FROM b"),
+    # table hints and keywords inside strings, [identifiers] and comments are not statements
+    ("SELECT * FROM dbo.Events WITH (NOLOCK)", "SELECT TOP (101) * FROM dbo.Events WITH (NOLOCK)"),
+    ("SELECT 'DELETE; DROP' AS [update] FROM dbo.Events -- EXEC",
+     "SELECT TOP (101) 'DELETE; DROP' AS [update] FROM dbo.Events -- EXEC"),
+])
+def test_cap_select(sql, expected):
+    assert cap_select(sql, LIMIT) == expected
+
+
+@pytest.mark.parametrize("sql", [
+    "",
+    ";",
+    "UPDATE dbo.Products SET price = 0",
+    # DML hidden in a subquery, a CTE or behind a comment
+    "SELECT * FROM dbo.Events WHERE event_id IN (SELECT 1 FROM x; DELETE FROM dbo.Events)",
+    "WITH gone AS (DELETE FROM dbo.Events OUTPUT deleted.*) SELECT * FROM gone",
+    "SELECT 1 /* harmless */ EXEC('DROP TABLE dbo.Events')",
+    "SELECT * FROM OPENROWSET('SQLNCLI', 'Server=x', 'SELECT 1')",
+    "SELECT * INTO dbo.Copy FROM dbo.Events",
+    # a second statement, with or without ';'
+    "SELECT 1; SELECT 2",
+    "SELECT 1 SELECT 2",
+    "SELECT * FROM dbo.Events WITH recent AS (SELECT 1) SELECT * FROM recent",
+    "SELECT * FROM dbo.Events; DELETE FROM dbo.Events",
+    # malformed
+    "WITH AS (SELECT 1) SELECT 1",
+    "WITH a AS (SELECT 1 SELECT * FROM a",
+    "WITH a AS (SELECT 1) DELETE FROM a",
+])
+def test_cap_select_rejects(sql):
+    with pytest.raises(HTTPException) as e:
+        cap_select(sql, LIMIT)
+    assert e.value.status_code == 422
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ("SELECT a FROM t", [("word", "SELECT", 0), ("word", "a", 0), ("word", "FROM", 0), ("word", "t", 0)]),
+    ("f(g(1))", [("word", "f", 0), ("op", "(", 0), ("word", "g", 1), ("op", "(", 1), ("number", "1", 2),
+                 ("op", ")", 1), ("op", ")", 0)]),
+    ("N'it''s ; DROP' [a]]b] \"c\"", [("string", "N'it''s ; DROP'", 0), ("ident", "[a]]b]", 0), ("ident", '"c"', 0)]),
+    ("1 -- DELETE\n/* ; */ 2.5", [("number", "1", 0), ("number", "2.5", 0)]),
+    ("@p #tmp", [("word", "@p", 0), ("word", "#tmp", 0)]),
+])
+def test_tokenize(sql, expected):
+    assert [(t.kind, t.text, t.depth) for t in tokenize(sql)] == expected
+
+
+class _FailingShowplan:
+    def __init__(self, sqlstate: str) -> None:
+        self.sqlstate = sqlstate
+
+    def execute(self, sql):
+        raise Exception(self.sqlstate, f"[{self.sqlstate}] SET SHOWPLAN_XML ON failed")
+
+
+@pytest.mark.parametrize("sqlstate, stays_on", [
+    ("42000", False),  # error 262: no SHOWPLAN permission
+    ("08S01", True),   # a dropped connection
+])
+def test_estimate_disables_only_on_permission_errors(monkeypatch, sqlstate, stays_on):
+    monkeypatch.setattr(sql_guard, "_showplan_ok", True)
+    assert estimate(_FailingShowplan(sqlstate), "SELECT 1") is None
+    assert sql_guard._showplan_ok is stays_on
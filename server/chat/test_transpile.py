@@ -0,0 +1,132 @@
+import datetime as dt
+import sqlite3
+
+import pytest
+
+from chat.transpile import TranspileError, transpile
+
+COLUMNS = {"product_id": "TEXT", "name": "TEXT", "brand": "TEXT", "current_price": "REAL", "quantity": "INTEGER",
+           "updated_at_utc": "DATETIME"}
+
+
+@pytest.mark.parametrize("sql, params, expected", [
+    ("SELECT TOP 5 name FROM dbo.readProduct WITH (NOLOCK)", (), "SELECT name FROM readProduct LIMIT 5"),
+    ("SELECT TOP (?) name FROM dbo.readProduct WHERE brand = N'Acme'", (3,),
+     "SELECT name FROM readProduct WHERE brand = 'Acme' LIMIT ?1"),
+    ("SELECT name FROM dbo.readProduct WHERE name LIKE '%' + ? + '%'", ("milk",),
+     "SELECT name FROM readProduct WHERE name LIKE '%' || ?1 || '%'"),
+    # + concatenates text and adds numbers
+    ("SELECT LEFT(name, 3) + LEFT(brand, 3) FROM dbo.readProduct",
+     (), "SELECT substr(name, 1, 3) || substr(brand, 1, 3) FROM readProduct"),
+    ("SELECT p.name + ' (' + p.brand + ')' FROM dbo.readProduct p", (),
+     "SELECT p.name || ' (' || p.brand || ')' FROM readProduct p"),
+    ("SELECT current_price * quantity + 1, quantity - 1 FROM dbo.readProduct", (),
+     "SELECT current_price * quantity + 1, quantity - 1 FROM readProduct"),
+    ("SELECT SUM(quantity) + COUNT(*) FROM dbo.readProduct", (), "SELECT SUM(quantity) + COUNT(*) FROM readProduct"),
+    ("SELECT DATEADD(day, -7, GETDATE())", (),
+     "SELECT strftime('%Y-%m-%d %H:%M:%f', strftime('%Y-%m-%d %H:%M:%f', 'now'), ((-7)) || ' days')"),
+    # a string compared with a date is read as a date
+    ("SELECT name FROM dbo.readProduct WHERE updated_at_utc > '2024-03-01T09:00:00'", (),
+     "SELECT name FROM readProduct WHERE updated_at_utc > strftime('%Y-%m-%d %H:%M:%f', '2024-03-01T09:00:00')"),
+    ("SELECT name FROM dbo.readProduct WHERE ? <= updated_at_utc", ("2024-03-01",),
+     "SELECT name FROM readProduct WHERE strftime('%Y-%m-%d %H:%M:%f', ?1) <= updated_at_utc"),
+    ("SELECT name FROM dbo.readProduct WHERE name = '2024-03-01'", (),
+     "SELECT name FROM readProduct WHERE name = '2024-03-01'"),
+    # (N)VARCHAR(n) truncates, VARCHAR without a length to 30
+    ("SELECT CAST(name AS NVARCHAR(10)) FROM dbo.readProduct", (),
+     "SELECT substr(CAST(name AS TEXT), 1, 10) FROM readProduct"),
+    ("SELECT CONVERT(VARCHAR, quantity) FROM dbo.readProduct", (),
+     "SELECT substr(CAST(quantity AS TEXT), 1, 30) FROM readProduct"),
+    ("SELECT CAST(name AS VARCHAR(MAX)) FROM dbo.readProduct", (), "SELECT CAST(name AS TEXT) FROM readProduct"),
+    ("SELECT CAST(current_price AS DECIMAL(10, 1)), CAST(current_price AS INT) FROM dbo.readProduct", (),
+     "SELECT round(current_price, 1), CAST(current_price AS INT) FROM readProduct"),
+    # AVG of an integer is an integer
+    ("SELECT AVG(quantity), AVG(current_price) FROM dbo.readProduct", (),
+     "SELECT CAST(avg(quantity) AS INTEGER), AVG(current_price) FROM readProduct"),
+    ("SELECT AVG(quantity * 2) FROM dbo.readProduct", (), "SELECT CAST(avg(quantity * 2) AS INTEGER) FROM readProduct"),
+    ("SELECT AVG(DISTINCT quantity) FROM dbo.readProduct", (),
+     "SELECT CAST(avg(DISTINCT quantity) AS INTEGER) FROM readProduct"),
+    ("SELECT AVG(CAST(quantity AS FLOAT)) FROM dbo.readProduct", (),
+     "SELECT AVG(CAST(quantity AS FLOAT)) FROM readProduct"),
+])
+def test_transpile(sql, params, expected):
+    assert transpile(sql, params, COLUMNS) == expected
+
+
+@pytest.mark.parametrize("sql, params", [
+    ("SELECT TOP 10 PERCENT name FROM dbo.readProduct", ()),
+    ("SELECT TOP 5 WITH TIES name FROM dbo.readProduct ORDER BY quantity", ()),
+    ("SELECT name FROM dbo.readProduct WHERE name LIKE '[a-c]%'", ()),
+    ("SELECT name FROM dbo.readProduct WHERE name LIKE ?", ("[a-c]%",)),
+    # + on anything but two numbers or two texts
+    ("SELECT name FROM dbo.readProduct WHERE notes + 1 > 0", ()),
+    ("SELECT name + quantity FROM dbo.readProduct", ()),
+    ("SELECT '5' + quantity FROM dbo.readProduct", ()),
+    ("SELECT unknown_column + 1 FROM dbo.readProduct", ()),
+    ("SELECT quantity + ? FROM dbo.readProduct", ()),
+    ("SELECT GETDATE() + 1", ()),
+    ("SELECT updated_at_utc - 1 FROM dbo.readProduct", ()),
+    # string conversions T-SQL formats differently
+    ("SELECT CONVERT(VARCHAR(10), updated_at_utc, 120) FROM dbo.readProduct", ()),
+    ("SELECT CAST(updated_at_utc AS VARCHAR(20)) FROM dbo.readProduct", ()),
+    ("SELECT CAST(current_price AS VARCHAR(10)) FROM dbo.readProduct", ()),
+    ("SELECT CAST(name AS CHAR(10)) FROM dbo.readProduct", ()),
+    ("SELECT AVG(quantity * 2 + name) FROM dbo.readProduct", ()),
+    ("SELECT AVG(unknown_column) FROM dbo.readProduct", ()),
+    ("SELECT FORMAT(current_price, 'C') FROM dbo.readProduct", ()),
+    # dates T-SQL reads by the session's language
+    ("SELECT name FROM dbo.readProduct WHERE updated_at_utc > '03/01/2024'", ()),
+    ("SELECT name FROM dbo.readProduct WHERE updated_at_utc BETWEEN ? AND ?", ("2024-03-01", "March 2, 2024")),
+    ("SELECT name FROM dbo.readProduct WHERE CAST(updated_at_utc AS DATE) IN ('1 Mar 2024')", ()),
+])
+def test_transpile_refuses(sql, params):
+    with pytest.raises(TranspileError):
+        transpile(sql, params, COLUMNS)
+
+
+@pytest.fixture
+def products():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE readProduct (name TEXT, brand TEXT, current_price REAL, quantity INTEGER, "
+                 "updated_at_utc DATETIME)")
+    conn.executemany("INSERT INTO readProduct VALUES (?, ?, ?, ?, ?)", [
+        # as chat.snapshot copies them
+        ("Milk", "Acme", 1.25, 3, "2026-10-01 08:00:00.000"),
+        ("Bread", "Bakehouse", 2.5, 4, "2026-10-02 08:00:00.000"),
+    ])
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("sql, params, expected", [
+    # what SQL Server answers for these
+    ("SELECT LEFT(name, 3) + LEFT(brand, 3) FROM dbo.readProduct ORDER BY name", (), [("BreBak",), ("MilAcm",)]),
+    ("SELECT CAST(brand AS VARCHAR(4)) FROM dbo.readProduct ORDER BY name", (), [("Bake",), ("Acme",)]),
+    ("SELECT AVG(quantity) FROM dbo.readProduct", (), [(3,)]),
+    ("SELECT AVG(current_price) FROM dbo.readProduct", (), [(1.875,)]),
+    ("SELECT CAST(current_price AS DECIMAL(10, 1)) FROM dbo.readProduct ORDER BY name", (), [(2.5,), (1.3,)]),
+    ("SELECT TOP 1 name FROM dbo.readProduct WHERE updated_at_utc > DATEADD(day, -1, ?) ORDER BY quantity",
+     (dt.datetime(2026, 10, 2, 12),), [("Bread",)]),
+    # string dates compare as dates, not as text
+    ("SELECT name FROM dbo.readProduct WHERE updated_at_utc > '2026-10-02T07:00:00'", (), [("Bread",)]),
+    ("SELECT name FROM dbo.readProduct WHERE updated_at_utc >= ?", ("2026-10-02 08:00",), [("Bread",)]),
+    ("SELECT name FROM dbo.readProduct WHERE updated_at_utc BETWEEN '2026-10-01' AND '2026-10-01T23:59:59'", (),
+     [("Milk",)]),
+    ("SELECT name FROM dbo.readProduct WHERE updated_at_utc IN ('2026-10-01 08:00', '2026-10-03')", (), [("Milk",)]),
+    ("SELECT name FROM dbo.readProduct WHERE CAST(updated_at_utc AS DATE) = '2026-10-02'", (), [("Bread",)]),
+    # DATEDIFF counts boundaries crossed
+    ("SELECT DATEDIFF(hour, '2026-10-01 10:59', '2026-10-01 11:01')", (), [(1,)]),
+    ("SELECT DATEDIFF(hour, '2026-10-01 10:00', '2026-10-01 10:59')", (), [(0,)]),
+    ("SELECT DATEDIFF(minute, '2026-10-01 10:59:59', '2026-10-01 11:00:00')", (), [(1,)]),
+    ("SELECT DATEDIFF(second, '2026-10-01 10:59:59.900', '2026-10-01 11:00:00.100')", (), [(1,)]),
+    ("SELECT DATEDIFF(day, '2026-10-01 23:59', '2026-10-02 00:01')", (), [(1,)]),
+    ("SELECT DATEDIFF(week, '2026-10-17', '2026-10-18')", (), [(1,)]),  # Saturday -> Sunday
+    ("SELECT DATEDIFF(week, '2026-10-18', '2026-10-24')", (), [(0,)]),  # Sunday -> Saturday
+    ("SELECT DATEDIFF(week, '2026-10-24', '2026-10-04')", (), [(-2,)]),
+    ("SELECT DATEDIFF(quarter, '2026-03-31', '2026-04-01')", (), [(1,)]),
+    ("SELECT DATEDIFF(month, '2026-01-31', '2026-02-01')", (), [(1,)]),
+])
+def test_transpiled_results(products, sql, params, expected):
+    # datetimes bound as chat.snapshot binds them
+    bound = [p.isoformat(" ", timespec="milliseconds") if isinstance(p, dt.datetime) else p for p in params]
+    assert products.execute(transpile(sql, params, COLUMNS), bound).fetchall() == expected
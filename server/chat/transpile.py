@@ -0,0 +1,548 @@
+"""
+T-SQL -> SQLite for the chat snapshot (chat.snapshot).
+
+The model writes T-SQL, so `transpile` rewrites the constructs it uses to
+SQLite: TOP -> LIMIT, dbo. and N'' prefixes, GETDATE()/DATEADD/DATEDIFF/
+YEAR/MONTH/DAY, LEN, ISNULL, CHARINDEX, LEFT/RIGHT, CAST/CONVERT, CONCAT
+and WITH (NOLOCK).
+
+Where SQLite would silently answer differently, the query is not tried
+(TranspileError) and runs on the server instead. Operand types come from
+the snapshot's column types, the parameters and the functions around them:
+
+- `+` becomes || between two text operands and stays + between two
+  numbers; any other `+` (a date, a column or expression of unknown type,
+  text next to a number) is refused, as is `-` on a date;
+- CAST/CONVERT to (N)VARCHAR(n) truncates to n characters (30 without a
+  length), and only text and integers are cast: T-SQL formats dates and
+  decimals its own way. CHAR(n) pads, and CONVERT with a style formats, so
+  neither is tried. DECIMAL(p, s) rounds to s places;
+- AVG of an integer is an integer in T-SQL; AVG of an expression of
+  unknown type is refused;
+- a LIKE pattern with a [...] class (a character class in T-SQL, literal
+  text in SQLite).
+
+Dates are text in SQLite, so they are kept in one form, DATETIME_FORMAT
+('YYYY-MM-DD HH:MM:SS.SSS'), which compares in date order: the snapshot
+copies them that way, GETDATE()/DATEADD/CAST produce it, and a string
+literal or parameter compared with a date (=, <, BETWEEN, IN, ...) is
+converted to it. Only ISO dates ('2024-03-01', '2024-03-01T09:00:00', ...)
+are converted; T-SQL reads other forms by the session's language, so those
+are refused. DATEDIFF counts unit boundaries crossed, as T-SQL does (10:59
+to 11:01 is one hour; weeks start on Sunday).
+"""
+from __future__ import annotations
+import datetime as dt
+import decimal
+import re
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from .sql_guard import tokenize
+
+
+class TranspileError(ValueError):
+    pass
+
+
+_UNITS = {"year": "years", "yy": "years", "yyyy": "years", "quarter": "months", "qq": "months", "q": "months",
+          "month": "months", "mm": "months", "m": "months", "week": "days", "wk": "days", "ww": "days",
+          "day": "days", "dd": "days", "d": "days", "hour": "hours", "hh": "hours", "minute": "minutes",
+          "mi": "minutes", "n": "minutes", "second": "seconds", "ss": "seconds", "s": "seconds"}
+_UNIT_FACTOR = {"quarter": 3, "qq": 3, "q": 3, "week": 7, "wk": 7, "ww": 7}
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%f"
+_ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,7})?)?)?")
+_COMPARISON = {"=", "<", ">", "!"}  # single-character tokens: >= is > then =
+_WEEKS = {"week", "wk", "ww"}
+_QUARTERS = {"quarter", "qq", "q"}
+_SECONDS_PER = {"hours": 3600, "minutes": 60, "seconds": 1}
+_NOW = {"GETDATE", "GETUTCDATE", "SYSDATETIME", "SYSUTCDATETIME", "CURRENT_TIMESTAMP"}
+_RENAMES = {"LEN": "length", "ISNULL": "ifnull", "STRING_AGG": "group_concat", "SUBSTRING": "substr",
+            "CEILING": "ceil"}
+
+# operand kinds: "text", "integer", "real", "datetime", "date", or None when unknown
+_NUMERIC = ("integer", "real")
+_COLUMN_KINDS = {"TEXT": "text", "INTEGER": "integer", "REAL": "real", "DATETIME": "datetime"}
+_TYPE_KINDS = {**dict.fromkeys(("INT", "INTEGER", "BIGINT", "SMALLINT", "TINYINT", "BIT"), "integer"),
+               **dict.fromkeys(("DECIMAL", "NUMERIC", "FLOAT", "REAL", "MONEY", "SMALLMONEY"), "real"),
+               **dict.fromkeys(("VARCHAR", "NVARCHAR", "CHAR", "NCHAR"), "text"),
+               **dict.fromkeys(("DATETIME", "DATETIME2", "SMALLDATETIME"), "datetime"), "DATE": "date"}
+_INTEGER_FUNCTIONS = {"COUNT", "COUNT_BIG", "LEN", "DATALENGTH", "CHARINDEX", "DATEDIFF", "YEAR", "MONTH", "DAY"}
+_TEXT_FUNCTIONS = {"LEFT", "RIGHT", "SUBSTRING", "UPPER", "LOWER", "LTRIM", "RTRIM", "TRIM", "REPLACE", "CONCAT",
+                   "STRING_AGG"}
+# the result has the kind of the first argument
+_SAME_KIND = {"SUM", "MIN", "MAX", "AVG", "ABS", "ROUND", "FLOOR", "CEILING", "ISNULL", "COALESCE"}
+# words that can stand right before a unary sign or a parenthesized expression
+_KEYWORDS = {"SELECT", "WHERE", "AND", "OR", "NOT", "WHEN", "THEN", "ELSE", "CASE", "ON", "BY", "HAVING", "AS",
+             "IS", "IN", "LIKE", "BETWEEN", "DISTINCT", "ALL", "EXISTS", "RETURN"}
+VARCHAR_DEFAULT_LENGTH = 30  # CAST(x AS VARCHAR) without a length
+
+
+def _check_like(pattern: str, escape: Optional[str]) -> None:
+    """T-SQL reads [...] in a LIKE pattern as a character class; SQLite matches it literally."""
+    n = 0
+    while n < len(pattern):
+        if escape and pattern[n] == escape:
+            n += 2
+            continue
+        if pattern[n] == "[":
+            raise TranspileError("LIKE with a [...] pattern")
+        n += 1
+
+
+def _value_kind(v: Any) -> Optional[str]:
+    if isinstance(v, (bool, int)):
+        return "integer"
+    if isinstance(v, (float, decimal.Decimal)):
+        return "real"
+    if isinstance(v, str):
+        return "text"
+    if isinstance(v, dt.datetime):
+        return "datetime"
+    if isinstance(v, dt.date):
+        return "date"
+    return None
+
+
+def _stamp(expr: str, *modifiers: str) -> str:
+    """`expr` (plus date modifiers) as DATETIME_FORMAT text."""
+    return f"strftime('{DATETIME_FORMAT}', " + ", ".join((expr,) + modifiers) + ")"
+
+
+def _part(fmt: str, expr: str) -> str:
+    return f"CAST(strftime('{fmt}', {expr}) AS INTEGER)"
+
+
+class _Transpiler:
+    def __init__(self, sql: str, params: Sequence[Any] = (), columns: Optional[Mapping[str, str]] = None) -> None:
+        self.t = tokenize(sql)
+        self.params = params
+        self.columns = {name.lower(): kind for name, kind in (columns or {}).items()}
+        self.like_params: List[Tuple[int, Optional[str]]] = []  # (?N, escape) of LIKE ? patterns
+        # T-SQL ? placeholders become ?1, ?2, ... so arguments can be reordered or repeated
+        self._param_at: Dict[int, int] = {}
+        for n, tok in enumerate(self.t):
+            if tok.text == "?":
+                self._param_at[n] = len(self._param_at) + 1
+
+    def _close(self, i: int) -> int:
+        """Index of the ')' matching the '(' at i."""
+        depth = self.t[i].depth
+        for n in range(i + 1, len(self.t)):
+            if self.t[n].text == ")" and self.t[n].depth == depth:
+                return n
+        raise TranspileError("unbalanced parentheses")
+
+    def _open(self, i: int) -> int:
+        """Index of the '(' matching the ')' at i."""
+        depth = self.t[i].depth
+        for n in range(i - 1, -1, -1):
+            if self.t[n].text == "(" and self.t[n].depth == depth:
+                return n
+        raise TranspileError("unbalanced parentheses")
+
+    def _args(self, i: int) -> Tuple[List[Tuple[int, int]], int]:
+        """Argument ranges of the call whose '(' is at i, and the index of its ')'."""
+        end = self._close(i)
+        args, start = [], i + 1
+        for n in range(i + 1, end):
+            if self.t[n].text == "," and self.t[n].depth == self.t[i].depth + 1:
+                args.append((start, n))
+                start = n + 1
+        if start < end:
+            args.append((start, end))
+        return args, end
+
+    def _word(self, a: Tuple[int, int]) -> str:
+        if a[1] - a[0] != 1 or self.t[a[0]].kind not in ("word", "string"):
+            raise TranspileError("expected a date part")
+        return self.t[a[0]].text.strip("'").lower()
+
+    def _like(self, i: int) -> None:
+        """Check the pattern after the LIKE at i (or note its parameter for `transpile`)."""
+        if i + 1 >= len(self.t):
+            return
+        # the pattern: literals and ? joined by +, e.g. '%' + ? + '%'
+        parts, n = [], i + 1
+        while n < len(self.t):
+            parts.append(n)
+            if n + 1 < len(self.t) and self.t[n + 1].text == "+":
+                n += 2
+                continue
+            break
+        escape = None
+        if n + 2 < len(self.t) and self.t[n + 1].upper == "ESCAPE" and self.t[n + 2].kind == "string":
+            escape = self.t[n + 2].text.lstrip("N")[1:-1].replace("''", "'") or None
+        for n in parts:
+            part = self.t[n]
+            if part.kind == "string":
+                _check_like(part.text.lstrip("N")[1:-1].replace("''", "'"), escape)
+            elif part.text == "?":
+                self.like_params.append((self._param_at[n], escape))
+            else:
+                raise TranspileError("LIKE with a computed pattern")
+
+    # ------------------------------------------------------------ operand kinds
+    def _binary(self, i: int) -> bool:
+        """Whether the sign at i has a left operand (x + y rather than + y)."""
+        if i == 0:
+            return False
+        prev = self.t[i - 1]
+        if prev.kind == "op":
+            return prev.text in (")", "?")
+        return prev.upper not in _KEYWORDS
+
+    def _operand_before(self, i: int) -> Tuple[int, int]:
+        """Token range of the operand right before the operator at i."""
+        n = i - 1
+        if self.t[n].text == ")":
+            start = self._open(n)
+            if start > 0 and self.t[start - 1].kind == "word" and self.t[start - 1].upper not in _KEYWORDS:
+                start -= 1  # a function call
+            return start, n + 1
+        start = n
+        while start >= 2 and self.t[start - 1].text == ".":
+            start -= 2
+        return start, n + 1
+
+    def _operand_after(self, i: int) -> Tuple[int, int]:
+        """Token range of the operand right after the operator at i."""
+        n = i + 1
+        if n >= len(self.t):
+            raise TranspileError("operator without an operand")
+        tok = self.t[n]
+        if tok.text in ("-", "+"):
+            return n, self._operand_after(n)[1]
+        if tok.text == "(":
+            return n, self._close(n) + 1
+        if tok.kind == "word" and n + 1 < len(self.t) and self.t[n + 1].text == "(":
+            return n, self._close(n + 1) + 1
+        end = n
+        while end + 2 < len(self.t) and self.t[end + 1].text == ".":
+            end += 2
+        return n, end + 1
+
+    def _kind(self, start: int, end: int) -> Optional[str]:
+        """Kind of the expression in tokens [start, end), None when it can't be told."""
+        t = self.t
+        if start >= end:
+            return None
+        if end - start == 1:
+            tok = t[start]
+            if tok.kind == "number":
+                return "real" if "." in tok.text else "integer"
+            if tok.kind == "string":
+                return "text"
+            if tok.text == "?":
+                n = self._param_at[start]
+                return _value_kind(self.params[n - 1]) if n <= len(self.params) else None
+            if tok.kind in ("word", "ident"):
+                return _COLUMN_KINDS.get(self.columns.get(tok.text.strip('[]"').lower(), ""))
+            return None
+        # alias.column
+        if all(t[n].text == "." for n in range(start + 1, end, 2)) and \
+                all(t[n].kind in ("word", "ident") for n in range(start, end, 2)) and (end - start) % 2:
+            return self._kind(end - 1, end)
+        if t[start].text == "(" and self._close(start) == end - 1:
+            return self._kind(start + 1, end - 1)
+        if t[start].kind == "word" and t[start + 1].text == "(" and self._close(start + 1) == end - 1:
+            return self._call_kind(t[start].upper, start + 1)
+        # arithmetic: numbers stay numbers; only text + text is text
+        depth = t[start].depth
+        pieces, ops, at = [], set(), start
+        for n in range(start, end):
+            if t[n].depth == depth and t[n].text in ("+", "-", "*", "/", "%"):
+                if n > at:
+                    pieces.append(self._kind(at, n))
+                ops.add(t[n].text)
+                at = n + 1
+        if at < end:
+            pieces.append(self._kind(at, end))
+        if not ops or not pieces:
+            return None
+        if all(k in _NUMERIC for k in pieces):
+            return "real" if "real" in pieces else "integer"
+        if ops == {"+"} and all(k == "text" for k in pieces):
+            return "text"
+        return None
+
+    def _call_kind(self, up: str, paren: int) -> Optional[str]:
+        args, _ = self._args(paren)
+        if up in _INTEGER_FUNCTIONS:
+            return "integer"
+        if up in _TEXT_FUNCTIONS:
+            return "text"
+        if up in _NOW or up == "DATEADD":
+            return "datetime"
+        if up in _SAME_KIND and args:
+            start, end = args[0]
+            if self.t[start].upper in ("DISTINCT", "ALL"):
+                start += 1
+            return self._kind(start, end)
+        if up in ("CAST", "TRY_CAST") and len(args) == 1:
+            at = self._as(paren, args[0])
+            return _TYPE_KINDS.get(self.t[at + 1].upper) if at + 1 < args[0][1] else None
+        if up == "CONVERT" and args:
+            return _TYPE_KINDS.get(self.t[args[0][0]].upper)
+        return None
+
+    def _as(self, paren: int, a: Tuple[int, int]) -> int:
+        """Index of the AS in CAST(x AS type)."""
+        at = next((n for n in range(*a) if self.t[n].upper == "AS" and self.t[n].depth == self.t[paren].depth + 1), None)
+        if at is None:
+            raise TranspileError("CAST without AS")
+        return at
+
+    def _compared_kind(self, i: int) -> Optional[str]:
+        """Kind of what the literal or parameter at i is compared with; None when it isn't compared."""
+        t = self.t
+        n = i - 1
+        if n > 0 and t[n].text in _COMPARISON:
+            while n > 1 and t[n - 1].text in _COMPARISON:
+                n -= 1
+            return self._kind(*self._operand_before(n))
+        n = i + 1
+        if n < len(t) and t[n].text in _COMPARISON:
+            while n + 1 < len(t) and t[n + 1].text in _COMPARISON:
+                n += 1
+            return self._kind(*self._operand_after(n))
+        # x BETWEEN i AND y, x BETWEEN y AND i
+        if i > 1 and t[i - 1].upper == "BETWEEN":
+            return self._kind(*self._operand_before(i - 1))
+        if i > 1 and t[i - 1].upper == "AND":
+            start = self._operand_before(i - 1)[0]
+            if start > 1 and t[start - 1].upper == "BETWEEN":
+                return self._kind(*self._operand_before(start - 1))
+        # x [NOT] IN (..., i, ...)
+        if t[i].depth > 0:
+            paren = next(n for n in range(i - 1, -1, -1) if t[n].text == "(" and t[n].depth == t[i].depth - 1)
+            n = paren - 1
+            if n > 0 and t[n].upper == "IN":
+                if t[n - 1].upper == "NOT":
+                    n -= 1
+                return self._kind(*self._operand_before(n)) if n > 0 else None
+        return None
+
+    def _literal(self, i: int, text: str) -> str:
+        """SQLite for the string or ? at i: compared with a date, it is converted to the date's form."""
+        if self._kind(i, i + 1) != "text":
+            return text
+        kind = self._compared_kind(i)
+        if kind not in ("datetime", "date"):
+            return text
+        tok = self.t[i]
+        value = self.params[self._param_at[i] - 1] if tok.text == "?" else tok.text.lstrip("N")[1:-1]
+        if not _ISO_DATE.fullmatch(value.strip()):
+            # T-SQL reads '03/01/2024' by the session's DATEFORMAT; SQLite can't read it at all
+            raise TranspileError(f"date literal {value!r}")
+        return _stamp(text) if kind == "datetime" else f"date({text})"
+
+    # ---------------------------------------------------------------- render
+    def _gap(self, i: int) -> str:
+        """The space the source had before token i, so '>=' or 'p.name' stay as they were."""
+        if i == 0:
+            return ""
+        prev = self.t[i - 1]
+        return " " if self.t[i].start > prev.start + len(prev.text) else ""
+
+    def _sign(self, i: int) -> str:
+        """SQLite for the binary + or - at i."""
+        left = self._kind(*self._operand_before(i))
+        right = self._kind(*self._operand_after(i))
+        if self.t[i].text == "-":
+            if {"datetime", "date"} & {left, right}:
+                raise TranspileError("- on a date")  # T-SQL subtracts days
+            return "-"
+        if left == right == "text":
+            return "||"
+        if left in _NUMERIC and right in _NUMERIC:
+            return "+"
+        raise TranspileError(f"+ on {left or 'unknown'} and {right or 'unknown'}")
+
+    def render(self, i: int, end: int) -> str:
+        """SQLite text for tokens [i, end); a TOP of the SELECT at this level becomes a trailing LIMIT."""
+        out: List[str] = []
+        limit: Optional[str] = None
+        t = self.t
+        first = i
+        while i < end:
+            tok = t[i]
+            up = tok.upper
+            nxt = t[i + 1] if i + 1 < end else None
+            gap = self._gap(i) if i > first else ""
+            if up == "TOP" and i > 0 and t[i - 1].upper in ("SELECT", "DISTINCT", "ALL"):
+                if nxt is not None and nxt.text == "(":
+                    close = self._close(i + 1)
+                    inner = self.render(i + 2, close)
+                    i = close + 1
+                elif nxt is not None and (nxt.kind == "number" or nxt.text == "?"):
+                    inner = self.render(i + 1, i + 2)
+                    i += 2
+                else:
+                    raise TranspileError("unsupported TOP")
+                if i < end and t[i].upper in ("PERCENT", "WITH"):
+                    raise TranspileError("TOP PERCENT / WITH TIES")
+                if limit is not None:
+                    raise TranspileError("several TOPs at one level")
+                limit = inner
+                continue
+            if up in ("UNION", "EXCEPT", "INTERSECT") and limit is not None:
+                raise TranspileError("TOP before a set operator")
+            if (up == "DBO" or tok.text.lower() == "[dbo]") and nxt is not None and nxt.text == ".":
+                out.append(gap)
+                i += 2
+                continue
+            if tok.kind == "string":
+                out.append(gap + self._literal(i, tok.text[1:] if tok.text[0] == "N" else tok.text))
+                i += 1
+                continue
+            if tok.text == "?":
+                out.append(gap + self._literal(i, f"?{self._param_at[i]}"))
+                i += 1
+                continue
+            if up == "LIKE":
+                self._like(i)
+            if tok.text in ("+", "-") and self._binary(i):
+                out.append(gap + self._sign(i))
+                i += 1
+                continue
+            if up == "WITH" and nxt is not None and nxt.text == "(" and i + 2 < end and t[i + 2].upper == "NOLOCK":
+                i = self._close(i + 1) + 1
+                continue
+            if up == "CURRENT_TIMESTAMP":
+                out.append(gap + _stamp("'now'"))
+                i += 1
+                continue
+            if tok.kind == "word" and nxt is not None and nxt.text == "(":
+                fn = self._function(i, up)
+                if fn is not None:
+                    text, i = fn
+                    out.append(gap + text)
+                    continue
+            if tok.text == "(":
+                close = self._close(i)
+                out.append(gap + "(" + self.render(i + 1, close) + ")")
+                i = close + 1
+                continue
+            out.append(gap + tok.text)
+            i += 1
+        text = "".join(out)
+        if limit is not None:
+            text += f" LIMIT {limit}"
+        return text
+
+    def _size(self, to: Tuple[int, int], n: int, default: Optional[int]) -> Optional[int]:
+        """The n-th number in a type's (...), e.g. 10 in VARCHAR(10); None for MAX."""
+        start, end = to
+        if end - start == 1:
+            return default
+        parts = [tok for tok in self.t[start + 2:end - 1] if tok.text != ","]
+        if n >= len(parts):
+            return default
+        if parts[n].upper == "MAX":
+            return None
+        if parts[n].kind != "number":
+            raise TranspileError(f"{self.t[start].upper} size")
+        return int(parts[n].text)
+
+    def _cast(self, a: Tuple[int, int], to: Tuple[int, int]) -> str:
+        expr = self.render(*a)
+        kind = self.t[to[0]].upper
+        if kind == "DATE":
+            return f"date({expr})"
+        if kind in ("DATETIME", "DATETIME2", "SMALLDATETIME"):
+            return _stamp(expr)
+        if kind in ("CHAR", "NCHAR"):
+            raise TranspileError(f"CAST to {kind}")  # T-SQL pads to the length
+        if kind in ("VARCHAR", "NVARCHAR"):
+            if self._kind(*a) not in ("text", "integer"):
+                raise TranspileError(f"CAST of a {self._kind(*a) or 'value of unknown type'} to {kind}")
+            length = self._size(to, 0, VARCHAR_DEFAULT_LENGTH)
+            return f"CAST({expr} AS TEXT)" if length is None else f"substr(CAST({expr} AS TEXT), 1, {length})"
+        if kind in ("DECIMAL", "NUMERIC"):
+            scale = self._size(to, 1, 0)
+            return f"round({expr}, {scale})" if scale else f"CAST(round({expr}) AS INTEGER)"
+        # SQLite picks the affinity from the type name: INT -> INTEGER, FLOAT -> REAL
+        return f"CAST({expr} AS {self.render(*to)})"
+
+    def _function(self, i: int, up: str) -> Optional[Tuple[str, int]]:
+        args, close = self._args(i + 1)
+
+        def arg(n: int) -> str:
+            return self.render(*args[n])
+
+        nargs = len(args)
+        if up in _NOW and nargs == 0:
+            return _stamp("'now'"), close + 1
+        if up in _RENAMES:
+            return f"{_RENAMES[up]}(" + ", ".join(arg(n) for n in range(nargs)) + ")", close + 1
+        if up in ("YEAR", "MONTH", "DAY") and nargs == 1:
+            fmt = {"YEAR": "%Y", "MONTH": "%m", "DAY": "%d"}[up]
+            return f"CAST(strftime('{fmt}', {arg(0)}) AS INTEGER)", close + 1
+        if up == "CHARINDEX" and nargs == 2:
+            return f"instr({arg(1)}, {arg(0)})", close + 1
+        if up == "LEFT" and nargs == 2:
+            return f"substr({arg(0)}, 1, {arg(1)})", close + 1
+        if up == "RIGHT" and nargs == 2:
+            return f"substr({arg(0)}, -({arg(1)}))", close + 1
+        if up in ("CAST", "TRY_CAST") and nargs == 1:
+            at = self._as(i + 1, args[0])
+            return self._cast((args[0][0], at), (at + 1, args[0][1])), close + 1
+        if up == "CONVERT" and nargs == 3:
+            raise TranspileError("CONVERT with a style")
+        if up == "CONVERT" and nargs == 2:
+            return self._cast(args[1], args[0]), close + 1
+        if up == "AVG" and nargs == 1:
+            kind = self._call_kind(up, i + 1)
+            if kind == "integer":
+                # T-SQL averages integers in integer arithmetic
+                return f"CAST(avg({arg(0)}) AS INTEGER)", close + 1
+            if kind != "real":
+                raise TranspileError(f"AVG of a {kind or 'value of unknown type'}")
+            return None
+        if up == "CONCAT":
+            return "(" + " || ".join(f"ifnull({arg(n)}, '')" for n in range(nargs)) + ")", close + 1
+        if up == "DATEADD" and nargs == 3:
+            unit = self._word(args[0])
+            if unit not in _UNITS:
+                raise TranspileError(f"DATEADD {unit}")
+            n = f"({arg(1)}) * {_UNIT_FACTOR[unit]}" if unit in _UNIT_FACTOR else f"({arg(1)})"
+            return _stamp(arg(2), f"({n}) || ' {_UNITS[unit]}'"), close + 1
+        if up == "DATEDIFF" and nargs == 3:
+            # T-SQL counts the unit boundaries between the two, not whole units elapsed
+            word, a, b = self._word(args[0]), arg(1), arg(2)
+            unit = _UNITS.get(word)
+            if word in _WEEKS:
+                # the Sunday that starts each one's week
+                sa, sb = (f"julianday(date({x}, '-6 days', 'weekday 0'))" for x in (a, b))
+                return f"CAST(round(({sb} - {sa}) / 7) AS INTEGER)", close + 1
+            if unit == "days":
+                return f"CAST(julianday(date({b})) - julianday(date({a})) AS INTEGER)", close + 1
+            if word in _QUARTERS:
+                return (f"(({_part('%Y', b)} - {_part('%Y', a)}) * 4"
+                        f" + ({_part('%m', b)} - 1) / 3 - ({_part('%m', a)} - 1) / 3)"), close + 1
+            if unit == "months":
+                return (f"(({_part('%Y', b)} - {_part('%Y', a)}) * 12"
+                        f" + {_part('%m', b)} - {_part('%m', a)})"), close + 1
+            if unit == "years":
+                return f"({_part('%Y', b)} - {_part('%Y', a)})", close + 1
+            if unit in _SECONDS_PER:
+                # %s drops the fraction; whole epoch seconds divide down to the hour or minute
+                per = _SECONDS_PER[unit]
+                return f"({_part('%s', b)} / {per} - {_part('%s', a)} / {per})", close + 1
+            raise TranspileError("DATEDIFF unit")
+        if up in ("FORMAT", "PATINDEX", "STUFF", "OBJECT_ID", "NEWID"):
+            raise TranspileError(up)
+        return None
+
+
+def transpile(sql: str, params: Sequence[Any] = (), columns: Optional[Mapping[str, str]] = None) -> str:
+    """SQLite text for a T-SQL SELECT, its ? placeholders numbered; TranspileError if it can't be done.
+
+    `columns` maps column names to their SQLite type (TEXT, INTEGER, REAL, DATETIME).
+    """
+    tr = _Transpiler(sql, params, columns)
+    text = tr.render(0, len(tr.t))
+    for n, escape in tr.like_params:
+        if n <= len(params) and isinstance(params[n - 1], str):
+            _check_like(params[n - 1], escape)
+    return text
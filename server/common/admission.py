@@ -0,0 +1,224 @@
+"""
+Admission control and priority load shedding.
+
+Every request is put in a lane before it reaches the routers:
+
+    checkout   POST /command/product/{id}/sale|purchase
+    command    the rest of /command/*
+    read       /query/* product endpoints
+    analytics  report aggregates (/query/products_*) and one-shot /chat/*
+    stream     /chat/*/stream (SSE answers)
+
+Each lane has its own concurrency limit, queue length and maximum queue wait
+(ADMIT_<LANE>="limit:queue:wait_s"). Lanes never borrow each other's slots,
+and the sync-endpoint threadpool is sized to the sum of the limits (plus
+ADMIT_SPARE_THREADS for unclassified routes), so a burst of reports or chat
+SQL can't take the threads a sale needs. While a higher-priority lane has
+requests waiting, lower lanes stop queueing and shed new arrivals. Shed or
+timed-out requests get 503 with Retry-After.
+
+A streaming answer holds its slot until the last event is sent, which is
+mostly time spent waiting on the LLM. Streams get their own lane, wider and
+least important, so a few open chat windows can't starve report aggregates
+of the four analytics slots, and under load they are shed before anything
+else. The slot is kept for the whole stream rather than dropped after the
+first byte, because the SQL and LLM work that needs bounding happens after it.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+log = logging.getLogger("smartmarket.admission")
+
+ADMISSION = os.getenv("ADMISSION", "1") != "0"
+ADMIT_SPARE_THREADS = int(os.getenv("ADMIT_SPARE_THREADS", "8"))
+
+# lane, priority (0 = most important), default "limit:queue:wait_s"
+LANES: List[Tuple[str, int, str]] = [
+    ("checkout", 0, "16:200:10"),
+    ("command", 1, "8:50:5"),
+    ("read", 2, "12:50:2"),
+    ("analytics", 3, "4:8:1"),
+    ("stream", 4, "12:12:2"),
+]
+
+# first match wins; unmatched paths (/healthz, /readyz, /debug, docs) are never queued
+ROUTES: List[Tuple["re.Pattern[str]", str]] = [
+    (re.compile(r"^/command/product/[^/]+/(sale|purchase)$"), "checkout"),
+    (re.compile(r"^/command/"), "command"),
+    (re.compile(r"^/query/products_"), "analytics"),
+    (re.compile(r"^/query/"), "read"),
+    (re.compile(r"^/chat/.*/stream$"), "stream"),
+    (re.compile(r"^/chat/"), "analytics"),
+]
+
+
+class Lane:
+    def __init__(self, name: str, priority: int, limit: int, queue: int, max_wait_s: float) -> None:
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.queue = queue
+        self.max_wait_s = max_wait_s
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.wait_s_total = 0.0
+        self.service_s_total = 0.0
+
+    @classmethod
+    def from_env(cls, name: str, priority: int, default: str) -> "Lane":
+        limit, queue, wait_s = os.getenv(f"ADMIT_{name.upper()}", default).split(":")
+        return cls(name, priority, int(limit), int(queue), float(wait_s))
+
+    async def acquire(self, pressure: bool) -> bool:
+        """Take a slot, queueing if allowed; False means the request must be shed."""
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if pressure or len(self.waiters) >= self.queue:
+            self.shed += 1
+            return False
+
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self.waiters.append(fut)
+        self.queued += 1
+        start = time.perf_counter()
+        timer = loop.call_later(self.max_wait_s, lambda: fut.done() or fut.set_result(False))
+        try:
+            granted = await fut
+        except asyncio.CancelledError:
+            # client went away; give back a slot that was handed to us in the meantime
+            if fut.done() and not fut.cancelled() and fut.result():
+                self.release()
+            else:
+                self._forget(fut)
+            raise
+        finally:
+            timer.cancel()
+        self.wait_s_total += time.perf_counter() - start
+        if not granted:
+            self._forget(fut)
+            self.timed_out += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        self.active -= 1
+        while self.waiters:
+            fut = self.waiters.popleft()
+            if not fut.done():
+                self.active += 1  # the slot passes straight to the next waiter
+                fut.set_result(True)
+                return
+
+    def _forget(self, fut: asyncio.Future) -> None:
+        try:
+            self.waiters.remove(fut)
+        except ValueError:
+            pass
+
+    def retry_after(self) -> int:
+        """Rough time for the current queue to drain, from the lane's mean service time."""
+        done = max(self.admitted - self.active, 1)
+        mean = self.service_s_total / done if self.service_s_total else 0.5
+        return max(1, math.ceil(mean * (len(self.waiters) + 1) / max(self.limit, 1)))
+
+    def stats(self) -> Dict[str, Any]:
+        done = max(self.admitted - self.active, 1)
+        return {
+            "lane": self.name,
+            "priority": self.priority,
+            "limit": self.limit,
+            "queue": self.queue,
+            "max_wait_s": self.max_wait_s,
+            "active": self.active,
+            "waiting": len(self.waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": self.shed,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(self.wait_s_total / max(self.queued, 1) * 1000, 2),
+            "avg_service_ms": round(self.service_s_total / done * 1000, 2),
+        }
+
+
+class AdmissionController:
+    def __init__(self) -> None:
+        self.lanes: Dict[str, Lane] = {name: Lane.from_env(name, prio, default) for name, prio, default in LANES}
+
+    def classify(self, path: str) -> Optional[Lane]:
+        for pattern, lane in ROUTES:
+            if pattern.match(path):
+                return self.lanes[lane]
+        return None
+
+    def under_pressure(self, lane: Lane) -> bool:
+        """True while any more important lane has requests queued."""
+        return any(other.waiters for other in self.lanes.values() if other.priority < lane.priority)
+
+    def thread_budget(self) -> int:
+        return sum(lane.limit for lane in self.lanes.values()) + ADMIT_SPARE_THREADS
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [lane.stats() for lane in sorted(self.lanes.values(), key=lambda l: l.priority)]
+
+
+admission = AdmissionController()
+
+
+def size_threadpool() -> None:
+    """Give sync endpoints exactly the threads the lanes can use (anyio defaults to 40)."""
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = admission.thread_budget()
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware: per-lane slots in front of the routers; 503 + Retry-After when shedding."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION:
+            return await self.app(scope, receive, send)
+        lane = admission.classify(scope["path"])
+        if lane is None:
+            return await self.app(scope, receive, send)
+
+        if not await lane.acquire(admission.under_pressure(lane)):
+            log.info("shed %s %s (lane %s)", scope["method"], scope["path"], lane.name)
+            return await self._reject(send, lane)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.service_s_total += time.perf_counter() - start
+            lane.release()
+
+    @staticmethod
+    async def _reject(send, lane: Lane) -> None:
+        body = json.dumps({"detail": f"Server busy ({lane.name}), retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(lane.retry_after()).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,274 @@
+"""
+Memoization for read-model methods: in-process L1, optional Redis L2.
+
+    @memoize(ttl_s=300, stale_s=600, tags=lambda: (CATEGORIES,))
+    def distinct_categories(): ...
+
+Each decorated function gets its own LRU (`max_entries`). A fresh entry is
+returned as is. An entry past its TTL but within `stale_s` is still returned
+immediately while one background thread refreshes it (stale-while-revalidate),
+so no caller waits on an expiring aggregate. Older entries are recomputed
+inline.
+
+Tags are the read scopes from common.versioning (product:<id>, catalog,
+products_profit, ...). Every `data_versions.bump` drops the entries tagged
+with a bumped scope, and `bump_all` clears everything, so writeModel commits
+invalidate exactly what they change. Per-function hit/miss/stale/eviction
+counters are served at /debug/cache. CACHE=0 disables the layer.
+
+With REDIS_URL set, L1 misses are looked up in the shared L2 before running
+the query, and invalidations reach every worker (see common.shared_cache).
+
+Replicas trail the primary by up to MAX_REPLICA_LAG_S, so two rules keep
+pre-write rows out of the cache:
+
+- a caller pinned to the primary (it sent a fresh X-Write-Token, see
+  common.consistency) bypasses L1 and L2 and reads the primary;
+- for MAX_REPLICA_LAG_S after one of an entry's tags is bumped, the value
+  is recomputed on the primary before it is stored. Otherwise the first
+  reader after a write could put the replica's old rows back under the new
+  ETag for a whole TTL.
+
+The second rule holds with CACHE=0 too: the ETag moves with the bump, so a
+replica read in that window would hand the client old rows it then keeps
+getting 304s for.
+"""
+from __future__ import annotations
+import functools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, FrozenSet, Hashable, Iterable, List, Optional
+
+from common import shared_cache
+from common.consistency import MAX_REPLICA_LAG_S, reading_primary, wants_primary
+from common.versioning import data_versions
+
+log = logging.getLogger("smartmarket.cache")
+
+CACHE = os.getenv("CACHE", "1") != "0"
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "512"))
+CACHE_REFRESH_WORKERS = int(os.getenv("CACHE_REFRESH_WORKERS", "2"))
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "stale_until", "tags")
+
+    def __init__(self, value: Any, ttl_s: float, stale_s: float, tags: FrozenSet[str]) -> None:
+        self.value = value
+        self.expires_at = time.monotonic() + ttl_s
+        self.stale_until = self.expires_at + stale_s
+        self.tags = tags
+
+
+class MemoCache:
+    """The LRU behind one memoized function."""
+
+    def __init__(self, name: str, ttl_s: float, stale_s: float, max_entries: int) -> None:
+        self.name = name
+        self.ttl_s = ttl_s
+        self.stale_s = stale_s
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._refreshing: set = set()
+        # bumped by every invalidation; a computation that straddles one must not be stored
+        self._epoch = 0
+        self.hits = self.misses = self.stale_hits = self.l2_hits = 0
+        self.refreshes = self.evictions = self.invalidations = 0
+
+    def get(self, key: Hashable, compute: Callable[[], Any], tags: FrozenSet[str]) -> Any:
+        if wants_primary():
+            # read-your-writes: whatever is cached may predate the caller's write
+            return compute()
+        compute = _on_primary_after_bump(compute, tags)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.stale_until:
+                self._entries.move_to_end(key)
+                if now < entry.expires_at:
+                    self.hits += 1
+                    return entry.value
+                self.stale_hits += 1
+                self._refresh_later(key, compute, tags)
+                return entry.value
+            self.misses += 1
+            epoch = self._epoch
+
+        l2 = shared_cache.l2
+        versions = None
+        if l2 is not None:
+            found, versions = l2.get(self.name, key, tags)
+            if found is not None:
+                value, expires_at = found
+                remaining = expires_at - time.time()
+                with self._lock:
+                    self.l2_hits += 1
+                self._store(key, value, tags, epoch, ttl_s=remaining)
+                if remaining <= 0:
+                    with self._lock:
+                        self._refresh_later(key, compute, tags)
+                return value
+
+        value = compute()
+        self._store(key, value, tags, epoch)
+        if l2 is not None:
+            l2.set(self.name, key, value, versions, self.ttl_s, self.ttl_s + self.stale_s)
+        return value
+
+    def _refresh_later(self, key: Hashable, compute: Callable[[], Any], tags: FrozenSet[str]) -> None:
+        # caller holds self._lock
+        if key not in self._refreshing:
+            self._refreshing.add(key)
+            _refresher().submit(self._refresh, key, compute, tags)
+
+    def _refresh(self, key: Hashable, compute: Callable[[], Any], tags: FrozenSet[str]) -> None:
+        compute = _on_primary_after_bump(compute, tags)
+        try:
+            with self._lock:
+                epoch = self._epoch
+            l2 = shared_cache.l2
+            versions = l2.versions(tags) if l2 is not None else None
+            value = compute()
+            self._store(key, value, tags, epoch)
+            if l2 is not None:
+                l2.set(self.name, key, value, versions, self.ttl_s, self.ttl_s + self.stale_s)
+            with self._lock:
+                self.refreshes += 1
+        except Exception as e:
+            log.warning("background refresh of %s failed: %s", self.name, e)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key: Hashable, value: Any, tags: FrozenSet[str], epoch: int, ttl_s: Optional[float] = None) -> None:
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            self._entries[key] = _Entry(value, self.ttl_s if ttl_s is None else ttl_s, self.stale_s, tags)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, scopes: Optional[Iterable[str]]) -> None:
+        with self._lock:
+            self._epoch += 1
+            if scopes is None:
+                dropped = list(self._entries)
+            else:
+                scopes = set(scopes)
+                dropped = [k for k, e in self._entries.items() if e.tags & scopes]
+            for key in dropped:
+                del self._entries[key]
+            self.invalidations += len(dropped)
+
+    def clear(self) -> None:
+        self.invalidate(None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                "function": self.name,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_s": self.ttl_s,
+                "stale_s": self.stale_s,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "l2_hits": self.l2_hits,
+                "hit_rate": round((self.hits + self.stale_hits) / lookups, 3) if lookups else None,
+                "refreshes": self.refreshes,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_caches: List[MemoCache] = []
+
+
+@functools.lru_cache(maxsize=1)
+def _refresher() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=CACHE_REFRESH_WORKERS, thread_name_prefix="cache-refresh")
+
+
+# scope -> monotonic time of its last bump; ALL for bump_all
+_bumped_at: Dict[str, float] = {}
+_bumped_lock = threading.Lock()
+ALL = "*"
+
+
+def _recently_bumped(tags: FrozenSet[str]) -> bool:
+    since = time.monotonic() - MAX_REPLICA_LAG_S
+    with _bumped_lock:
+        return _bumped_at.get(ALL, 0.0) > since or any(_bumped_at.get(t, 0.0) > since for t in tags)
+
+
+def _on_primary_after_bump(compute: Callable[[], Any], tags: FrozenSet[str]) -> Callable[[], Any]:
+    """`compute`, run against the primary while a replica may still be missing a write to `tags`."""
+    def run() -> Any:
+        if not _recently_bumped(tags):
+            return compute()
+        with reading_primary():
+            return compute()
+    return run
+
+
+def _mark_bumped(scopes: Iterable[str]) -> None:
+    """Start the MAX_REPLICA_LAG_S window of `scopes` (ALL for every scope)."""
+    now = time.monotonic()
+    with _bumped_lock:
+        for scope in scopes:
+            _bumped_at[scope] = now
+        if len(_bumped_at) > 10000:
+            # product scopes pile up; only the last MAX_REPLICA_LAG_S matter
+            for scope in [s for s, t in _bumped_at.items() if now - t > MAX_REPLICA_LAG_S]:
+                del _bumped_at[scope]
+
+
+def _on_bump(scopes: Optional[Iterable[str]]) -> None:
+    scopes = None if scopes is None else tuple(scopes)
+    _mark_bumped((ALL,) if scopes is None else scopes)
+    for cache in _caches:
+        cache.invalidate(scopes)
+
+
+data_versions.subscribe(_on_bump)
+# bumps other workers made whose publish may not be here yet
+shared_cache.recent_bump_listeners.append(_mark_bumped)
+
+
+def memoize(ttl_s: float, stale_s: float = 0.0, tags: Optional[Callable[..., Iterable[str]]] = None,
+            max_entries: int = CACHE_MAX_ENTRIES):
+    """Decorator: cache results per argument tuple; `tags(*args, **kwargs)` names the scopes they depend on."""
+    def deco(fn):
+        cache = MemoCache(fn.__qualname__, ttl_s, stale_s, max_entries)
+        _caches.append(cache)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            entry_tags = frozenset(tags(*args, **kwargs)) if tags else frozenset()
+            if not CACHE:
+                # still on the primary right after a bump: the ETag already names the new version
+                return _on_primary_after_bump(lambda: fn(*args, **kwargs), entry_tags)()
+            key = (args, tuple(sorted(kwargs.items())))
+            return cache.get(key, lambda: fn(*args, **kwargs), entry_tags)
+
+        wrapper.cache = cache
+        return wrapper
+    return deco
+
+
+def cache_stats() -> List[Dict[str, Any]]:
+    return [c.stats() for c in _caches]
+
+
+def clear_caches() -> None:
+    for c in _caches:
+        c.clear()
@@ -0,0 +1,83 @@
+"""
+Negotiated response compression (brotli when available and accepted, else gzip).
+
+Only complete bodies above COMPRESS_MIN_BYTES are compressed; streamed
+responses (more_body=True, e.g. server-sent events) pass through untouched.
+"""
+from __future__ import annotations
+import gzip
+import os
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESSIBLE = (b"application/json", b"text/", b"application/vnd.msgpack")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    offered = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip().lower()] = q
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = None
+        for key, value in scope.get("headers") or ():
+            if key == b"accept-encoding":
+                encoding = choose_encoding(value.decode("latin-1"))
+                break
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if start_message is None:
+                return await send(message)
+
+            start, start_message = start_message, None
+            headers = dict(start.get("headers") or ())
+            body = message.get("body", b"")
+            eligible = (
+                not message.get("more_body", False)
+                and len(body) >= self.minimum_size
+                and b"content-encoding" not in headers
+                and headers.get(b"content-type", b"").startswith(COMPRESSIBLE)
+            )
+            if eligible:
+                body = brotli.compress(body, quality=4) if encoding == "br" else gzip.compress(body, compresslevel=5)
+                raw = [(k, v) for k, v in start.get("headers") or () if k not in (b"content-length", b"content-encoding")]
+                raw += [(b"content-encoding", encoding.encode()), (b"content-length", str(len(body)).encode()), (b"vary", b"Accept-Encoding")]
+                start = {**start, "headers": raw}
+                message = {**message, "body": body}
+            await send(start)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
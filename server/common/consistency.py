@@ -0,0 +1,96 @@
+"""
+Read-your-writes on top of read replicas.
+
+Replicas trail the primary by up to MAX_REPLICA_LAG_S. A request that
+changed data (it bumped data_versions) answers with an `X-Write-Token`; a
+client that sends it back gets its reads from the primary until the token is
+older than that bound. Only that client is pinned: everyone else keeps
+reading from the replicas, however many writes there are. Read-only POSTs
+(/chat/ask without a confirmed write, /chat/analyze_note) get no token.
+
+Reads of a scope bumped within MAX_REPLICA_LAG_S go to the primary for
+everyone (common.cache, whether or not CACHE is on): they are answered with
+the new ETag, so replica rows from before the write would stick.
+"""
+from __future__ import annotations
+import contextlib
+import contextvars
+import os
+import time
+from typing import List, Optional
+
+from common.versioning import data_versions
+
+MAX_REPLICA_LAG_S = float(os.getenv("MAX_REPLICA_LAG_S", "5"))
+WRITE_TOKEN_HEADER = "X-Write-Token"
+_WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+_read_primary: contextvars.ContextVar[bool] = contextvars.ContextVar("read_primary", default=False)
+# per request: a mutable flag, so a write run in the threadpool (a copied context) still sets it
+_wrote: contextvars.ContextVar[Optional[List[bool]]] = contextvars.ContextVar("wrote", default=None)
+
+
+def _note_write(scopes) -> None:
+    # bumps relayed from other workers, or made by background jobs, have no request to mark
+    flag = _wrote.get()
+    if flag is not None:
+        flag[0] = True
+
+
+data_versions.subscribe(_note_write)
+
+
+def issue_token() -> str:
+    """Commit time in epoch ms; opaque to clients, they only echo it."""
+    return str(int(time.time() * 1000))
+
+
+def token_is_fresh(token: str) -> bool:
+    try:
+        written_at = int(token) / 1000
+    except ValueError:
+        return False
+    return time.time() - written_at < MAX_REPLICA_LAG_S
+
+
+def wants_primary() -> bool:
+    return _read_primary.get()
+
+
+@contextlib.contextmanager
+def reading_primary():
+    """Send the reads inside the block to the primary (e.g. to refill a cache right after a write)."""
+    reset = _read_primary.set(True)
+    try:
+        yield
+    finally:
+        _read_primary.reset(reset)
+
+
+class ConsistencyMiddleware:
+    """Pure ASGI middleware: honors X-Write-Token on the way in, issues one after requests that wrote."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        token = dict(scope.get("headers") or ()).get(b"x-write-token")
+        reset = _read_primary.set(token is not None and token_is_fresh(token.decode("latin-1")))
+        wrote = [False]
+        reset_wrote = _wrote.set(wrote)
+
+        async def send_with_token(message):
+            if message["type"] == "http.response.start" and 200 <= message["status"] < 300 and wrote[0]:
+                headers = list(message.get("headers") or [])
+                headers.append((b"x-write-token", issue_token().encode()))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_token if scope["method"] in _WRITE_METHODS else send)
+        finally:
+            _wrote.reset(reset_wrote)
+            _read_primary.reset(reset)
@@ -1,12 +1,25 @@
-import pyodbc
+import logging
 import os
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
+from common.query_stats import query_stats
+from common.tracing import span
+from common.consistency import wants_primary
 
 load_dotenv()
 
+log = logging.getLogger("smartmarket.db")
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))         # opened by the startup warm-up
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))        # idle connections kept; 0 disables pooling
+DB_POOL_IDLE_S = float(os.getenv("DB_POOL_IDLE_S", "300"))  # Azure SQL drops idle sessions after a while
+
 DRIVER_OPTIONS = [
     "ODBC Driver 18 for SQL Server",
-    "ODBC Driver 17 for SQL Server", 
+    "ODBC Driver 17 for SQL Server",
     "ODBC Driver 13 for SQL Server",
     "ODBC Driver 11 for SQL Server",
     "SQL Server Native Client 11.0",
@@ -22,16 +35,298 @@ def get_working_driver():
             return driver
     return "ODBC Driver 18 for SQL Server"
 
-PYODBC_CONN = (
-    f"DRIVER={{{get_working_driver()}}};"
-    f"SERVER={os.getenv('DB_SERVER')};"
-    f"DATABASE={os.getenv('DB_NAME')};"
-    f"UID={os.getenv('DB_USER')};"
-    f"PWD={os.getenv('DB_PASS')};"
-    "Encrypt=yes;"
-    "TrustServerCertificate=yes;"
-)
-
-def get_conn():
-    """Open a new DB connection. Caller should close it (context manager recommended)."""
-    return pyodbc.connect(PYODBC_CONN)
+DB_READ_SERVERS = [h.strip() for h in os.getenv("DB_READ_SERVERS", "").split(",") if h.strip()]
+DB_READ_INTENT = os.getenv("DB_READ_INTENT", "1") != "0"    # ApplicationIntent=ReadOnly on replica connections
+REPLICA_COOLDOWN_S = float(os.getenv("REPLICA_COOLDOWN_S", "30"))
+
+
+@lru_cache(maxsize=None)
+def get_conn_str(server: Optional[str] = None, read_only: bool = False) -> str:
+    """Built on the first connection: probing ODBC drivers at import slowed every cold start.
+
+    Replica connections may use their own login (DB_READ_USER/DB_READ_PASS).
+    """
+    user = (read_only and os.getenv("DB_READ_USER")) or os.getenv("DB_USER")
+    password = (read_only and os.getenv("DB_READ_PASS")) or os.getenv("DB_PASS")
+    return (
+        f"DRIVER={{{get_working_driver()}}};"
+        f"SERVER={server or os.getenv('DB_SERVER')};"
+        f"DATABASE={os.getenv('DB_NAME')};"
+        f"UID={user};"
+        f"PWD={password};"
+        "Encrypt=yes;"
+        "TrustServerCertificate=yes;"
+        + ("ApplicationIntent=ReadOnly;" if read_only and DB_READ_INTENT else "")
+    )
+
+
+class TimedCursor:
+    """Cursor proxy: times every execute() and counts fetched rows into query_stats."""
+
+    def __init__(self, cur, label: str):
+        self._cur = cur
+        self._label = label
+        self._stat = None
+
+    def execute(self, sql, *params):
+        with span("db.query", **{"db.label": self._label}) as sp:
+            start = time.perf_counter()
+            failed = True
+            try:
+                self._cur.execute(sql, *params)
+                failed = False
+            finally:
+                # pyodbc accepts both execute(sql, seq) and execute(sql, *args); log whichever was used.
+                logged = params[0] if len(params) == 1 and isinstance(params[0], (list, tuple)) else params
+                self._stat = query_stats.record(sql, logged, time.perf_counter() - start, label=self._label, failed=failed)
+                sp.set(**{"db.statement": self._stat.fingerprint})
+        return self
+
+    def fetchone(self):
+        row = self._cur.fetchone()
+        if row is not None:
+            query_stats.add_rows(self._stat, 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._cur.fetchmany(size) if size is not None else self._cur.fetchmany()
+        query_stats.add_rows(self._stat, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cur.fetchall()
+        query_stats.add_rows(self._stat, len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self._cur:
+            query_stats.add_rows(self._stat, 1)
+            yield row
+
+    def __enter__(self):
+        self._cur.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._cur.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+
+def _is_disconnect(exc: BaseException) -> bool:
+    # ODBC SQLSTATE class 08 = connection exception; such a connection must not be reused
+    args = getattr(exc, "args", ())
+    return bool(args) and isinstance(args[0], str) and args[0].startswith("08")
+
+
+class ConnectionPool:
+    """Idle pyodbc connections to one server, newest first so the warm ones get picked.
+
+    A replica that fails to connect (or drops a connection) is marked down for
+    REPLICA_COOLDOWN_S; reads skip it meanwhile.
+    """
+
+    def __init__(self, name: str, server: Optional[str] = None, read_only: bool = False,
+                 max_idle: int = DB_POOL_MAX, idle_timeout: float = DB_POOL_IDLE_S):
+        self.name = name
+        self.server = server
+        self.read_only = read_only
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._idle: List[Tuple[Any, float]] = []
+        self.in_use = 0
+        self.opened = 0
+        self.reused = 0
+        self.failures = 0
+        self.down_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def mark_down(self, reason: BaseException) -> None:
+        self.failures += 1
+        if self.read_only:
+            self.down_until = time.monotonic() + REPLICA_COOLDOWN_S
+            log.warning("replica %s marked down for %gs: %s", self.name, REPLICA_COOLDOWN_S, reason)
+
+    def acquire(self):
+        now = time.monotonic()
+        stale = []
+        conn = None
+        with self._lock:
+            while self._idle:
+                candidate, since = self._idle.pop()
+                if now - since <= self.idle_timeout:
+                    conn = candidate
+                    self.reused += 1
+                    break
+                stale.append(candidate)
+        for c in stale:
+            self._close(c)
+        if conn is None:
+            conn = self._open()
+        with self._lock:
+            self.in_use += 1
+        return conn
+
+    def release(self, conn, healthy: bool = True) -> None:
+        with self._lock:
+            self.in_use -= 1
+            if healthy and len(self._idle) < self.max_idle:
+                self._idle.append((conn, time.monotonic()))
+                return
+        self._close(conn)
+
+    def warm(self, n: int = DB_POOL_MIN) -> int:
+        """Open connections until `n` are idle; returns how many were opened."""
+        with self._lock:
+            missing = min(n, self.max_idle) - len(self._idle)
+        fresh = [self._open() for _ in range(max(missing, 0))]
+        with self._lock:
+            for conn in fresh:
+                self._idle.append((conn, time.monotonic()))
+        return len(fresh)
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"name": self.name, "idle": len(self._idle), "in_use": self.in_use, "max_idle": self.max_idle,
+                    "opened": self.opened, "reused": self.reused, "failures": self.failures, "healthy": self.healthy}
+
+    def _open(self):
+        import pyodbc
+        try:
+            with span("db.connect", **{"db.pool": self.name}):
+                conn = pyodbc.connect(get_conn_str(self.server, self.read_only))
+        except Exception as e:
+            self.mark_down(e)
+            raise
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    @staticmethod
+    def _close(conn) -> None:
+        try:
+            conn.close()
+        except Exception as e:
+            log.debug("closing pooled connection failed: %s", e)
+
+
+# the command side (and anything that must see its own writes) uses the primary
+pool = ConnectionPool("primary")
+replicas = [ConnectionPool(f"replica:{server}", server, read_only=True) for server in DB_READ_SERVERS]
+
+
+def _read_replicas() -> List[ConnectionPool]:
+    """Healthy replicas, least busy first."""
+    return sorted((p for p in replicas if p.healthy), key=lambda p: p.in_use)
+
+
+def all_pools() -> List[ConnectionPool]:
+    return [pool] + replicas
+
+
+def warm_pools(n: int = DB_POOL_MIN) -> None:
+    """Fill every pool; a replica that is down only gets skipped, the primary has to be up."""
+    pool.warm(n)
+    for replica in replicas:
+        try:
+            replica.warm(n)
+        except Exception as e:
+            log.warning("could not warm %s: %s", replica.name, e)
+
+
+class TimedConnection:
+    """Connection proxy whose cursors report to query_stats; everything else is pyodbc's.
+
+    Leaving the `with` block commits (or rolls back on error) like pyodbc does,
+    then hands the connection back to its pool instead of dropping it.
+    """
+
+    def __init__(self, conn, label: str, owner: ConnectionPool = pool):
+        self._conn = conn
+        self._label = label
+        self._owner = owner
+
+    def cursor(self):
+        return TimedCursor(self._conn.cursor(), self._label)
+
+    def execute(self, sql, *params):
+        return self.cursor().execute(sql, *params)
+
+    @property
+    def timeout(self):
+        # pyodbc's per-statement timeout (seconds, 0 = none); set it back before the connection is released
+        return self._conn.timeout
+
+    @timeout.setter
+    def timeout(self, seconds):
+        self._conn.timeout = seconds
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            conn.rollback()
+        except Exception:
+            self._owner.release(conn, healthy=False)
+            raise
+        self._owner.release(conn)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        conn, self._conn = self._conn, None
+        try:
+            conn.__exit__(exc_type, exc, tb)
+        except BaseException:
+            self._owner.release(conn, healthy=False)
+            raise
+        if exc is not None and _is_disconnect(exc):
+            self._owner.mark_down(exc)
+            self._owner.release(conn, healthy=False)
+        else:
+            self._owner.release(conn)
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def get_write_conn(label: str = "app"):
+    """A pooled connection to the primary; use it as a context manager so it goes back to the pool.
+
+    `label` tags the statements in /debug/queries (e.g. "chat" for LLM-generated SQL).
+    """
+    return TimedConnection(pool.acquire(), label, pool)
+
+
+def get_read_conn(label: str = "app"):
+    """A pooled connection for queries: the least busy healthy replica, or the primary.
+
+    Requests that must see a recent write (see common.consistency) always get the primary.
+    """
+    if not replicas or wants_primary():
+        return get_write_conn(label)
+    for replica in _read_replicas():
+        try:
+            return TimedConnection(replica.acquire(), label, replica)
+        except Exception:
+            continue  # marked down by _open(); try the next one
+    return get_write_conn(label)
+
+
+# older call sites: the primary, as before
+get_conn = get_write_conn
@@ -0,0 +1,68 @@
+"""
+Opt-in fast JSON path for read endpoints (FAST_JSON=1).
+
+With `response_model=...`, FastAPI validates every returned dataclass through
+pydantic, re-serializes it with jsonable rules and finally encodes it with
+the stdlib json module. On this path we skip straight to one encoder call:
+orjson when it is installed (it encodes dataclasses and datetimes natively),
+otherwise json with pre-built per-class field lists.
+"""
+from __future__ import annotations
+import dataclasses
+import datetime
+import decimal
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+FAST_JSON = os.getenv("FAST_JSON", "0") == "1"
+
+_FIELDS: Dict[type, Tuple[str, ...]] = {}
+
+
+def _default(obj: Any) -> Any:
+    if dataclasses.is_dataclass(obj):
+        names = _FIELDS.get(type(obj))
+        if names is None:
+            names = _FIELDS[type(obj)] = tuple(f.name for f in dataclasses.fields(obj))
+        return {n: getattr(obj, n) for n in names}
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def fast_response(content: Any, response: Optional[Response] = None) -> Any:
+    """Wrap `content` in a FastJSONResponse when FAST_JSON is on; otherwise return it untouched.
+
+    Headers already set on the injected `response` (e.g. the ETag) are carried over,
+    since FastAPI ignores them once a Response object is returned.
+    """
+    if not FAST_JSON:
+        return content
+    out = FastJSONResponse(content)
+    if response is not None:
+        for key, value in response.headers.items():
+            if key not in ("content-length", "content-type"):
+                out.headers[key] = value
+    return out
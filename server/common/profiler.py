@@ -0,0 +1,258 @@
+"""
+On-demand sampling profiler.
+
+Nothing runs unless asked: a request carrying `X-Profile: 1` (or `?profile=1`)
+together with a valid `X-Admin-Token` is profiled on its own, and an admin can
+open a time window via POST /debug/profile/start. A background thread samples
+every thread's Python stack with `sys._current_frames()`, so the FastAPI
+handler, controller, model and the frame blocked inside pyodbc all show up.
+
+Identical stacks are stored once with a count, and a profile stops taking
+samples after PROFILE_MAX_SAMPLES. A per-request profile leaves out threads
+parked in a wait (idle threadpool and job workers, other requests' idle
+connections); the thread that runs the request's event loop is always kept.
+
+Profiles are kept in memory (and written to PROFILE_DIR when set) and can be
+downloaded as speedscope JSON or folded stacks for flamegraph.pl.
+"""
+from __future__ import annotations
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from common.admin import is_admin
+
+PROFILE_INTERVAL_S = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_MAX_WINDOW_S = float(os.getenv("PROFILE_MAX_WINDOW_S", "300"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+PROFILE_MAX_SAMPLES = int(os.getenv("PROFILE_MAX_SAMPLES", "100000"))
+
+Frame = Tuple[str, str, int]
+
+# innermost frames of a thread that is waiting for work: (file name, function)
+_IDLE_LEAVES = {("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"), ("queue.py", "get"),
+                ("selectors.py", "select"), ("thread.py", "_worker")}
+
+
+def _idle(code) -> bool:
+    """Whether a thread whose innermost frame runs `code` is waiting for work."""
+    return (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES
+
+
+class Profile:
+    """Samples collected by one profiler run, grouped per thread."""
+
+    def __init__(self, profile_id: str, name: str, interval: float) -> None:
+        self.id = profile_id
+        self.name = name
+        self.interval = interval
+        self.started_at = time.time()
+        self.duration_s = 0.0
+        self.frames: List[Frame] = []
+        self._frame_index: Dict[Frame, int] = {}
+        # thread name -> {stack (root first, as frame indices): times sampled}
+        self.samples: Dict[str, Dict[Tuple[int, ...], int]] = {}
+        self.sample_count = 0
+        self.truncated = False  # stopped at PROFILE_MAX_SAMPLES
+
+    def add_stack(self, thread_name: str, stack: List[Frame]) -> None:
+        if self.sample_count >= PROFILE_MAX_SAMPLES:
+            self.truncated = True
+            return
+        idx = []
+        for fr in stack:
+            i = self._frame_index.get(fr)
+            if i is None:
+                i = self._frame_index[fr] = len(self.frames)
+                self.frames.append(fr)
+            idx.append(i)
+        stacks = self.samples.setdefault(thread_name, {})
+        key = tuple(idx)
+        stacks[key] = stacks.get(key, 0) + 1
+        self.sample_count += 1
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_s": round(self.duration_s, 3),
+            "samples": self.sample_count,
+            "truncated": self.truncated,
+            "threads": len(self.samples),
+        }
+
+    def to_speedscope(self) -> Dict[str, Any]:
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "smartmarket-profiler",
+            "shared": {"frames": [{"name": n, "file": f, "line": l} for n, f, l in self.frames]},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": thread_name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(stacks.values()) * self.interval,
+                    "samples": [list(stack) for stack in stacks],
+                    "weights": [n * self.interval for n in stacks.values()],
+                }
+                for thread_name, stacks in self.samples.items()
+            ],
+        }
+
+    def to_folded(self) -> str:
+        counts: Dict[str, int] = {}
+        for thread_name, stacks in self.samples.items():
+            for stack, n in stacks.items():
+                key = ";".join([thread_name] + [f"{self.frames[i][0]} ({os.path.basename(self.frames[i][1])}:{self.frames[i][2]})" for i in stack])
+                counts[key] = counts.get(key, 0) + n
+        return "\n".join(f"{k} {v}" for k, v in counts.items()) + "\n"
+
+
+class SamplingProfiler:
+    """Background thread that snapshots all Python stacks every `interval` seconds.
+
+    With `skip_idle`, threads waiting for work are left out, except `keep` (a thread ident).
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, name: str, interval: float = PROFILE_INTERVAL_S, skip_idle: bool = False,
+                 keep: Optional[int] = None) -> None:
+        self.profile = Profile(f"{int(time.time())}-{next(self._ids)}", name, interval)
+        self.skip_idle = skip_idle
+        self.keep = keep
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> "SamplingProfiler":
+        self._t0 = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self) -> Profile:
+        self._stop.set()
+        self._thread.join()
+        self.profile.duration_s = time.perf_counter() - self._t0
+        profile_store.add(self.profile)
+        return self.profile
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        interval = self.profile.interval
+        while True:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == me or (self.skip_idle and tid != self.keep and _idle(frame.f_code)):
+                    continue
+                stack: List[Frame] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                self.profile.add_stack(names.get(tid, str(tid)), stack)
+            if self.profile.sample_count >= PROFILE_MAX_SAMPLES or self._stop.wait(interval):
+                break
+
+
+class ProfileStore:
+    """Keeps the last PROFILE_KEEP profiles; optionally mirrors them to PROFILE_DIR."""
+
+    def __init__(self, keep: int = PROFILE_KEEP) -> None:
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._profiles: "OrderedDict[str, Profile]" = OrderedDict()
+        self._window: Optional[SamplingProfiler] = None
+        self._window_timer: Optional[threading.Timer] = None
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles[profile.id] = profile
+            while len(self._profiles) > self.keep:
+                self._profiles.popitem(last=False)
+        if PROFILE_DIR:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(os.path.join(PROFILE_DIR, f"{profile.id}.speedscope.json"), "w", encoding="utf-8") as f:
+                json.dump(profile.to_speedscope(), f)
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [p.summary() for p in reversed(self._profiles.values())]
+
+    # --- time-window profiling ---
+    def start_window(self, seconds: float) -> str:
+        seconds = min(max(seconds, 0.1), PROFILE_MAX_WINDOW_S)
+        with self._lock:
+            if self._window is not None:
+                raise RuntimeError("A profiling window is already running")
+            self._window = SamplingProfiler(f"window {seconds:g}s").start()
+            self._window_timer = threading.Timer(seconds, self.stop_window)
+            self._window_timer.daemon = True
+            self._window_timer.start()
+            return self._window.profile.id
+
+    def stop_window(self) -> Optional[Profile]:
+        with self._lock:
+            window, self._window = self._window, None
+            timer, self._window_timer = self._window_timer, None
+        if timer is not None:
+            timer.cancel()
+        return window.stop() if window is not None else None
+
+
+profile_store = ProfileStore()
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware: profiles a single request when an admin asks for it.
+
+    Requests without the trigger only pay for a header scan; no sampler thread exists.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope):
+            return await self.app(scope, receive, send)
+
+        # other requests' threads are in the process too; idle ones are only noise here
+        profiler = SamplingProfiler(f"{scope['method']} {scope['path']}", skip_idle=True,
+                                    keep=threading.get_ident()).start()
+        profile_id = profiler.profile.id
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            # joins the sampler and may write PROFILE_DIR: not on the event loop
+            await run_in_threadpool(profiler.stop)
+
+    @staticmethod
+    def _wants_profile(scope) -> bool:
+        headers = dict(scope.get("headers") or ())
+        flagged = headers.get(b"x-profile") in (b"1", b"true") or b"profile=1" in scope.get("query_string", b"").split(b"&")
+        if not flagged:
+            return False
+        token = headers.get(b"x-admin-token")
+        return is_admin(token.decode("latin-1") if token else None)
@@ -0,0 +1,120 @@
+"""
+In-process SQL statistics.
+
+Every statement that goes through a `get_conn()` cursor is fingerprinted
+(literals stripped, whitespace collapsed) and accumulated here, so the
+top offenders by total time can be listed from /debug/queries.
+"""
+from __future__ import annotations
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+log = logging.getLogger("smartmarket.sql")
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+MAX_FINGERPRINTS = int(os.getenv("QUERY_STATS_MAX", "1000"))
+
+_COMMENTS_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING_RE = re.compile(r"N?'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES_RE = re.compile(r"\s+")
+
+
+def fingerprint(sql: str) -> str:
+    """Normalize a statement so that calls differing only in literals share one key."""
+    s = _COMMENTS_RE.sub(" ", sql)
+    s = _STRING_RE.sub("?", s)
+    s = _NUMBER_RE.sub("?", s)
+    s = _IN_LIST_RE.sub("(?+)", s)
+    s = _SPACES_RE.sub(" ", s).strip().rstrip(";").strip()
+    return s.lower()
+
+
+@dataclass
+class QueryStat:
+    fingerprint: str
+    label: str
+    calls: int = 0
+    errors: int = 0
+    total_s: float = 0.0
+    max_s: float = 0.0
+    rows: int = 0
+    last_seen: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "fingerprint": self.fingerprint,
+            "label": self.label,
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_ms": round(self.total_s * 1000, 3),
+            "mean_ms": round(self.total_s * 1000 / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_s * 1000, 3),
+            "rows": self.rows,
+            "last_seen": self.last_seen,
+        }
+
+
+class QueryStats:
+    """Thread-safe accumulator keyed by (label, fingerprint)."""
+
+    ORDER_KEYS = {
+        "total": lambda s: s.total_s,
+        "mean": lambda s: s.total_s / s.calls if s.calls else 0.0,
+        "max": lambda s: s.max_s,
+        "calls": lambda s: s.calls,
+        "rows": lambda s: s.rows,
+    }
+
+    def __init__(self, slow_ms: float = SLOW_QUERY_MS, max_entries: int = MAX_FINGERPRINTS) -> None:
+        self.slow_ms = slow_ms
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], QueryStat] = {}
+
+    def record(self, sql: str, params: Any, duration_s: float, *, label: str = "app", failed: bool = False) -> QueryStat:
+        key = (label, fingerprint(sql))
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                if len(self._stats) >= self.max_entries:
+                    # Drop the cheapest entry so ad-hoc (chat) SQL can't grow this without bound.
+                    cheapest = min(self._stats, key=lambda k: self._stats[k].total_s)
+                    del self._stats[cheapest]
+                stat = self._stats[key] = QueryStat(fingerprint=key[1], label=label)
+            stat.calls += 1
+            stat.errors += int(failed)
+            stat.total_s += duration_s
+            stat.max_s = max(stat.max_s, duration_s)
+            stat.last_seen = time.time()
+
+        if duration_s * 1000 >= self.slow_ms:
+            log.warning("slow query (%.1f ms, %s): %s | params=%r", duration_s * 1000, label, " ".join(sql.split()), params)
+        return stat
+
+    def add_rows(self, stat: Optional[QueryStat], n: int) -> None:
+        if stat is None or n <= 0:
+            return
+        with self._lock:
+            stat.rows += n
+
+    def top(self, n: int = 20, order_by: str = "total") -> List[Dict[str, Any]]:
+        key = self.ORDER_KEYS.get(order_by)
+        if key is None:
+            raise ValueError(f"order_by must be one of {sorted(self.ORDER_KEYS)}")
+        with self._lock:
+            ranked = sorted(self._stats.values(), key=key, reverse=True)[:n]
+            return [s.as_dict() for s in ranked]
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+query_stats = QueryStats()
@@ -0,0 +1,76 @@
+"""
+Readiness and startup warm-up.
+
+/healthz only says the process is up. /readyz answers 200 once the warm-up
+steps have run: the minimum pool connections are open, the hot ReadModel /
+writeModel statements have been executed once (so SQL Server has compiled and
+cached their plans) and the catalog, categories and brands have been loaded.
+Until then it answers 503, so a load balancer or the desktop client's wake-up
+call can wait for a warm instance. A failed warm-up (e.g. the database is
+still resuming) is retried every WARMUP_RETRY_S.
+"""
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from common.tracing import span
+
+log = logging.getLogger("smartmarket.readiness")
+
+WARMUP = os.getenv("WARMUP", "1") != "0"
+WARMUP_RETRY_S = float(os.getenv("WARMUP_RETRY_S", "5"))
+
+
+class Readiness:
+    def __init__(self) -> None:
+        self._steps: List[Tuple[str, Callable[[], Any]]] = []
+        self._thread: Optional[threading.Thread] = None
+        self.ready = False
+        self.attempts = 0
+        self.last_error: Optional[str] = None
+        self.steps_ms: Dict[str, float] = {}
+
+    def add_step(self, name: str, fn: Callable[[], Any]) -> None:
+        self._steps.append((name, fn))
+
+    def start(self) -> None:
+        """Run the warm-up in a background thread; the server keeps answering /healthz meanwhile."""
+        if not WARMUP:
+            self.ready = True
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self.attempts += 1
+            try:
+                for name, fn in self._steps:
+                    start = time.perf_counter()
+                    with span(f"warmup.{name}"):
+                        fn()
+                    self.steps_ms[name] = round((time.perf_counter() - start) * 1000, 1)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                log.warning("warm-up attempt %d failed, retrying in %gs: %s", self.attempts, WARMUP_RETRY_S, self.last_error)
+                time.sleep(WARMUP_RETRY_S)
+                continue
+            self.ready = True
+            self.last_error = None
+            log.warning("ready after warm-up: %s", ", ".join(f"{k} {v} ms" for k, v in self.steps_ms.items()))
+            return
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "status": "ready" if self.ready else "warming",
+            "attempts": self.attempts,
+            "steps_ms": self.steps_ms,
+            "last_error": self.last_error,
+        }
+
+
+readiness = Readiness()
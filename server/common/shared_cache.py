@@ -0,0 +1,286 @@
+"""
+Shared L2 cache and cross-worker invalidation over Redis.
+
+With REDIS_URL set, every memoized read (common.cache) is looked up in the
+process-local L1 first, then in Redis, and only then computed. Entries are
+stored together with the versions of their tags; `INCR sm:tagv:<scope>`
+therefore invalidates every entry with that tag at once, including entries a
+slower worker writes back after the fact.
+
+Each data_versions bump (i.e. each writeModel commit) increments the tag
+versions and publishes the scopes on the `sm:invalidate` channel. Every
+worker listens on that channel and applies the bump locally, which drops its
+L1 entries and moves its ETags within milliseconds of the commit. For
+MAX_REPLICA_LAG_S after that, entries with a bumped tag are refilled from the
+primary (common.cache); no reader is pinned to it by a bump.
+
+Until the publish arrives, another worker already sees the new tag versions
+and could store rows from a lagging replica under them. So a bump also sets
+`sm:tagb:<scope>` for MAX_REPLICA_LAG_S, before the INCR; lookups read it
+along with the versions, and a worker that finds it computes on the primary
+like the worker that wrote.
+
+ETags are built from the same tag versions plus an epoch kept in Redis, so
+every worker hands out the same ETag for the same data. Within
+MAX_REPLICA_LAG_S of a bump a worker may still hold the old rows in its L1,
+so those ETags stay per process (common.versioning) until it is over.
+
+Redis being unreachable only costs the L2: lookups fall through to the
+database and the listener reconnects in the background. For local testing run
+`python benchmarks/redis_standin.py` (fakeredis) and point REDIS_URL at it.
+"""
+from __future__ import annotations
+import dataclasses
+import datetime as dt
+import decimal
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import Any, Callable, Iterable, List, Optional, Sequence, Tuple
+
+from common.consistency import MAX_REPLICA_LAG_S
+from common.versioning import data_versions
+
+log = logging.getLogger("smartmarket.shared_cache")
+
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "sm")
+L2_RETRY_S = float(os.getenv("L2_RETRY_S", "5"))
+
+ALL_TAG = "*"  # bumped by bump_all; part of every entry's versions
+CHANNEL = f"{REDIS_PREFIX}:invalidate"
+
+# called with the tags a lookup found bumped within MAX_REPLICA_LAG_S, by any worker (common.cache)
+recent_bump_listeners: List[Callable[[List[str]], None]] = []
+
+
+def _encode(obj: Any) -> Any:
+    # JSON, not pickle: bytes read back from Redis must never be able to run code in a worker
+    if isinstance(obj, dt.datetime):
+        return {"__datetime__": obj.isoformat()}
+    if isinstance(obj, dt.date):
+        return {"__date__": obj.isoformat()}
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if dataclasses.is_dataclass(obj) and type(obj).__name__ == "ProductRead":
+        return {"__product__": {f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)}}
+    raise TypeError(f"Can't store {type(obj).__name__} in the L2")
+
+
+def _decode(d: dict) -> Any:
+    if "__datetime__" in d:
+        return dt.datetime.fromisoformat(d["__datetime__"])
+    if "__date__" in d:
+        return dt.date.fromisoformat(d["__date__"])
+    if "__product__" in d:
+        from readFrom.read_model import ProductRead  # read_model imports this module
+        return ProductRead(**d["__product__"])
+    return d
+
+
+def dumps(value: Any) -> bytes:
+    return json.dumps(value, default=_encode, separators=(",", ":")).encode()
+
+
+def loads(raw: bytes) -> Any:
+    return json.loads(raw, object_hook=_decode)
+
+
+def _plain(versions: Optional[List[Any]]) -> Optional[List[Any]]:
+    """Tag versions as JSON-friendly ints (Redis returns bytes, or None for a tag never bumped)."""
+    return None if versions is None else [None if v is None else int(v) for v in versions]
+
+
+class RedisL2:
+    def __init__(self, url: str) -> None:
+        import redis
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        # the subscriber blocks on reads, so it must not share the short socket timeout
+        self._subscriber = redis.Redis.from_url(url, socket_connect_timeout=0.5, health_check_interval=30)
+        self.origin = secrets.token_hex(6)
+        self._down_until = 0.0
+        self._applying = threading.local()
+        self.hits = self.misses = self.errors = self.published = self.received = 0
+
+    # ------------------------------------------------------------- entries
+    def _tag_keys(self, tags: Iterable[str]) -> List[str]:
+        return [f"{REDIS_PREFIX}:tagv:{t}" for t in (ALL_TAG, *sorted(tags))]
+
+    def _bump_keys(self, tags: Iterable[str]) -> List[str]:
+        # set for MAX_REPLICA_LAG_S after a bump of the tag, by whichever worker made it
+        return [f"{REDIS_PREFIX}:tagb:{t}" for t in (ALL_TAG, *sorted(tags))]
+
+    @staticmethod
+    def _seen(tags: Iterable[str], flags: Sequence[Any]) -> None:
+        recent = [t for t, flag in zip((ALL_TAG, *sorted(tags)), flags) if flag is not None]
+        if recent:
+            for fn in recent_bump_listeners:
+                fn(recent)
+
+    def _available(self) -> bool:
+        return time.monotonic() >= self._down_until
+
+    def _failed(self, e: Exception) -> None:
+        self.errors += 1
+        self._down_until = time.monotonic() + L2_RETRY_S
+        log.warning("Redis L2 unavailable for %gs: %s", L2_RETRY_S, e)
+
+    def get(self, name: str, key: Any, tags: Sequence[str]) -> Tuple[Optional[Tuple[Any, float]], Optional[List[Any]]]:
+        """((value, expires_at) or None, current tag versions) -- versions are passed back to `set`.
+
+        Recently bumped tags are reported to recent_bump_listeners first.
+        """
+        if not self._available():
+            return None, None
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.get(self._key(name, key))
+            pipe.mget(self._tag_keys(tags))
+            pipe.mget(self._bump_keys(tags))
+            raw, versions, bumped = pipe.execute()
+        except Exception as e:
+            self._failed(e)
+            return None, None
+        self._seen(tags, bumped)
+        versions = _plain(versions)
+        if raw is not None:
+            try:
+                value, expires_at, stored_versions = loads(raw)
+            except (ValueError, TypeError) as e:
+                # an entry from an older build, or garbage: treat it as a miss
+                log.warning("unreadable L2 entry for %s: %s", name, e)
+                stored_versions = None
+            if stored_versions == versions:
+                self.hits += 1
+                return (value, expires_at), versions
+        self.misses += 1
+        return None, versions
+
+    def versions(self, tags: Sequence[str]) -> Optional[List[Any]]:
+        """Current tag versions, as from `get`."""
+        if not self._available():
+            return None
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.mget(self._tag_keys(tags))
+            pipe.mget(self._bump_keys(tags))
+            versions, bumped = pipe.execute()
+        except Exception as e:
+            self._failed(e)
+            return None
+        self._seen(tags, bumped)
+        return _plain(versions)
+
+    def etag_parts(self, scopes: Sequence[str]) -> Optional[List[str]]:
+        """The shared epoch and the tag versions of `scopes`, for data_versions.etag; None while Redis is down."""
+        if not self._available():
+            return None
+        epoch_key = f"{REDIS_PREFIX}:epoch"
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.get(epoch_key)
+            pipe.mget(self._tag_keys(scopes))
+            pipe.mget(self._bump_keys(scopes))
+            epoch, versions, bumped = pipe.execute()
+            if epoch is None:
+                # a new Redis (or one that lost its data) counts versions from 0 again: new epoch
+                self.client.set(epoch_key, secrets.token_hex(4), nx=True)
+                epoch = self.client.get(epoch_key)
+        except Exception as e:
+            self._failed(e)
+            return None
+        self._seen(scopes, bumped)
+        if any(flag is not None for flag in bumped):
+            # our L1 may not have dropped the old rows yet: a local ETag until the window is over
+            return None
+        return ["r" + epoch.decode()] + [str(v or 0) for v in _plain(versions)]
+
+    def set(self, name: str, key: Any, value: Any, versions: Optional[List[Any]], ttl_s: float, keep_s: float) -> None:
+        if versions is None or not self._available():
+            return
+        try:
+            raw = dumps((value, time.time() + ttl_s, versions))
+            self.client.set(self._key(name, key), raw, px=max(int(keep_s * 1000), 1))
+        except Exception as e:
+            self._failed(e)
+
+    @staticmethod
+    def _key(name: str, key: Any) -> str:
+        return f"{REDIS_PREFIX}:cache:{name}:{repr(key)}"
+
+    # -------------------------------------------------------- invalidation
+    def on_bump(self, scopes: Optional[Iterable[str]]) -> None:
+        """data_versions listener: bump the tag versions and tell the other workers."""
+        if getattr(self._applying, "remote", False):
+            return
+        scopes = None if scopes is None else list(scopes)
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            # the marker first: whoever sees the new version must also see that it is recent
+            for bump_key in (self._bump_keys(()) if scopes is None else self._bump_keys(scopes)[1:]):
+                pipe.set(bump_key, 1, px=max(int(MAX_REPLICA_LAG_S * 1000), 1))
+            for tag_key in (self._tag_keys(()) if scopes is None else self._tag_keys(scopes)[1:]):
+                pipe.incr(tag_key)
+            pipe.publish(CHANNEL, json.dumps({"origin": self.origin, "scopes": scopes}))
+            pipe.execute()
+            self.published += 1
+        except Exception as e:
+            self._failed(e)
+
+    def _apply(self, message: bytes) -> None:
+        data = json.loads(message)
+        if data.get("origin") == self.origin:
+            return
+        self.received += 1
+        self._applying.remote = True
+        try:
+            if data.get("scopes") is None:
+                data_versions.bump_all()
+            else:
+                data_versions.bump(*data["scopes"])
+        finally:
+            self._applying.remote = False
+
+    def listen(self) -> None:
+        while True:
+            try:
+                pubsub = self._subscriber.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                for msg in pubsub.listen():
+                    if msg.get("type") == "message":
+                        self._apply(msg["data"])
+            except Exception as e:
+                log.warning("invalidation listener lost Redis, reconnecting: %s", e)
+                # our L1 may have missed messages meanwhile
+                self._applying.remote = True
+                try:
+                    data_versions.bump_all()
+                finally:
+                    self._applying.remote = False
+                time.sleep(L2_RETRY_S)
+
+    def stats(self) -> dict:
+        return {"url": REDIS_URL, "origin": self.origin, "hits": self.hits, "misses": self.misses,
+                "errors": self.errors, "published": self.published, "received": self.received,
+                "available": self._available()}
+
+
+l2: Optional[RedisL2] = None
+
+
+def start() -> None:
+    """Connect the L2 and start the invalidation listener (no-op without REDIS_URL)."""
+    global l2
+    if not REDIS_URL or l2 is not None:
+        return
+    try:
+        l2 = RedisL2(REDIS_URL)
+    except ImportError:
+        log.warning("REDIS_URL is set but the redis package is not installed; using the in-process cache only")
+        return
+    data_versions.subscribe(l2.on_bump)
+    data_versions.share(l2.etag_parts)
+    threading.Thread(target=l2.listen, name="cache-invalidation", daemon=True).start()
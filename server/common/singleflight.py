@@ -0,0 +1,128 @@
+"""
+Single-flight request coalescing.
+
+When many clients ask for the same thing at once (store opening: categories,
+brands, category value), only the first call runs the query; concurrent
+identical calls wait for it and share its result. With SINGLEFLIGHT_WINDOW_MS
+> 0 a finished result is also handed to identical calls arriving within that
+window.
+
+The key is the method plus its arguments plus `data_versions.writes`, so a
+call made after a write never joins an execution that started before it. A
+call pinned to the primary (common.consistency) never joins one either: the
+leader may be reading a replica that hasn't seen the caller's write.
+`/debug/singleflight` shows, per method, how many executions were saved and
+roughly how much query time that was.
+"""
+from __future__ import annotations
+import functools
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from common.consistency import wants_primary
+from common.versioning import data_versions
+
+SINGLEFLIGHT = os.getenv("SINGLEFLIGHT", "1") != "0"
+SINGLEFLIGHT_WINDOW_S = float(os.getenv("SINGLEFLIGHT_WINDOW_MS", "0")) / 1000
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "duration_s", "finished_at")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.duration_s = 0.0
+        self.finished_at = 0.0
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def do(self, name: str, key: Hashable, fn: Callable[[], Any], window_s: float = SINGLEFLIGHT_WINDOW_S) -> Any:
+        with self._lock:
+            stat = self._stats.setdefault(name, {"calls": 0, "executions": 0, "shared": 0, "saved_s": 0.0})
+            stat["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None or (call.done.is_set() and time.monotonic() - call.finished_at > window_s)
+            if leader:
+                call = self._calls[key] = _Call()
+                stat["executions"] += 1
+            else:
+                stat["shared"] += 1
+
+        if not leader:
+            call.done.wait()
+            with self._lock:
+                stat["saved_s"] += call.duration_s
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        start = time.perf_counter()
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.duration_s = time.perf_counter() - start
+            call.finished_at = time.monotonic()
+            with self._lock:
+                if window_s <= 0 or call.error is not None:
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                else:
+                    self._expire(window_s)
+            call.done.set()
+
+    def _expire(self, window_s: float) -> None:
+        now = time.monotonic()
+        for key in [k for k, c in self._calls.items() if c.done.is_set() and now - c.finished_at > window_s]:
+            del self._calls[key]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            out = [{"method": name, "calls": int(s["calls"]), "executions": int(s["executions"]),
+                    "shared": int(s["shared"]), "saved_ms": round(s["saved_s"] * 1000, 1)}
+                   for name, s in self._stats.items()]
+        return sorted(out, key=lambda s: s["saved_ms"], reverse=True)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+singleflight = SingleFlight()
+
+
+def coalesce(key: Optional[Callable[..., Hashable]] = None, window_ms: Optional[float] = None):
+    """Decorator: concurrent calls with equal keys share one execution.
+
+    `key(*args, **kwargs)` overrides the default key (all arguments);
+    `window_ms` overrides SINGLEFLIGHT_WINDOW_MS for this function.
+    """
+    window_s = SINGLEFLIGHT_WINDOW_S if window_ms is None else window_ms / 1000
+
+    def deco(fn):
+        name = fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not SINGLEFLIGHT or wants_primary():
+                return fn(*args, **kwargs)
+            part = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+            try:
+                hash(part)
+            except TypeError:
+                return fn(*args, **kwargs)
+            return singleflight.do(name, (name, part, data_versions.writes), lambda: fn(*args, **kwargs), window_s)
+        return wrapper
+    return deco
@@ -0,0 +1,46 @@
+"""
+Startup timing report.
+
+app.py imports this module first and marks each import phase, so every boot
+logs where its cold-start time went (and /debug/startup shows it later).
+Use `python benchmarks/startup.py` for a per-module import audit.
+"""
+from __future__ import annotations
+import logging
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+log = logging.getLogger("smartmarket.startup")
+
+# modules we keep out of the boot path; reported so a regression is visible
+LAZY_MODULES = ("chat.chat_model", "requests", "pyodbc", "pyarrow")
+
+
+class StartupReport:
+    def __init__(self) -> None:
+        self.t0 = time.perf_counter()
+        self._last = self.t0
+        self.phases: List[Tuple[str, float]] = []
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self._last) * 1000))
+        self._last = now
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "phases_ms": {name: round(ms, 1) for name, ms in self.phases},
+            "total_ms": round(sum(ms for _, ms in self.phases), 1),
+            "loaded_lazy_modules": [m for m in LAZY_MODULES if m in sys.modules],
+        }
+
+    def log(self) -> None:
+        report = self.as_dict()
+        log.warning("startup %.1f ms: %s; lazy modules already loaded: %s",
+                    report["total_ms"],
+                    ", ".join(f"{k} {v} ms" for k, v in report["phases_ms"].items()),
+                    report["loaded_lazy_modules"] or "none")
+
+
+startup_report = StartupReport()
@@ -0,0 +1,334 @@
+"""
+Lightweight request tracing.
+
+Spans are opened around every HTTP request (TracingMiddleware), every
+controller method (`trace_methods`), every statement run through a
+`get_conn()` cursor and every call to the Hugging Face router. The current
+span lives in a contextvar, so children opened in the threadpool or in other
+asyncio tasks attach to the right parent.
+
+Finished spans go to TRACE_FILE (one JSON object per line) and/or an
+OTLP/HTTP collector at OTLP_ENDPOINT. Independently of exporters, any request
+slower than SLOW_TRACE_MS is logged with its span tree and critical path.
+"""
+from __future__ import annotations
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+log = logging.getLogger("smartmarket.trace")
+
+TRACE_FILE = os.getenv("TRACE_FILE")
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT")  # e.g. http://localhost:4318
+SLOW_TRACE_MS = float(os.getenv("SLOW_TRACE_MS", "2000"))
+SERVICE_NAME = os.getenv("SERVICE_NAME", "smartmarket-api")
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]) -> None:
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attrs: Any) -> None:
+        self.attributes.update(attrs)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_unix_nano": self.start_ns,
+            "end_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+# ---------------------------------------------------------------- collection
+
+class _TraceBuffer:
+    """Holds the finished spans of in-flight traces until their root span ends."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._spans: Dict[str, List[Span]] = {}
+
+    def open(self, trace_id: str) -> None:
+        with self._lock:
+            self._spans[trace_id] = []
+
+    def add(self, sp: Span) -> bool:
+        """Buffer `sp`; False when its trace already finished (e.g. a background task outliving the request)."""
+        with self._lock:
+            spans = self._spans.get(sp.trace_id)
+            if spans is None:
+                return False
+            spans.append(sp)
+            return True
+
+    def pop(self, trace_id: str) -> List[Span]:
+        with self._lock:
+            return self._spans.pop(trace_id, [])
+
+
+_buffer = _TraceBuffer()
+
+
+def critical_path(root: Span, spans: List[Span]) -> List[Span]:
+    """Follow, from the root down, the child that finished last at each level."""
+    children: Dict[str, List[Span]] = {}
+    for sp in spans:
+        if sp.parent_id:
+            children.setdefault(sp.parent_id, []).append(sp)
+    path = [root]
+    while children.get(path[-1].span_id):
+        path.append(max(children[path[-1].span_id], key=lambda s: s.end_ns))
+    return path
+
+
+def format_breakdown(root: Span, spans: List[Span]) -> str:
+    children: Dict[str, List[Span]] = {}
+    for sp in spans:
+        if sp.parent_id:
+            children.setdefault(sp.parent_id, []).append(sp)
+    on_path = {sp.span_id for sp in critical_path(root, spans)}
+    lines: List[str] = []
+
+    def walk(sp: Span, depth: int) -> None:
+        mark = "*" if sp.span_id in on_path else " "
+        offset = (sp.start_ns - root.start_ns) / 1e6
+        lines.append(f"{mark} {'  ' * depth}{sp.name}  +{offset:.1f}ms  {sp.duration_ms:.1f}ms{'  ERROR ' + sp.error if sp.error else ''}")
+        for child in sorted(children.get(sp.span_id, []), key=lambda s: s.start_ns):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return "\n".join(lines)
+
+
+# ----------------------------------------------------------------- exporters
+
+class _FileExporter:
+    """Appends spans to a JSON-lines file from a background thread, like _OtlpExporter."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._q: "queue.Queue[List[Span]]" = queue.Queue(maxsize=1000)
+        threading.Thread(target=self._run, name="trace-file-exporter", daemon=True).start()
+
+    def export(self, spans: List[Span]) -> None:
+        try:
+            self._q.put_nowait(spans)
+        except queue.Full:
+            pass
+
+    def _run(self) -> None:
+        while True:
+            batches = [self._q.get()]
+            # whatever else is queued goes out with the same open()
+            while True:
+                try:
+                    batches.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for spans in batches:
+                        for sp in spans:
+                            f.write(json.dumps(sp.as_dict(), default=str) + "\n")
+            except OSError as e:
+                log.debug("trace file export failed: %s", e)
+
+
+class _OtlpExporter:
+    """Ships spans as OTLP/HTTP JSON from a background thread, never blocking requests."""
+
+    def __init__(self, endpoint: str) -> None:
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self._q: "queue.Queue[List[Span]]" = queue.Queue(maxsize=1000)
+        threading.Thread(target=self._run, name="otlp-exporter", daemon=True).start()
+
+    def export(self, spans: List[Span]) -> None:
+        try:
+            self._q.put_nowait(spans)
+        except queue.Full:
+            pass
+
+    @staticmethod
+    def _attr(key: str, value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def _payload(self, spans: List[Span]) -> bytes:
+        otlp_spans = [{
+            "traceId": sp.trace_id,
+            "spanId": sp.span_id,
+            "parentSpanId": sp.parent_id or "",
+            "name": sp.name,
+            "kind": 1,
+            "startTimeUnixNano": str(sp.start_ns),
+            "endTimeUnixNano": str(sp.end_ns),
+            "attributes": [self._attr(k, v) for k, v in sp.attributes.items()],
+            "status": {"code": 2, "message": sp.error} if sp.error else {"code": 1},
+        } for sp in spans]
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [self._attr("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "smartmarket.tracing"}, "spans": otlp_spans}],
+        }]}
+        return json.dumps(body).encode()
+
+    def _run(self) -> None:
+        import urllib.request
+        while True:
+            spans = self._q.get()
+            try:
+                req = urllib.request.Request(self.url, data=self._payload(spans), headers={"Content-Type": "application/json"})
+                urllib.request.urlopen(req, timeout=5).close()
+            except Exception as e:
+                log.debug("OTLP export failed: %s", e)
+
+
+_exporters: List[Any] = []
+if TRACE_FILE:
+    _exporters.append(_FileExporter(TRACE_FILE))
+if OTLP_ENDPOINT:
+    _exporters.append(_OtlpExporter(OTLP_ENDPOINT))
+
+
+def _finish_trace(root: Span) -> None:
+    spans = _buffer.pop(root.trace_id)
+    for exporter in _exporters:
+        exporter.export(spans)
+    if root.duration_ms >= SLOW_TRACE_MS:
+        log.warning("slow request %s (%.1f ms), trace %s:\n%s", root.name, root.duration_ms, root.trace_id, format_breakdown(root, spans))
+
+
+# ----------------------------------------------------------------------- API
+
+@contextmanager
+def span(name: str, *, trace_id: Optional[str] = None, parent_id: Optional[str] = None, **attributes: Any) -> Iterator[Span]:
+    """Open a child of the current span (or a new root when there is none)."""
+    parent = _current.get()
+    if parent is not None:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    sp = Span(name, trace_id or secrets.token_hex(16), parent_id, attributes)
+    is_root = parent is None
+    if is_root:
+        _buffer.open(sp.trace_id)
+    token = _current.set(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        sp.end_ns = time.time_ns()
+        _current.reset(token)
+        if not _buffer.add(sp):
+            for exporter in _exporters:
+                exporter.export([sp])
+        if is_root:
+            _finish_trace(sp)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator: run the function (sync, async or async generator) inside a span."""
+    def deco(fn):
+        span_name = name or fn.__qualname__
+        if inspect.isasyncgenfunction(fn):
+            # the span stays open until the stream is exhausted or closed
+            @functools.wraps(fn)
+            async def asyncgen_wrapper(*args, **kwargs):
+                with span(span_name):
+                    async for item in fn(*args, **kwargs):
+                        yield item
+            return asyncgen_wrapper
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def trace_methods(cls):
+    """Class decorator: trace every public method defined on the class."""
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith("_") or not inspect.isfunction(value):
+            continue
+        setattr(cls, attr, traced(f"{cls.__name__}.{attr}")(value))
+    return cls
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware: one root span per HTTP request, W3C traceparent in and out."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace_id = parent_id = None
+        for key, value in scope.get("headers") or ():
+            if key == b"traceparent":
+                parts = value.decode("latin-1").split("-")
+                if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+                    trace_id, parent_id = parts[1], parts[2]
+                break
+
+        with span(f"{scope['method']} {scope['path']}", trace_id=trace_id, parent_id=parent_id,
+                  **{"http.method": scope["method"], "http.target": scope["path"]}) as root:
+
+            async def send_with_trace(message):
+                if message["type"] == "http.response.start":
+                    root.set(**{"http.status_code": message["status"]})
+                    headers = list(message.get("headers") or [])
+                    headers.append((b"traceparent", f"00-{root.trace_id}-{root.span_id}-01".encode()))
+                    message["headers"] = headers
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace)
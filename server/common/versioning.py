@@ -0,0 +1,112 @@
+"""
+Read-model data versions.
+
+Every writeModel commit bumps the version of the scopes it changed (the
+product itself plus the aggregates that event type can touch). `/query/*`
+responses carry an ETag built from those versions, so a matching
+If-None-Match is answered with 304 before any DB access.
+
+The counters here are per process. With REDIS_URL set, ETags come from the
+shared tag versions instead (common.shared_cache), so a conditional request
+matches on whichever worker it lands. Without Redis, or while it is down,
+they carry a per-process epoch and only match on the worker that issued them.
+"""
+from __future__ import annotations
+import secrets
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+from fastapi import Request, Response
+
+# aggregate scopes
+CATALOG = "catalog"
+CATEGORIES = "categories"
+BRANDS = "brands"
+PROFIT = "products_profit"
+CATEGORY_VALUE = "products_category_value"
+MONTHLY_PROFIT = "products_total_profit_per_month"
+
+
+def product_scope(product_id: str) -> str:
+    return f"product:{product_id}"
+
+
+class DataVersions:
+    """Monotonic per-scope counters. `bump_all` invalidates every scope at once."""
+
+    def __init__(self) -> None:
+        # a restart must never reuse an ETag handed out by the previous process
+        self.epoch = secrets.token_hex(4)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.writes = 0  # bumps of any kind; a cheap "has anything changed" stamp
+        self._scopes: Dict[str, int] = {}
+        self._listeners: List[Callable[[Optional[Iterable[str]]], None]] = []
+        self._shared: Optional[Callable[[Sequence[str]], Optional[List[str]]]] = None
+
+    def get(self, scope: str) -> int:
+        return self._scopes.get(scope, 0)
+
+    def bump(self, *scopes: str) -> None:
+        with self._lock:
+            for scope in scopes:
+                self._scopes[scope] = self._scopes.get(scope, 0) + 1
+            self.writes += 1
+        self._notify(scopes)
+
+    def bump_all(self) -> None:
+        """For writes we can't attribute to scopes (e.g. SQL run from the chat)."""
+        with self._lock:
+            self._generation += 1
+            self.writes += 1
+        self._notify(None)
+
+    def subscribe(self, fn: Callable[[Optional[Iterable[str]]], None]) -> None:
+        """`fn(scopes)` is called after each bump; `scopes` is None for bump_all."""
+        self._listeners.append(fn)
+
+    def _notify(self, scopes: Optional[Iterable[str]]) -> None:
+        for fn in self._listeners:
+            fn(scopes)
+
+    def share(self, fn: Callable[[Sequence[str]], Optional[List[str]]]) -> None:
+        """Build ETags from `fn(scopes)`, versions every worker sees; local ones when it returns None."""
+        self._shared = fn
+
+    def etag(self, *scopes: str, variant: Optional[str] = None) -> str:
+        parts = self._shared(scopes) if self._shared is not None else None
+        if parts is None:
+            parts = [self.epoch, str(self._generation)] + [str(self.get(s)) for s in scopes]
+        if variant:
+            parts.append(variant)
+        return f'W/"{"-".join(parts)}"'
+
+
+data_versions = DataVersions()
+
+
+def _matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    strong = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == strong:
+            return True
+    return False
+
+
+def not_modified(request: Request, response: Response, *scopes: str, variant: Optional[str] = None) -> Optional[Response]:
+    """Return a 304 when the client's ETag is current; otherwise tag `response` and return None.
+
+    The ETag is computed before the query runs, so a concurrent write can only
+    make it older than the data (next request refetches), never newer.
+    `variant` distinguishes representations of the same data (e.g. JSON vs Arrow).
+    """
+    etag = data_versions.etag(*scopes, variant=variant)
+    inm = request.headers.get("if-none-match")
+    if inm and _matches(inm, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
@@ -0,0 +1,94 @@
+"""
+Columnar wire formats for large read results.
+
+Clients that send `Accept: application/vnd.apache.arrow.stream` (pyarrow) or
+`Accept: application/vnd.msgpack` (msgpack) get the rows as column batches
+instead of a JSON array of objects: one list per column, no repeated keys and
+no per-row JSON decoding on the client. Each format is only offered when its
+library is installed; otherwise the endpoint falls back to JSON.
+"""
+from __future__ import annotations
+import dataclasses
+import datetime
+import importlib.util
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+from fastapi import Request, Response
+
+# pyarrow costs tens of ms to import; only check it is installed until a client asks for Arrow.
+HAS_ARROW = importlib.util.find_spec("pyarrow") is not None
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+ARROW = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/vnd.msgpack"
+_MSGPACK_ALIASES = (MSGPACK, "application/msgpack", "application/x-msgpack")
+
+
+@lru_cache(maxsize=1)
+def _arrow():
+    import pyarrow
+    return pyarrow
+
+
+def negotiate(request: Request) -> Optional[str]:
+    """The columnar media type to answer with, or None for plain JSON."""
+    accept = request.headers.get("accept", "")
+    if HAS_ARROW and ARROW in accept:
+        return ARROW
+    if msgpack is not None and any(m in accept for m in _MSGPACK_ALIASES):
+        return MSGPACK
+    return None
+
+
+def variant_of(fmt: Optional[str]) -> Optional[str]:
+    """Short ETag suffix per representation, so JSON and columnar bodies never share a validator."""
+    return {ARROW: "arrow", MSGPACK: "msgpack"}.get(fmt)
+
+
+def to_columns(rows: Sequence[Any]) -> Dict[str, List[Any]]:
+    """Rows (dataclasses or dicts) -> {column: values}; missing keys become None."""
+    if not rows:
+        return {}
+    if dataclasses.is_dataclass(rows[0]):
+        names = [f.name for f in dataclasses.fields(rows[0])]
+        return {n: [getattr(r, n) for r in rows] for n in names}
+    names: Dict[str, None] = {}
+    for r in rows:
+        for k in r:
+            names.setdefault(k, None)
+    return {n: [r.get(n) for r in rows] for n in names}
+
+
+def flatten_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Event dicts carry a nested `changes` map; columnar formats get one column per changed field."""
+    return [{"event_type": e["event_type"], "occurred_at_utc": e["occurred_at_utc"], **e["changes"]} for e in events]
+
+
+def _msgpack_default(obj: Any) -> Any:
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not msgpack serializable")
+
+
+def encode(columns: Dict[str, List[Any]], fmt: str) -> bytes:
+    if fmt == ARROW:
+        pa = _arrow()
+        sink = pa.BufferOutputStream()
+        table = pa.table(columns) if columns else pa.table({})
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    return msgpack.packb(columns, default=_msgpack_default, use_bin_type=True)
+
+
+def columnar_response(rows: Sequence[Any], fmt: str, response: Optional[Response] = None) -> Response:
+    out = Response(content=encode(to_columns(rows), fmt), media_type=fmt)
+    if response is not None:
+        for key, value in response.headers.items():
+            if key not in ("content-length", "content-type"):
+                out.headers[key] = value
+    return out
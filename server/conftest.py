@@ -0,0 +1,5 @@
+# pytest from server/: modules import from here (`chat.sql_guard`, `common.cache`), as under uvicorn
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
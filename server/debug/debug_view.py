@@ -0,0 +1,136 @@
+"""Admin-only diagnostics endpoints."""
+from typing import Any, Dict, Optional
+from fastapi import APIRouter, Body, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+from common.admin import require_admin
+from common.query_stats import query_stats
+from common.profiler import profile_store
+from common.startup import startup_report
+from common.readiness import readiness
+from common.db import all_pools
+from common.admission import admission
+from common.singleflight import singleflight
+from common.cache import cache_stats, clear_caches
+from common import shared_cache
+from chat.llm_cache import llm_cache
+from jobs.job_queue import job_queue
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.get("/queries")
+def top_queries(n: int = Query(20, ge=1, le=500), order_by: str = "total"):
+    try:
+        return query_stats.top(n, order_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.delete("/queries")
+def reset_queries():
+    query_stats.reset()
+    return {"ok": True}
+
+
+@router.post("/profile/start")
+def start_profile_window(seconds: float = Query(30.0, gt=0)):
+    try:
+        return {"ok": True, "profile_id": profile_store.start_window(seconds)}
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.post("/profile/stop")
+def stop_profile_window():
+    profile = profile_store.stop_window()
+    if profile is None:
+        raise HTTPException(status_code=404, detail="No profiling window is running")
+    return profile.summary()
+
+@router.get("/profiles")
+def list_profiles():
+    return profile_store.list()
+
+@router.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = Query("speedscope", pattern="^(speedscope|folded)$")):
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        return PlainTextResponse(profile.to_folded())
+    return JSONResponse(
+        profile.to_speedscope(),
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.speedscope.json"'},
+    )
+
+
+@router.get("/startup")
+def startup_timing():
+    return {**startup_report.as_dict(), "warmup": readiness.as_dict()}
+
+@router.get("/pool")
+def pool_stats():
+    return [p.stats() for p in all_pools()]
+
+@router.get("/admission")
+def admission_stats():
+    return admission.stats()
+
+@router.get("/singleflight")
+def singleflight_stats():
+    return singleflight.stats()
+
+@router.delete("/singleflight")
+def reset_singleflight():
+    singleflight.reset()
+    return {"ok": True}
+
+@router.get("/cache")
+def memo_cache_stats():
+    l2 = shared_cache.l2
+    return {"l1": cache_stats(), "l2": l2.stats() if l2 is not None else None}
+
+@router.delete("/cache")
+def clear_memo_caches():
+    clear_caches()
+    return {"ok": True}
+
+@router.get("/llm_cache")
+def llm_cache_stats():
+    return llm_cache.stats()
+
+@router.delete("/llm_cache")
+def clear_llm_cache():
+    llm_cache.clear()
+    return {"ok": True}
+
+# bulk note analysis (chat.note_digest); imported here so the chat stack stays lazy
+@router.post("/note_digest/run")
+def run_note_digest():
+    # poll /jobs/{id} for the run's stats
+    return {"job": job_queue.enqueue("note.digest", {}, dedupe_key="note.digest")}
+
+@router.get("/note_digest")
+def note_digest_status():
+    from chat.note_digest import note_digest
+    return note_digest.status()
+
+@router.get("/chat_snapshot")
+def chat_snapshot_stats():
+    from chat.snapshot import chat_snapshot
+    return chat_snapshot.stats()
+
+@router.post("/chat_snapshot/refresh")
+def refresh_chat_snapshot(full: bool = False):
+    from chat.snapshot import chat_snapshot
+    return chat_snapshot.refresh(full=full)
+
+@router.get("/jobs")
+def jobs_overview(status: Optional[str] = None, kind: Optional[str] = None, n: int = Query(50, ge=1, le=500)):
+    return {**job_queue.stats(), "recent": job_queue.recent(status, kind, n)}
+
+@router.post("/jobs")
+def enqueue_job(kind: str, payload: Dict[str, Any] = Body(default={}), priority: Optional[int] = None):
+    # any registered kind, not just the public ones
+    try:
+        return {"job": job_queue.enqueue(kind, payload, priority=priority)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,64 @@
+"""
+Job kinds run by jobs.job_queue.
+
+Each handler imports its stack on first use, so a process that only enqueues
+(e.g. a write endpoint) does not load httpx or the chat model.
+"""
+from __future__ import annotations
+from typing import Any, Dict
+
+from .job_queue import job
+
+
+@job("note.analyze", priority=5, max_attempts=3, timeout_s=120)
+async def analyze_note(payload: Dict[str, Any]) -> Any:
+    """Sentiment, tag and summary of a product's latest note, stored for /chat/analyze_note."""
+    from chat.chat_model import HF_TOKEN
+    from chat.note_digest import note_digest
+    result = await note_digest.analyze_product(payload["product_id"])
+    if result is None:
+        return None
+    if result.get("summary") is None and HF_TOKEN:
+        # stored anyway; retrying gets the summary once the model is back
+        raise RuntimeError("Summary unavailable")
+    return {k: result[k] for k in ("product_id", "event_id", "tag", "sentiment_breakdown", "summary", "source")}
+
+
+@job("note.digest", priority=0, max_attempts=2)
+async def run_note_digest(payload: Dict[str, Any]) -> Any:
+    from chat.note_digest import note_digest
+    return await note_digest.run()
+
+
+@job("chat.ask", priority=3, max_attempts=1, timeout_s=180, public=True)
+async def chat_ask(payload: Dict[str, Any]) -> Any:
+    """/chat/ask off the request path: the result is the AskResponse body.
+
+    Read-only and never retried: a write is confirmed on /chat/ask itself,
+    since a retried or timed-out job could run a committed write again.
+    """
+    from fastapi.encoders import jsonable_encoder
+    from chat.chat_schemas import AskRequest
+    from chat.chat_view import get_controller
+    if payload.get("confirm_write") or payload.get("confirmation_token"):
+        raise ValueError("chat.ask jobs cannot confirm writes; use /chat/ask")
+    return jsonable_encoder(await get_controller().ask(AskRequest(**payload)))
+
+
+@job("chat.analyze_note", priority=3, max_attempts=2, timeout_s=120, public=True)
+async def chat_analyze_note(payload: Dict[str, Any]) -> Any:
+    from chat.chat_view import get_controller
+    return await get_controller().analyze_and_respond(payload.get("note"), payload.get("product_id"))
+
+
+@job("field_model.train", executor="process", max_attempts=1)
+def train_field_model(payload: Dict[str, Any]) -> Any:
+    """Refit the local field classifier from the label log (CPU-bound, so in the process pool).
+
+    The server picks the new model up on its next start.
+    """
+    from chat.field_classifier import FIELD_LOG_PATH, FIELD_MODEL_PATH, FieldClassifier, read_labels
+    labels = read_labels(payload.get("labels") or FIELD_LOG_PATH)
+    out = payload.get("out") or FIELD_MODEL_PATH
+    FieldClassifier.train(labels, epochs=int(payload.get("epochs", 15))).save(out)
+    return {"labels": len(labels), "model": out}
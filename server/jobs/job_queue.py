@@ -0,0 +1,384 @@
+"""
+Durable background jobs.
+
+Slow work (LLM calls, note analysis, the note digest) is put in a queue table
+instead of running on the request: `job_queue.enqueue(kind, payload)` stores a
+row and returns its id at once, and clients poll GET /jobs/{id} (or long-poll
+GET /jobs/{id}/wait) for the result.
+
+The queue is a SQLite file (JOBS_PATH, WAL), so queued jobs survive a restart
+and every worker process on the host shares it. A worker claims the ready job
+with the highest priority in one IMMEDIATE transaction and holds a lease on it
+(JOB_LEASE_S, renewed while it runs); a job whose worker died is claimed again
+once its lease runs out.
+
+Handlers are registered per kind with `@job(...)` (see jobs.handlers) and say
+how they run:
+
+    async    a coroutine on the server's event loop (I/O: HF calls, DB)
+    thread   a function in a JOB_THREADS thread pool (blocking I/O)
+    process  a module-level function in a JOB_PROCESSES process pool (CPU);
+             payload and result must pickle
+
+JOB_WORKERS jobs run at once per process. A failed job is retried after
+JOB_RETRY_BASE_S * 2^(attempt-1) seconds (plus jitter) until it has used
+max_attempts; the last error is kept either way. Finished jobs are deleted
+after JOB_KEEP_S. JOBS=0 keeps this process from running jobs (enqueueing
+still works).
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from common.tracing import span
+
+log = logging.getLogger("smartmarket.jobs")
+
+JOBS = os.getenv("JOBS", "1") != "0"
+JOBS_PATH = os.getenv("JOBS_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_THREADS = int(os.getenv("JOB_THREADS", "4"))
+JOB_PROCESSES = int(os.getenv("JOB_PROCESSES", "2"))
+JOB_POLL_S = float(os.getenv("JOB_POLL_S", "1"))
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "300"))
+JOB_RETRY_BASE_S = float(os.getenv("JOB_RETRY_BASE_S", "2"))
+JOB_KEEP_S = float(os.getenv("JOB_KEEP_S", str(7 * 24 * 3600)))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+EXECUTORS = ("async", "thread", "process")
+
+_SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           TEXT PRIMARY KEY,
+    kind         TEXT NOT NULL,
+    payload      TEXT NOT NULL,
+    priority     INTEGER NOT NULL DEFAULT 0,
+    status       TEXT NOT NULL,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after    REAL NOT NULL,
+    lease_until  REAL,
+    worker       TEXT,
+    dedupe_key   TEXT,
+    result       TEXT,
+    error        TEXT,
+    created_at   REAL NOT NULL,
+    started_at   REAL,
+    finished_at  REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs(status, priority DESC, run_after);
+CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs(dedupe_key, status);
+"""
+
+_COLUMNS = ("id", "kind", "payload", "priority", "status", "attempts", "max_attempts", "run_after", "lease_until",
+            "worker", "dedupe_key", "result", "error", "created_at", "started_at", "finished_at")
+
+
+@dataclass
+class JobKind:
+    name: str
+    handler: Callable[[Dict[str, Any]], Any]
+    executor: str = "async"
+    priority: int = 0
+    max_attempts: int = 3
+    timeout_s: Optional[float] = None
+    public: bool = False  # may be submitted through POST /jobs
+
+
+REGISTRY: Dict[str, JobKind] = {}
+
+
+def job(name: str, *, executor: str = "async", priority: int = 0, max_attempts: int = 3,
+        timeout_s: Optional[float] = None, public: bool = False) -> Callable:
+    """Register the decorated function as the handler of job kind `name`; it gets the payload dict."""
+    if executor not in EXECUTORS:
+        raise ValueError(f"executor must be one of {EXECUTORS}")
+
+    def register(fn: Callable) -> Callable:
+        REGISTRY[name] = JobKind(name, fn, executor, priority, max_attempts, timeout_s, public)
+        return fn
+    return register
+
+
+def _row(r: sqlite3.Row) -> Dict[str, Any]:
+    out = dict(zip(_COLUMNS, r))
+    out["payload"] = json.loads(out["payload"])
+    out["result"] = json.loads(out["result"]) if out["result"] is not None else None
+    return out
+
+
+class JobQueue:
+    def __init__(self, path: str = JOBS_PATH) -> None:
+        self.path = path
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._local = threading.local()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+        self._threads: Optional[Executor] = None
+        self._processes: Optional[Executor] = None
+        self._stats = {"ran": 0, "succeeded": 0, "retried": 0, "failed": 0}
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA_SQL)
+            self._local.conn = conn
+        return conn
+
+    # ------------------------------------------------------------ producers
+    def enqueue(self, kind: str, payload: Dict[str, Any], *, priority: Optional[int] = None,
+                delay_s: float = 0.0, dedupe_key: Optional[str] = None) -> str:
+        """Queue a job and return its id. With `dedupe_key`, a job still queued under that key is reused."""
+        if kind not in REGISTRY:
+            _load_handlers()
+        spec = REGISTRY.get(kind)
+        if spec is None:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if dedupe_key is not None:
+                found = conn.execute("SELECT id FROM jobs WHERE dedupe_key = ? AND status = ?",
+                                     (dedupe_key, QUEUED)).fetchone()
+                if found is not None:
+                    conn.execute("COMMIT")
+                    return found[0]
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, priority, status, max_attempts, run_after, dedupe_key, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, json.dumps(payload, ensure_ascii=False, default=str),
+                 spec.priority if priority is None else priority, QUEUED, spec.max_attempts, now + delay_s,
+                 dedupe_key, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._notify()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        r = self._conn().execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row(r) if r is not None else None
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not started; False if it is running or finished."""
+        cur = self._conn().execute("UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                                   (CANCELLED, time.time(), job_id, QUEUED))
+        return cur.rowcount == 1
+
+    def recent(self, status: Optional[str] = None, kind: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE 1 = 1"
+        params: List[Any] = []
+        if status:
+            sql += " AND status = ?"
+            params.append(status)
+        if kind:
+            sql += " AND kind = ?"
+            params.append(kind)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        return [_row(r) for r in self._conn().execute(sql, params).fetchall()]
+
+    def stats(self) -> Dict[str, Any]:
+        counts = self._conn().execute("SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status").fetchall()
+        oldest = self._conn().execute("SELECT MIN(created_at) FROM jobs WHERE status = ? AND run_after <= ?",
+                                      (QUEUED, time.time())).fetchone()[0]
+        return {
+            "path": self.path,
+            "worker": self.worker_id,
+            "running_here": bool(self._workers),
+            "workers": len(self._workers),
+            "since_start": dict(self._stats),
+            "oldest_ready_age_s": round(time.time() - oldest, 1) if oldest else None,
+            "counts": [{"kind": k, "status": s, "jobs": n} for k, s, n in counts],
+            "kinds": {k.name: {"executor": k.executor, "priority": k.priority, "max_attempts": k.max_attempts,
+                               "timeout_s": k.timeout_s, "public": k.public} for k in REGISTRY.values()},
+        }
+
+    # -------------------------------------------------------------- workers
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Take the most urgent ready job (or one whose worker's lease ran out) for this worker."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            r = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM jobs"
+                " WHERE (status = ? AND run_after <= ?) OR (status = ? AND lease_until < ?)"
+                " ORDER BY priority DESC, run_after ASC LIMIT 1",
+                (QUEUED, now, RUNNING, now),
+            ).fetchone()
+            if r is None:
+                conn.execute("COMMIT")
+                return None
+            claimed = _row(r)
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, worker = ?,"
+                " started_at = ? WHERE id = ?",
+                (RUNNING, now + JOB_LEASE_S, self.worker_id, now, claimed["id"]),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        claimed["attempts"] += 1
+        return claimed
+
+    def _finish(self, job_id: str, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, lease_until = NULL"
+            " WHERE id = ? AND worker = ?",
+            (status, json.dumps(result, ensure_ascii=False, default=str) if result is not None else None, error,
+             time.time(), job_id, self.worker_id),
+        )
+
+    def _retry_later(self, job_id: str, attempts: int, error: str) -> float:
+        delay = JOB_RETRY_BASE_S * 2 ** (attempts - 1)
+        delay += random.uniform(0, delay / 2)
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, run_after = ?, error = ?, lease_until = NULL WHERE id = ? AND worker = ?",
+            (QUEUED, time.time() + delay, error, job_id, self.worker_id),
+        )
+        return delay
+
+    def _renew(self, job_id: str) -> None:
+        self._conn().execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?",
+                             (time.time() + JOB_LEASE_S, job_id, self.worker_id, RUNNING))
+
+    def purge(self) -> int:
+        cur = self._conn().execute("DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?",
+                                   (*FINISHED, time.time() - JOB_KEEP_S))
+        return cur.rowcount
+
+    async def _execute(self, spec: JobKind, payload: Dict[str, Any]) -> Any:
+        if spec.executor == "async":
+            return await spec.handler(payload)
+        loop = asyncio.get_running_loop()
+        if spec.executor == "thread":
+            return await loop.run_in_executor(self._threads, spec.handler, payload)
+        return await loop.run_in_executor(self._processes, spec.handler, payload)
+
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(JOB_LEASE_S / 3)
+            await asyncio.to_thread(self._renew, job_id)
+
+    async def _run(self, claimed: Dict[str, Any]) -> None:
+        spec = REGISTRY.get(claimed["kind"])
+        job_id, attempts = claimed["id"], claimed["attempts"]
+        self._stats["ran"] += 1
+        if spec is None:
+            await asyncio.to_thread(self._finish, job_id, FAILED, None, f"Unknown job kind: {claimed['kind']}")
+            self._stats["failed"] += 1
+            return
+        if attempts > claimed["max_attempts"]:
+            # its previous worker died mid-run more often than the job may be retried
+            await asyncio.to_thread(self._finish, job_id, FAILED, None, claimed["error"] or "lease expired")
+            self._stats["failed"] += 1
+            return
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            with span("job.run", kind=spec.name, attempt=attempts):
+                result = await asyncio.wait_for(self._execute(spec, claimed["payload"]), spec.timeout_s)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            if attempts < claimed["max_attempts"]:
+                delay = await asyncio.to_thread(self._retry_later, job_id, attempts, error)
+                self._stats["retried"] += 1
+                log.warning("job %s (%s) attempt %d failed, retrying in %.1fs: %s", job_id, spec.name, attempts,
+                            delay, error)
+            else:
+                await asyncio.to_thread(self._finish, job_id, FAILED, None, error)
+                self._stats["failed"] += 1
+                log.error("job %s (%s) failed after %d attempts: %s", job_id, spec.name, attempts, error)
+            return
+        finally:
+            heartbeat.cancel()
+        await asyncio.to_thread(self._finish, job_id, SUCCEEDED, result)
+        self._stats["succeeded"] += 1
+
+    async def _worker(self) -> None:
+        assert self._wake is not None
+        while True:
+            try:
+                claimed = await asyncio.to_thread(self._claim)
+            except sqlite3.Error as e:
+                log.warning("job queue unavailable: %s", e)
+                claimed = None
+            if claimed is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), JOB_POLL_S)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(claimed)
+
+    def _notify(self) -> None:
+        # enqueue may be called from a sync endpoint's thread
+        if self._loop is not None and self._wake is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    def start(self) -> None:
+        """Start the worker pool on the running loop (from the app lifespan)."""
+        if not JOBS or self._workers:
+            return
+        _load_handlers()
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._threads = ThreadPoolExecutor(JOB_THREADS, thread_name_prefix="job")
+        if any(k.executor == "process" for k in REGISTRY.values()):
+            self._processes = ProcessPoolExecutor(JOB_PROCESSES)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(JOB_WORKERS)]
+        purged = self.purge()
+        log.info("job workers started: %d (%s), purged %d old jobs", JOB_WORKERS, self.worker_id, purged)
+
+    def _requeue_mine(self) -> int:
+        cur = self._conn().execute(
+            "UPDATE jobs SET status = ?, attempts = attempts - 1, lease_until = NULL WHERE worker = ? AND status = ?",
+            (QUEUED, self.worker_id, RUNNING))
+        return cur.rowcount
+
+    async def stop(self) -> None:
+        """Stop the workers; jobs cut short go back to the queue without using up an attempt."""
+        if not self._workers:
+            return
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        requeued = self._requeue_mine()
+        if requeued:
+            log.info("requeued %d unfinished jobs", requeued)
+        for pool in (self._threads, self._processes):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._threads = self._processes = None
+        self._loop = self._wake = None
+
+
+def _load_handlers() -> None:
+    # registering the handlers imports nothing heavy; each handler imports its stack when it first runs
+    import jobs.handlers  # noqa: F401
+
+
+job_queue = JobQueue()
@@ -0,0 +1,61 @@
+import asyncio
+import time
+from typing import Any, Dict, Optional
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from . import handlers  # noqa: F401  registers the job kinds
+from .job_queue import FINISHED, REGISTRY, job_queue
+
+router = APIRouter()
+
+WAIT_POLL_S = 0.2
+
+
+class JobRequest(BaseModel):
+    kind: str
+    payload: Dict[str, Any] = {}
+    priority: Optional[int] = None
+
+
+def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: job[k] for k in ("id", "kind", "status", "attempts", "max_attempts", "result", "error",
+                                "created_at", "started_at", "finished_at")}
+
+
+def _get(job_id: str) -> Dict[str, Any]:
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("", status_code=202)
+def submit_job(request: JobRequest):
+    # only kinds registered with public=True; the rest are queued by the server itself
+    kind = REGISTRY.get(request.kind)
+    if kind is None or not kind.public:
+        raise HTTPException(status_code=400, detail=f"Unknown job kind: {request.kind}")
+    job_id = job_queue.enqueue(request.kind, request.payload, priority=request.priority)
+    return {"id": job_id, "status": "queued"}
+
+@router.get("/{job_id}")
+def get_job(job_id: str):
+    return _public(_get(job_id))
+
+@router.get("/{job_id}/wait")
+async def wait_for_job(job_id: str, timeout: float = Query(30.0, gt=0, le=120)):
+    # long poll: returns as soon as the job finishes, or its current state after `timeout`
+    deadline = time.monotonic() + timeout
+    while True:
+        job = await run_in_threadpool(_get, job_id)
+        if job["status"] in FINISHED or time.monotonic() >= deadline:
+            return _public(job)
+        await asyncio.sleep(WAIT_POLL_S)
+
+@router.delete("/{job_id}")
+def cancel_job(job_id: str):
+    _get(job_id)
+    if not job_queue.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job already started")
+    return {"ok": True}
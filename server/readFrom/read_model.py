@@ -2,7 +2,12 @@
 from dataclasses import dataclass
 from typing import List, Optional, Dict, Any
 import json
-from common.db import get_conn
+from common.db import get_read_conn
+from common.cache import memoize
+from common.versioning import (
+    product_scope,
+    CATALOG, CATEGORIES, BRANDS, PROFIT, CATEGORY_VALUE, MONTHLY_PROFIT,
+)
 
 @dataclass
 class ProductRead:
@@ -24,6 +29,7 @@ class ReadModel:
     Model that encapsulates data + DB access for read side (classic MVC).
     """
     @staticmethod
+    @memoize(ttl_s=30, stale_s=30, tags=lambda **_: (CATALOG,))
     def list_products(*,query: Optional[str],category: Optional[str],brand: Optional[str]) -> List[ProductRead]:
         sql = [
             "SELECT product_id, name, current_price, quantity, is_on_promotion",
@@ -46,7 +52,7 @@ class ReadModel:
             params.extend([like, like])
 
 
-        with get_conn() as conn:
+        with get_read_conn() as conn:
             cur = conn.cursor()
             cur.execute("\n".join(sql), params)
             rows = cur.fetchall()
@@ -63,8 +69,9 @@ class ReadModel:
         return out
     
     @staticmethod
+    @memoize(ttl_s=60, stale_s=60, tags=lambda product_id: (product_scope(product_id),), max_entries=2048)
     def get_product(product_id: str) -> Optional[ProductRead]:
-        with get_conn() as conn:
+        with get_read_conn() as conn:
             cur = conn.cursor()
             cur.execute(
                 """
@@ -94,8 +101,9 @@ class ReadModel:
         )
 
     @staticmethod
+    @memoize(ttl_s=300, stale_s=600, tags=lambda: (CATEGORIES,))
     def distinct_categories() -> List[str]:
-        with get_conn() as conn:
+        with get_read_conn() as conn:
             cur = conn.cursor()
             cur.execute("""
                 SELECT DISTINCT Category
@@ -106,8 +114,9 @@ class ReadModel:
             return [r[0] for r in cur.fetchall()]
 
     @staticmethod
+    @memoize(ttl_s=300, stale_s=600, tags=lambda: (BRANDS,))
     def distinct_brands() -> List[str]:
-        with get_conn() as conn:
+        with get_read_conn() as conn:
             cur = conn.cursor()
             cur.execute("""
                 SELECT DISTINCT Brand
@@ -119,10 +128,11 @@ class ReadModel:
 
 
     @staticmethod
+    @memoize(ttl_s=60, stale_s=60, tags=lambda product_id: (product_scope(product_id),))
     def product_events(product_id: str) -> List[Dict[str, Any]]:
         events: List[Dict[str, Any]] = []
 
-        with get_conn() as conn:
+        with get_read_conn() as conn:
             cur = conn.cursor()
             cur.execute(
                 """
@@ -182,9 +192,10 @@ class ReadModel:
         return events
 
     @staticmethod
+    @memoize(ttl_s=300, stale_s=600, tags=lambda: (PROFIT,))
     def get_products_profit() -> List[Dict[str, Any]]:
         profits: List[Dict[str, Any]] = []
-        with get_conn() as conn:
+        with get_read_conn() as conn:
             cur = conn.cursor()
             cur.execute(
                 """
@@ -202,9 +213,10 @@ class ReadModel:
         return profits
     
     @staticmethod
+    @memoize(ttl_s=300, stale_s=600, tags=lambda: (CATEGORY_VALUE,))
     def get_products_category_value() -> List[Dict[str, Any]]:
         category_values: List[Dict[str, Any]] = []
-        with get_conn() as conn:
+        with get_read_conn() as conn:
             cur = conn.cursor()
             cur.execute(
                 """
@@ -227,9 +239,10 @@ class ReadModel:
         return category_values
     
     @staticmethod
+    @memoize(ttl_s=300, stale_s=600, tags=lambda: (MONTHLY_PROFIT,))
     def get_products_total_profit_per_month() -> List[Dict[str, Any]]:
         monthly_profits: List[Dict[str, Any]] = []
-        with get_conn() as conn:
+        with get_read_conn() as conn:
             cur = conn.cursor()
             cur.execute(
                 """
@@ -264,10 +277,25 @@ class ReadModel:
         return monthly_profits
     
     @staticmethod
+    @memoize(ttl_s=300, stale_s=300, tags=lambda product_id: (product_scope(product_id),), max_entries=2048)
     def get_product_image(product_id: str):
-        with get_conn() as conn:
+        with get_read_conn() as conn:
             cur = conn.cursor()
             cur.execute("SELECT image_url FROM dbo.readProduct WHERE product_id = ?", (product_id,))
             row = cur.fetchone()
 
-        return row[0].strip() if row and row[0] and str(row[0]).strip() else None
\ No newline at end of file
+        return row[0].strip() if row and row[0] and str(row[0]).strip() else None
+
+    @staticmethod
+    def warm_up() -> None:
+        """Run each read statement once so the catalog lists and their query plans are warm before the first user."""
+        ReadModel.list_products(query=None, category=None, brand=None)
+        ReadModel.distinct_categories()
+        ReadModel.distinct_brands()
+        # per-product statements only need compiling: an id that never exists is enough
+        ReadModel.get_product("")
+        ReadModel.product_events("")
+        ReadModel.get_product_image("")
+        ReadModel.get_products_profit()
+        ReadModel.get_products_category_value()
+        ReadModel.get_products_total_profit_per_month()
@@ -1,48 +1,84 @@
 """FastAPI views (endpoints) for QUERIES only."""
-from fastapi import APIRouter, HTTPException, Query
-from typing import List , Optional 
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from typing import List , Optional
 from .read_controller import ReadController
 from .read_model import ProductRead
+from common.fast_json import fast_response
+from common.wire import negotiate, variant_of, columnar_response, flatten_events
+from common.versioning import (
+    not_modified, product_scope,
+    CATALOG, CATEGORIES, BRANDS, PROFIT, CATEGORY_VALUE, MONTHLY_PROFIT,
+)
 
 router = APIRouter()
 controller = ReadController()
 
+
+def _rows_response(rows, fmt, response: Response):
+    """Column batches when the client accepts Arrow/msgpack, JSON otherwise."""
+    response.headers["Vary"] = "Accept"
+    return columnar_response(rows, fmt, response) if fmt else fast_response(rows, response)
+
+
 @router.get("/products", response_model=List[ProductRead])
-def list_products(q: Optional[str] = Query(None, alias="q"), category: Optional[str] = None, brand: Optional[str] = None):
-    return controller.list_products(query=q, category=category, brand=brand)
+def list_products(request: Request, response: Response, q: Optional[str] = Query(None, alias="q"), category: Optional[str] = None, brand: Optional[str] = None):
+    fmt = negotiate(request)
+    if (cached := not_modified(request, response, CATALOG, variant=variant_of(fmt))):
+        return cached
+    return _rows_response(controller.list_products(query=q, category=category, brand=brand), fmt, response)
 
 @router.get("/products/{product_id}", response_model=ProductRead)
-def get_product(product_id: str):
+def get_product(request: Request, response: Response, product_id: str):
+    if (cached := not_modified(request, response, product_scope(product_id))):
+        return cached
     prod = controller.get_product(product_id)
     if not prod:
         raise HTTPException(status_code=404, detail="Product not found")
-    return prod
+    return fast_response(prod, response)
 
 @router.get("/products/distinct/categories", response_model=List[str])
-def distinct_categories():
-    return controller.distinct_categories()
+def distinct_categories(request: Request, response: Response):
+    if (cached := not_modified(request, response, CATEGORIES)):
+        return cached
+    return fast_response(controller.distinct_categories(), response)
 
 @router.get("/products/distinct/brands", response_model=List[str])
-def distinct_brands():
-    return controller.distinct_brands()
+def distinct_brands(request: Request, response: Response):
+    if (cached := not_modified(request, response, BRANDS)):
+        return cached
+    return fast_response(controller.distinct_brands(), response)
 
 @router.get("/products/{product_id}/events")
-def get_product_events(product_id: str):
-    return controller.product_events(product_id)
+def get_product_events(request: Request, response: Response, product_id: str):
+    fmt = negotiate(request)
+    if (cached := not_modified(request, response, product_scope(product_id), variant=variant_of(fmt))):
+        return cached
+    events = controller.product_events(product_id)
+    return _rows_response(flatten_events(events) if fmt else events, fmt, response)
 
 @router.get("/products_profit")
-def get_products_profit():
-    return controller.get_products_profit()
+def get_products_profit(request: Request, response: Response):
+    fmt = negotiate(request)
+    if (cached := not_modified(request, response, PROFIT, variant=variant_of(fmt))):
+        return cached
+    return _rows_response(controller.get_products_profit(), fmt, response)
 
 @router.get("/products_category_value")
-def get_products_category_value():
-    return controller.get_products_category_value()
+def get_products_category_value(request: Request, response: Response):
+    fmt = negotiate(request)
+    if (cached := not_modified(request, response, CATEGORY_VALUE, variant=variant_of(fmt))):
+        return cached
+    return _rows_response(controller.get_products_category_value(), fmt, response)
 
 @router.get("/products_total_profit_per_month")
-def get_products_total_profit_per_month():
-    return controller.get_products_total_profit_per_month()
+def get_products_total_profit_per_month(request: Request, response: Response):
+    fmt = negotiate(request)
+    if (cached := not_modified(request, response, MONTHLY_PROFIT, variant=variant_of(fmt))):
+        return cached
+    return _rows_response(controller.get_products_total_profit_per_month(), fmt, response)
 
 @router.get("/get_image/{product_id}")
-def get_product_image(product_id: str):
-    return controller.get_product_image(product_id)
-   
\ No newline at end of file
+def get_product_image(request: Request, response: Response, product_id: str):
+    if (cached := not_modified(request, response, product_scope(product_id))):
+        return cached
+    return fast_response(controller.get_product_image(product_id), response)
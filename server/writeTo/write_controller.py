@@ -4,10 +4,12 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from typing import Optional, Dict, Any
 from .write_model import Event, EventType, Product, writeModel
+from common.tracing import trace_methods
 
 
 
 
+@trace_methods
 class writeController:
 
     def ensure_valid_for_type(self, ev: Event) -> None:
@@ -4,11 +4,17 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, TYPE_CHECKING
 from datetime import datetime, timezone
 
-from common.db import get_conn 
-import pyodbc
+if TYPE_CHECKING:  # imported lazily by common.db at first connect
+    import pyodbc
+
+from common.db import get_write_conn
+from common.versioning import (
+    data_versions, product_scope,
+    CATALOG, CATEGORIES, BRANDS, PROFIT, CATEGORY_VALUE, MONTHLY_PROFIT,
+)
 
 class EventType(str, Enum):
     CREATE = "CREATE"
@@ -19,6 +25,17 @@ class EventType(str, Enum):
     DELETE = "DELETE"
     NOTE_ADDED = "NOTE_ADDED"
 
+# Read-side aggregates each event type can change, on top of the product itself.
+AFFECTED_SCOPES = {
+    EventType.CREATE: (CATALOG, CATEGORIES, BRANDS, PROFIT, CATEGORY_VALUE),
+    EventType.UPDATE: (CATALOG, CATEGORIES, BRANDS, PROFIT, CATEGORY_VALUE),
+    EventType.PRICE_CHANGE: (CATALOG, CATEGORY_VALUE),
+    EventType.SALE: (CATALOG, PROFIT, CATEGORY_VALUE, MONTHLY_PROFIT),
+    EventType.PURCHASE: (CATALOG, CATEGORY_VALUE),
+    EventType.DELETE: (CATALOG, CATEGORIES, BRANDS, PROFIT, CATEGORY_VALUE),
+    EventType.NOTE_ADDED: (),
+}
+
 def utcnow() -> datetime:
     return datetime.now(timezone.utc).replace(tzinfo=None)  
 
@@ -70,7 +87,7 @@ class writeModel:
 
     @classmethod
     def create_product(self, p: Product, ev: Event) -> None:
-        with get_conn() as cn:
+        with get_write_conn() as cn:
             cur = cn.cursor()
             # Insert Event
             self._insert_event(cur, ev)
@@ -92,10 +109,11 @@ class writeModel:
             p.image_url, p.note, inventory_value, total_profit)
        
             cn.commit()
+            self._committed(ev)
 
     @classmethod
     def update_product(self, fields: Dict[str, Any], ev: Event) -> None:
-        with get_conn() as cn:
+        with get_write_conn() as cn:
             cur = cn.cursor()
             self._insert_event(cur, ev)
             # Build UPDATE for readProduct dynamically
@@ -111,12 +129,13 @@ class writeModel:
             params.append(ev.product_id)
             cur.execute(sql, params)
             cn.commit()
+            self._committed(ev)
         
 
     @classmethod
     def change_price(self,ev: Event) -> None:
 
-        with get_conn() as cn:
+        with get_write_conn() as cn:
             cur = cn.cursor()
             self._insert_event(cur, ev)
 
@@ -139,10 +158,11 @@ class writeModel:
             params.append(ev.product_id)
             cur.execute(sql, params)
             cn.commit()
+            self._committed(ev)
     
     @classmethod
     def get_product_quantity_and_profit(self, product_id: str):
-        with get_conn() as cn:
+        with get_write_conn() as cn:
             cur = cn.cursor()
             cur.execute("SELECT quantity, total_profit FROM readProduct WHERE product_id = ?", product_id)
             row = cur.fetchone()
@@ -156,7 +176,7 @@ class writeModel:
 
     @classmethod
     def get_product_quantity_cost_total_profit(self, product_id: str):
-        with get_conn() as cn:
+        with get_write_conn() as cn:
             cur = cn.cursor()
             cur.execute("SELECT quantity, cost_price, total_profit FROM readProduct WHERE product_id = ?", product_id)
             row = cur.fetchone()
@@ -171,7 +191,7 @@ class writeModel:
     @classmethod
     def purchase(self,ev: Event) -> None:
 
-        with get_conn() as cn:
+        with get_write_conn() as cn:
             cur = cn.cursor()
             self._insert_event(cur, ev)
 
@@ -184,12 +204,13 @@ class writeModel:
             ''', ev.quantity_after, ev.purchase_unit_cost, ev.quantity_after, ev.purchase_unit_cost, ev.occurred_at_utc, ev.product_id)
 
             cn.commit()
+            self._committed(ev)
 
 
     @classmethod
     def sale(self, ev: Event, new_total_profit: float) -> None:
 
-        with get_conn() as cn:
+        with get_write_conn() as cn:
             cur = cn.cursor()
             self._insert_event(cur, ev)
 
@@ -201,10 +222,11 @@ class writeModel:
                 WHERE product_id = ?
             ''', ev.quantity_after, new_total_profit, inventory_value, ev.product_id)
             cn.commit()
+            self._committed(ev)
 
     @classmethod
     def set_promotion(self, ev: Event) -> None:
-        with get_conn() as cn:
+        with get_write_conn() as cn:
             cur = cn.cursor()
             self._insert_event(cur, ev)
             cur.execute('''
@@ -213,11 +235,12 @@ class writeModel:
                 WHERE product_id = ?
             ''', 1 if ev.is_on_promotion else 0, ev.promotion_discount_percent, ev.product_id)
             cn.commit()
+            self._committed(ev)
     
     @classmethod
     def add_note(self, ev: Event) -> None:
 
-        with get_conn() as cn:
+        with get_write_conn() as cn:
             cur = cn.cursor()
             self._insert_event(cur, ev)
             cur.execute('''
@@ -225,14 +248,27 @@ class writeModel:
                 WHERE product_id = ?
             ''', ev.note, ev.product_id)
             cn.commit()
+            self._committed(ev)
        
     @classmethod
     def delete_product(self, ev: Event) -> None:
-        with get_conn() as cn:
+        with get_write_conn() as cn:
             cur = cn.cursor()
             self._insert_event(cur, ev)
             cur.execute("DELETE FROM readProduct WHERE product_id = ?", ev.product_id)
             cn.commit()
+            self._committed(ev)
+
+    @classmethod
+    def warm_up(self) -> None:
+        # the lookups every sale/purchase starts with; the INSERT/UPDATEs can't run without writing
+        self.get_product_quantity_and_profit("")
+        self.get_product_quantity_cost_total_profit("")
+
+    @staticmethod
+    def _committed(ev: Event) -> None:
+        # Only after commit: a reader may then see an old ETag with new data, never the reverse.
+        data_versions.bump(product_scope(ev.product_id), *AFFECTED_SCOPES[ev.event_type])
 
     @staticmethod
     def _insert_event(cur: pyodbc.Cursor, ev: Event) -> None:
@@ -253,7 +289,7 @@ class writeModel:
 
     @classmethod
     def upload_image(self, ev: Event) -> None:
-        with get_conn() as cn:
+        with get_write_conn() as cn:
             cur = cn.cursor()
             self._insert_event(cur, ev)
             cur.execute('''
@@ -262,3 +298,4 @@ class writeModel:
                 WHERE product_id = ?
             ''', ev.image_url, ev.product_id)
             cn.commit()
+            self._committed(ev)
@@ -3,20 +3,41 @@
 # Minimal "usage example" (not a GUI). Acts as a stub demonstrating the controller API.
 # Run this after setting SMARTMARKET_ODBC env var to your pyodbc SQL Server connection string.
 from __future__ import annotations
+import logging
+import os
 from typing import Dict, Any
 from .write_model import Product
 from .write_controller import writeController
+from jobs.job_queue import job_queue
 from fastapi import APIRouter, HTTPException
 from typing import Optional
 from fastapi import Body
 
+NOTE_ANALYZE_ON_WRITE = os.getenv("NOTE_ANALYZE_ON_WRITE", "1") != "0"
+
+log = logging.getLogger("smartmarket.write")
+
 router = APIRouter()
 controller = writeController()
 
+
+def analyze_note_later(product_id: str) -> None:
+    # sentiment, tag and summary are computed by a job worker and stored next to
+    # the note, so Analyze on the pricing page is a lookup (chat.note_digest)
+    if not NOTE_ANALYZE_ON_WRITE:
+        return
+    try:
+        job_queue.enqueue("note.analyze", {"product_id": product_id}, dedupe_key=f"note.analyze:{product_id}")
+    except Exception as e:
+        # the write is committed; the periodic note.digest job picks the note up instead
+        log.warning("could not queue note.analyze for %s: %s", product_id, e)
+
 @router.post("/product/create")
 def create_product(dto: Product):
     try:
         controller.create_product(dto)
+        if dto.note:
+            analyze_note_later(dto.product_id)
         return {"ok": True}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -25,6 +46,8 @@ def create_product(dto: Product):
 def update_product(product_id: str, fields: Dict[str, Any]):
     try:
         controller.update_product(product_id, fields)
+        if fields.get("note"):
+            analyze_note_later(product_id)
         return {"ok": True}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -49,6 +72,7 @@ def sale_product(product_id: str, quantity: int, sale_unit_price: float, sale_un
 def add_note(product_id: str, note: str):
     try:
         controller.add_note(product_id, note)
+        analyze_note_later(product_id)
         return {"ok": True}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))